@@ -30,6 +30,10 @@ DEBUG = True
 
 ALLOWED_HOSTS = []
 
+# The addresses or networks of the collectors that may read /metrics. The
+# requests passed by a proxy are refused, since they come from its address.
+METRICS_ALLOWED_IPS = ["127.0.0.1", "::1"]
+
 
 # Application definition
 
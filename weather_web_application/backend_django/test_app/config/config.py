@@ -9,6 +9,13 @@ CONFIG_DIR = Path(BASE_DIR, "config")
 
 LOGS_DIR = Path(BASE_DIR, "logs")
 LOGS_DIR.mkdir(parents=True, exist_ok=True)
+# The reports of the profiled requests (see profiling.py). Only the newest
+# MAX_PROFILES reports are kept.
+PROFILES_DIR = Path(LOGS_DIR, "profiles")
+MAX_PROFILES = 20
+
+CACHE_DIR = Path(BASE_DIR, "cache")
+CACHE_DIR.mkdir(parents=True, exist_ok=True)
 
 
 logging_config = {
@@ -47,6 +54,11 @@ logging_config = {
             "backupCount": 5,
         },
     },
+    "loggers": {
+        # The stage timings of the weather pipeline (ml_part/instrumentation.py).
+        # A level above INFO switches them off.
+        "pipeline": {"level": "INFO"},
+    },
     "root": {
         "level": "INFO",
         "handlers": ["console", "info", "error"],
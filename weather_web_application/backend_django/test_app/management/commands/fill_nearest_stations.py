@@ -0,0 +1,77 @@
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from ...ml_part.catalog import catalog
+from ...ml_part.spatial import SpatialIndex
+from ...models import City, Station
+
+
+class Command(BaseCommand):
+    help = (
+        "Fill the nearest stations of the cities. Only the cities whose "
+        "nearest station has changed are updated, so the command can be "
+        "rerun after new cities or stations are added."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--only-missing",
+            action="store_true",
+            help="Process only the cities without a nearest station.",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="The number of cities updated with a single query.",
+        )
+
+    def handle(self, *args, **options):
+        stations = np.array(
+            list(Station.objects.values_list("id", "lat", "lng")), dtype=float
+        ).reshape(-1, 3)
+        if len(stations) == 0:
+            raise CommandError("There are no stations in the database.")
+
+        cities = City.objects.all()
+        if options["only_missing"]:
+            cities = cities.filter(nearest_station__isnull=True)
+        cities = np.array(
+            [
+                (id_, lat, lng, -1 if station_id is None else station_id)
+                for id_, lat, lng, station_id in cities.values_list(
+                    "id", "lat", "lng", "nearest_station_id"
+                ).iterator()
+            ],
+            dtype=float,
+        ).reshape(-1, 4)
+
+        # We find the nearest stations of all cities with a single query
+        # to the ball tree instead of scanning the stations for every city
+        inds, _ = SpatialIndex(stations[:, 1], stations[:, 2]).query_nearest(
+            cities[:, 1], cities[:, 2]
+        )
+        station_ids = stations[inds, 0].astype(int)
+        is_changed = station_ids != cities[:, 3].astype(int)
+
+        changed_cities = [
+            City(id=int(id_), nearest_station_id=int(station_id))
+            for id_, station_id in zip(
+                cities[is_changed, 0], station_ids[is_changed]
+            )
+        ]
+        with transaction.atomic():
+            City.objects.bulk_update(
+                changed_cities,
+                ["nearest_station"],
+                batch_size=options["batch_size"],
+            )
+        # Bulk updates do not send the signals that invalidate the catalog
+        catalog.invalidate(City)
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Updated {len(changed_cities)} of {len(cities)} cities."
+            )
+        )
@@ -0,0 +1,20 @@
+# Generated by Django 4.2.1 on 2026-10-18 18:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("test_app", "0003_alter_city_options"),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name="city",
+            options={},
+        ),
+        migrations.AddIndex(
+            model_name="city",
+            index=models.Index(fields=["lat", "lng"], name="city_coords_idx"),
+        ),
+    ]
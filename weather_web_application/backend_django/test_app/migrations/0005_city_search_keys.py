@@ -0,0 +1,41 @@
+# Generated by Django 4.2.1 on 2026-10-18 18:55
+
+from django.db import migrations, models
+from test_app.ml_part.search import normalize
+
+
+def set_search_keys(apps, schema_editor):
+    City = apps.get_model("test_app", "City")
+    cities = list(City.objects.only("name", "country"))
+    for city in cities:
+        city.search_name = normalize(city.name)
+        city.search_country = normalize(city.country)
+    City.objects.bulk_update(
+        cities, ["search_name", "search_country"], batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("test_app", "0004_city_coords_idx"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="city",
+            name="search_country",
+            field=models.CharField(default="", editable=False, max_length=50),
+        ),
+        migrations.AddField(
+            model_name="city",
+            name="search_name",
+            field=models.CharField(default="", editable=False, max_length=50),
+        ),
+        migrations.RunPython(set_search_keys, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="city",
+            index=models.Index(
+                fields=["search_name", "search_country"], name="city_search_idx"
+            ),
+        ),
+    ]
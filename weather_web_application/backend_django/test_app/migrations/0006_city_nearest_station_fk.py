@@ -0,0 +1,22 @@
+# Generated by Django 4.2.1 on 2026-10-18 18:57
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("test_app", "0005_city_search_keys"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="city",
+            name="nearest_station",
+            field=models.ForeignKey(
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                to="test_app.station",
+            ),
+        ),
+    ]
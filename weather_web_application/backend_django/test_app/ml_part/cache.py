@@ -0,0 +1,567 @@
+import io
+import json
+import os
+import shutil
+import threading
+import weakref
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import Optional, Union
+
+import numpy as np
+import pandas as pd
+
+from ..config.config import CACHE_DIR
+from .dtypes import MEASUREMENT_DTYPE, STATION_DTYPE
+
+try:
+    import fcntl
+except ImportError:  # Windows, where only the threads are synchronized
+    fcntl = None
+
+
+def _atomic_write(path: Union[Path, str], data: Union[str, bytes]) -> None:
+    """Writing a file into a temporary one first and replacing it, so that
+    concurrent workers never read a partially written file"""
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temp_path, "wb" if isinstance(data, bytes) else "w") as file:
+        file.write(data)
+    os.replace(temp_path, path)
+
+
+class NOAACache:
+    """
+    On-disk per-station cache of NOAA daily summaries
+
+    ...
+
+    Every station is kept in two files: '<station>.csv.gz' with its rows in
+    the same format as the NOAA API returns them and '<station>.json' with the
+    covered date range, the last observed date and the data types. The range
+    is stored separately because stations can have no observations for some
+    days, and such days must not be requested again. The days after the last
+    observed date are requested again though, since the observations can be
+    published later (up to 'max_delay_days').
+
+    Parameters
+    ----------
+    cache_dir : Path | str, default=CACHE_DIR / 'noaa'
+        The directory where the station files are stored.
+    refresh_days : int, default=3
+        The number of the last observed days that are requested again, since
+        NOAA can revise observations for recent days.
+    max_delay_days : int, default=30
+        The number of the last cached days without observations that are
+        requested again, since NOAA can publish observations with a delay.
+
+    Methods
+    -------
+    get_fetch_start -> str | None:
+        Getting the first date that has to be requested for a station or None
+        if the cache covers the whole date range.
+    read_csv -> DataFrame:
+        Parsing NOAA rows from a path or a file-like object with compact
+        dtypes.
+    read -> DataFrame:
+        Reading the cached rows of a station within a date range.
+    update -> None:
+        Merging the requested rows of a station into the cache.
+    """
+
+    TIME_FORMAT = "%Y-%m-%d"
+    KEY_COLUMNS = ["STATION", "DATE"]
+    MEASUREMENT_DTYPE = MEASUREMENT_DTYPE
+
+    def __init__(
+        self,
+        cache_dir: Union[Path, str] = Path(CACHE_DIR, "noaa"),
+        refresh_days: int = 3,
+        max_delay_days: int = 30,
+    ):
+        self.cache_dir = Path(cache_dir)
+        self.refresh_days = refresh_days
+        self.max_delay_days = max_delay_days
+
+    def _data_path(self, station_id: str) -> Path:
+        return Path(self.cache_dir, f"{station_id}.csv.gz")
+
+    def _meta_path(self, station_id: str) -> Path:
+        return Path(self.cache_dir, f"{station_id}.json")
+
+    def _read_meta(self, station_id: str) -> Optional[dict]:
+        meta_path = self._meta_path(station_id)
+        if not (meta_path.exists() and self._data_path(station_id).exists()):
+            return None
+        with open(meta_path, "r") as file:
+            return json.load(file)
+
+    def _is_covered(
+        self, meta: Optional[dict], data_types, start_date: str
+    ) -> bool:
+        """Checking if the cached data can be extended instead of replaced"""
+        return (
+            meta is not None
+            and meta["start_date"] <= start_date
+            and set(data_types) <= set(meta["data_types"])
+        )
+
+    def get_fetch_start(
+        self, station_id: str, data_types, start_date: str, end_date: str
+    ) -> Optional[str]:
+        meta = self._read_meta(station_id)
+        if not self._is_covered(meta, data_types, start_date):
+            return start_date
+        if meta["end_date"] >= end_date:
+            return None
+
+        # The last observed days and the days after them are requested again
+        # to pick up late observations. The stations that stopped observing
+        # are not requested again beyond 'max_delay_days'.
+        # The caches written before the last observed date was stored are
+        # anchored to their end date
+        last_observed = (
+            meta.get("last_observed", meta["end_date"]) or meta["start_date"]
+        )
+        fetch_start = max(
+            datetime.strptime(last_observed, self.TIME_FORMAT)
+            - timedelta(days=self.refresh_days - 1),
+            datetime.strptime(meta["end_date"], self.TIME_FORMAT)
+            - timedelta(days=self.max_delay_days - 1),
+        )
+        return max(start_date, fetch_start.strftime(self.TIME_FORMAT))
+
+    @classmethod
+    def read_csv(cls, filepath_or_buffer, data_types) -> pd.DataFrame:
+        """Parsing the rows incrementally, so that neither the whole text nor
+        object-typed columns are kept in memory"""
+        columns = cls.KEY_COLUMNS + list(data_types)
+        try:
+            data = pd.read_csv(
+                filepath_or_buffer,
+                dtype={
+                    "STATION": STATION_DTYPE,
+                    **{
+                        data_type: cls.MEASUREMENT_DTYPE
+                        for data_type in data_types
+                    },
+                },
+                parse_dates=["DATE"],
+            )
+        except pd.errors.EmptyDataError:  # There are no rows at all
+            data = pd.DataFrame(columns=columns)
+        return data
+
+    def read(
+        self, station_id: str, data_types, start_date: str, end_date: str
+    ) -> pd.DataFrame:
+        columns = self.KEY_COLUMNS + list(data_types)
+        if self._read_meta(station_id) is None:
+            return pd.DataFrame(columns=columns)
+
+        data = self.read_csv(self._data_path(station_id), data_types)
+        data = data[(data["DATE"] >= start_date) & (data["DATE"] <= end_date)]
+        return data.reindex(columns=columns)
+
+    def update(
+        self,
+        station_id: str,
+        data_types,
+        start_date: str,
+        end_date: str,
+        fetch_start: str,
+        station_data: pd.DataFrame,
+    ) -> None:
+        meta = self._read_meta(station_id)
+        station_data = station_data.reindex(
+            columns=self.KEY_COLUMNS + list(data_types)
+        )
+        station_data["DATE"] = pd.to_datetime(station_data["DATE"])
+        if fetch_start == start_date and not self._is_covered(
+            meta, data_types, start_date
+        ):
+            # The whole range was requested, so the old data is replaced
+            data = station_data
+            meta = {"start_date": start_date, "data_types": list(data_types)}
+        else:
+            # The requested rows take precedence, and the cached data types
+            # that were not requested this time are kept
+            cached_data = self.read_csv(
+                self._data_path(station_id), meta["data_types"]
+            )
+            data = (
+                station_data.set_index("DATE")
+                .combine_first(cached_data.set_index("DATE"))
+                .reset_index()
+            )
+        meta["end_date"] = max(meta.get("end_date", end_date), end_date)
+
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        data = data.sort_values("DATE")
+        # The days without any value are not observed
+        observed = data["DATE"][data[list(data_types)].notna().any(axis=1)]
+        meta["last_observed"] = (
+            observed.iloc[-1].strftime(self.TIME_FORMAT)
+            if len(observed) > 0
+            else None
+        )
+        buffer = io.BytesIO()
+        data.to_csv(buffer, index=False, compression="gzip")
+        _atomic_write(self._data_path(station_id), buffer.getvalue())
+        _atomic_write(self._meta_path(station_id), json.dumps(meta))
+
+
+class ERA5Store:
+    """
+    Columnar on-disk store of daily ERA5 data for one location and one set of
+    variables
+
+    ...
+
+    The store is a directory with a flat float32 file per variable, a uint8
+    file that marks the days obtained from the forecast endpoint and
+    'meta.json' with the first date. Rows are consecutive days, so the files
+    are only appended to and can be memory-mapped by readers. Forecast days
+    always follow the archive days, so they are replaced by truncating the
+    files once the archive has data for them. The rows are mapped to dates by
+    their positions, so a store must be changed by one thread of one process
+    at a time (see lock()).
+
+    Parameters
+    ----------
+    loc_coords : tuple[float, float]
+        Coordinates of the location.
+    dataset_type : str
+        'daily' or 'hourly' depending on the endpoint parameter.
+    columns : list[str]
+        Names of the stored variables.
+    store_dir : Path | str, default=CACHE_DIR / 'era5'
+        The directory where the stores are kept.
+
+    Methods
+    -------
+    lock -> contextmanager:
+        Locking the store for the threads and the processes (workers).
+    get_fetch_start -> str | None:
+        Getting the first date that has to be requested or None if the stored
+        data can be used as is.
+    read -> DataFrame:
+        Reading the stored days within a date range.
+    update -> None:
+        Replacing the forecast days and appending the requested days.
+    """
+
+    TIME_FORMAT = "%Y-%m-%d"
+    ARCHIVE, FORECAST = 0, 1
+    SOURCE_FILE = "source.u1"
+
+    # Only one thread at a time may change a store. The locks are kept only
+    # while the stores of a location exist, so they do not pile up for every
+    # location ever requested.
+    _locks = weakref.WeakValueDictionary()
+    _locks_lock = threading.Lock()
+
+    def __init__(
+        self,
+        loc_coords: tuple[float, float],
+        dataset_type: str,
+        columns: list[str],
+        store_dir: Union[Path, str] = Path(CACHE_DIR, "era5"),
+    ):
+        lat, lng = loc_coords
+        self.columns = list(columns)
+        name = f"{lat:.4f}_{lng:.4f}_{dataset_type}_" + "-".join(
+            sorted(self.columns)
+        )
+        self.path = Path(store_dir, name)
+        # The lock file is kept outside the store, which can be removed
+        self.lock_path = Path(store_dir, f"{name}.lock")
+        with self._locks_lock:
+            self._thread_lock = self._locks.setdefault(
+                str(self.path), threading.Lock()
+            )
+
+    @contextmanager
+    def lock(self):
+        """Holding the lock from get_fetch_start() to update(), so that
+        several workers do not append the same days"""
+        with self._thread_lock:
+            self.lock_path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.lock_path, "a") as file:
+                if fcntl is not None:
+                    # The lock is released when the file is closed
+                    fcntl.flock(file, fcntl.LOCK_EX)
+                yield
+
+    def _column_path(self, column: str) -> Path:
+        return Path(self.path, f"{column}.f4")
+
+    def _read_meta(self) -> Optional[dict]:
+        meta_path = Path(self.path, "meta.json")
+        if not meta_path.exists():
+            return None
+        with open(meta_path, "r") as file:
+            return json.load(file)
+
+    def _write_meta(self, meta: dict) -> None:
+        _atomic_write(Path(self.path, "meta.json"), json.dumps(meta))
+
+    def _load(self, path: Path, dtype) -> np.ndarray:
+        if not path.exists() or path.stat().st_size == 0:
+            return np.empty(0, dtype=dtype)
+        return np.memmap(path, dtype=dtype, mode="r")
+
+    def _num_rows(self) -> tuple[int, int]:
+        """Getting the number of all and archive days"""
+        source = self._load(Path(self.path, self.SOURCE_FILE), np.uint8)
+        # The source is written last, so it never has more rows than others
+        num_rows = min(
+            [len(source)]
+            + [
+                len(self._load(self._column_path(col), np.float32))
+                for col in self.columns
+            ]
+        )
+        forecast_rows = np.flatnonzero(source[:num_rows] == self.FORECAST)
+        num_archive_rows = (
+            forecast_rows[0] if len(forecast_rows) > 0 else num_rows
+        )
+        return num_rows, int(num_archive_rows)
+
+    def _shift_date(self, start_date: str, days: int) -> str:
+        return (
+            datetime.strptime(start_date, self.TIME_FORMAT)
+            + timedelta(days=days)
+        ).strftime(self.TIME_FORMAT)
+
+    def get_fetch_start(self, start_date: str, end_date: str) -> Optional[str]:
+        meta = self._read_meta()
+        if meta is None or meta["start_date"] > start_date:
+            return start_date
+
+        num_rows, num_archive_rows = self._num_rows()
+        archive_end = self._shift_date(meta["start_date"], num_archive_rows - 1)
+        stored_end = self._shift_date(meta["start_date"], num_rows - 1)
+        if archive_end >= end_date:
+            return None
+        # The archive is asked for the forecast days only once a day
+        if stored_end >= end_date and meta["updated_on"] == str(date.today()):
+            return None
+        return self._shift_date(meta["start_date"], num_archive_rows)
+
+    def read(self, start_date: str, end_date: str) -> pd.DataFrame:
+        meta = self._read_meta()
+        num_rows, _ = self._num_rows()
+        dates = pd.date_range(meta["start_date"], periods=num_rows, freq="D")
+        rows = (dates >= start_date) & (dates <= end_date)
+        data = {"date": dates[rows]}
+        for col in self.columns:
+            values = self._load(self._column_path(col), np.float32)
+            data[col] = np.array(values[:num_rows][rows])
+        return pd.DataFrame(data)
+
+    def update(
+        self,
+        start_date: str,
+        archive_data: pd.DataFrame,
+        forecast_data: Optional[pd.DataFrame] = None,
+    ) -> None:
+        """Saving the requested days that have a 'date' column and follow
+        the archive days of the store"""
+        meta = self._read_meta()
+        if meta is None or meta["start_date"] > start_date:
+            shutil.rmtree(self.path, ignore_errors=True)
+            self.path.mkdir(parents=True, exist_ok=True)
+            meta = {"start_date": start_date}
+        _, num_archive_rows = self._num_rows()
+
+        # Forecast days are dropped, since they are requested again
+        for path in [Path(self.path, self.SOURCE_FILE)] + [
+            self._column_path(col) for col in self.columns
+        ]:
+            if path.exists():
+                itemsize = 1 if path.name == self.SOURCE_FILE else 4
+                os.truncate(path, num_archive_rows * itemsize)
+
+        next_date = self._shift_date(meta["start_date"], num_archive_rows)
+        for source, data in [
+            (self.ARCHIVE, archive_data),
+            (self.FORECAST, forecast_data),
+        ]:
+            if data is None or len(data) == 0:
+                continue
+            # Rows must be consecutive days without gaps
+            dates = pd.date_range(next_date, data["date"].iloc[-1], freq="D")
+            if len(dates) == 0:
+                continue
+            data = data.set_index("date").reindex(dates)
+            for col in self.columns:
+                with open(self._column_path(col), "ab") as file:
+                    file.write(data[col].to_numpy(np.float32).tobytes())
+            with open(Path(self.path, self.SOURCE_FILE), "ab") as file:
+                file.write(np.full(len(data), source, np.uint8).tobytes())
+            next_date = self._shift_date(
+                dates[-1].strftime(self.TIME_FORMAT), 1
+            )
+
+        meta["updated_on"] = str(date.today())
+        self._write_meta(meta)
+
+
+class HoltWintersParamsStore:
+    """
+    On-disk store of the fitted Holt-Winters parameters per station and
+    target series
+
+    ...
+
+    The parameters of a station and a target ('temp_max', 'temp_min') are
+    kept in '<station>_<target>.json' with the date of the fit. They barely
+    change from day to day, so the fresh parameters are used as they are and
+    the stale ones are the starting point of the next fit.
+
+    Parameters
+    ----------
+    store_dir : Path | str, default=CACHE_DIR / 'holt_winters'
+        The directory where the parameters are stored.
+    max_age_days : int, default=7
+        The number of days the parameters are used without refitting.
+
+    Methods
+    -------
+    get -> dict | None:
+        Getting the stored parameters ('params': alpha, beta and gamma) and
+        their fit date ('fitted_on').
+    is_fresh -> bool:
+        Checking if the parameters can be used without refitting.
+    save -> None:
+        Saving the parameters fitted today.
+    """
+
+    TIME_FORMAT = "%Y-%m-%d"
+
+    def __init__(
+        self,
+        store_dir: Union[Path, str] = Path(CACHE_DIR, "holt_winters"),
+        max_age_days: int = 7,
+    ):
+        self.store_dir = Path(store_dir)
+        self.max_age_days = max_age_days
+
+    def _path(self, station_id: str, target: str) -> Path:
+        return Path(self.store_dir, f"{station_id}_{target}.json")
+
+    def get(self, station_id: str, target: str) -> Optional[dict]:
+        path = self._path(station_id, target)
+        if not path.exists():
+            return None
+        with open(path, "r") as file:
+            return json.load(file)
+
+    def is_fresh(self, record: Optional[dict]) -> bool:
+        if record is None:
+            return False
+        fitted_on = datetime.strptime(record["fitted_on"], self.TIME_FORMAT)
+        return (datetime.today() - fitted_on).days < self.max_age_days
+
+    def save(self, station_id: str, target: str, params) -> None:
+        record = {
+            "params": [float(val) for val in params],
+            "fitted_on": date.today().strftime(self.TIME_FORMAT),
+        }
+        self.store_dir.mkdir(parents=True, exist_ok=True)
+        _atomic_write(self._path(station_id, target), json.dumps(record))
+
+
+class SARIMAXStateStore:
+    """
+    On-disk store of the fitted SARIMAX models per station and target series
+
+    ...
+
+    A fitted model is kept as its parameters and the state of its Kalman
+    filter after the last observation ('<station>_<target>.npz'), which is
+    all that is needed to filter new observations and to forecast without
+    re-estimation. The results objects of statsmodels keep the filter output
+    for every observation and take hundreds of megabytes. '<station>_<target>
+    .json' keeps the dates of the observations, the fit date and the errors
+    that detect drift: the mean absolute one-step-ahead error of the fit
+    (the baseline) and the sum and the number of the errors on the
+    observations filtered since the fit.
+
+    Parameters
+    ----------
+    store_dir : Path | str, default=CACHE_DIR / 'sarimax'
+        The directory where the models are stored.
+    refit_days : int, default=30
+        The number of days after which the model is fitted again.
+    drift_factor : float, default=1.5
+        The model is fitted again if the mean error on the new observations
+        exceeds the baseline this many times.
+    drift_min_obs : int, default=7
+        The number of new observations the drift is detected on.
+
+    Methods
+    -------
+    get -> tuple[dict, dict] | None:
+        Getting the meta information and the arrays ('params', 'state' and
+        'state_cov') of a model.
+    is_fresh -> bool:
+        Checking if the model can be extended instead of fitted again.
+    has_drifted -> bool:
+        Checking if the errors on the new observations have grown.
+    save -> None:
+        Saving the meta information and the arrays of a model.
+    """
+
+    TIME_FORMAT = "%Y-%m-%d"
+    ARRAYS = ["params", "state", "state_cov"]
+
+    def __init__(
+        self,
+        store_dir: Union[Path, str] = Path(CACHE_DIR, "sarimax"),
+        refit_days: int = 30,
+        drift_factor: float = 1.5,
+        drift_min_obs: int = 7,
+    ):
+        self.store_dir = Path(store_dir)
+        self.refit_days = refit_days
+        self.drift_factor = drift_factor
+        self.drift_min_obs = drift_min_obs
+
+    def _arrays_path(self, station_id: str, target: str) -> Path:
+        return Path(self.store_dir, f"{station_id}_{target}.npz")
+
+    def _meta_path(self, station_id: str, target: str) -> Path:
+        return Path(self.store_dir, f"{station_id}_{target}.json")
+
+    def get(self, station_id: str, target: str) -> Optional[tuple[dict, dict]]:
+        meta_path = self._meta_path(station_id, target)
+        arrays_path = self._arrays_path(station_id, target)
+        if not (meta_path.exists() and arrays_path.exists()):
+            return None
+        with open(meta_path, "r") as file:
+            meta = json.load(file)
+        with np.load(arrays_path) as arrays:
+            return meta, {name: arrays[name] for name in self.ARRAYS}
+
+    def is_fresh(self, meta: dict) -> bool:
+        fitted_on = datetime.strptime(meta["fitted_on"], self.TIME_FORMAT)
+        return (datetime.today() - fitted_on).days < self.refit_days
+
+    def has_drifted(self, meta: dict) -> bool:
+        if meta["num_new_obs"] < self.drift_min_obs:
+            return False
+        new_error = meta["new_abs_error"] / meta["num_new_obs"]
+        return new_error > self.drift_factor * meta["baseline_error"]
+
+    def save(
+        self, station_id: str, target: str, meta: dict, **arrays: np.ndarray
+    ) -> None:
+        self.store_dir.mkdir(parents=True, exist_ok=True)
+        # The arrays are written first, so the meta information never
+        # describes the arrays that are not written yet
+        buffer = io.BytesIO()
+        np.savez(buffer, **arrays)
+        _atomic_write(self._arrays_path(station_id, target), buffer.getvalue())
+        _atomic_write(self._meta_path(station_id, target), json.dumps(meta))
@@ -0,0 +1,190 @@
+import sys
+import threading
+
+import numpy as np
+import pandas as pd
+from django.db import models
+
+from ..models import City, Station
+from .search import PrefixIndex
+from .spatial import SpatialIndex
+
+
+class StationTable:
+    """
+    Compact station table
+
+    ...
+
+    The identifiers are kept in an array of interned strings and the
+    coordinates in contiguous float arrays, so that the sectors and the
+    spatial index are built from the arrays directly. Rows are found by
+    station identifiers with a hash index.
+
+    Parameters
+    ----------
+    ids : array-like
+        Identifiers (names) of the stations.
+    lat : array-like
+        Latitudes of the stations.
+    lng : array-like
+        Longitudes of the stations.
+
+    Methods
+    -------
+    from_queryset -> StationTable:
+        Building the table from the rows of a queryset.
+    get_coords -> tuple[float, float]:
+        Getting the coordinates of a station.
+    """
+
+    def __init__(self, ids, lat, lng):
+        self.ids = np.array([sys.intern(str(id_)) for id_ in ids], dtype=object)
+        self.lat = np.asarray(lat, dtype=float)
+        self.lng = np.asarray(lng, dtype=float)
+        self.rows = {id_: row for row, id_ in enumerate(self.ids)}
+
+    @classmethod
+    def from_queryset(cls, queryset) -> "StationTable":
+        ids, lat, lng = [], [], []
+        for id_, station_lat, station_lng in queryset.values_list(
+            "name", "lat", "lng"
+        ).iterator():
+            ids.append(id_)
+            lat.append(station_lat)
+            lng.append(station_lng)
+        return cls(ids, lat, lng)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __contains__(self, station_id: str) -> bool:
+        return station_id in self.rows
+
+    def get_coords(self, station_id: str) -> tuple[float, float]:
+        row = self.rows[station_id]
+        return (float(self.lat[row]), float(self.lng[row]))
+
+
+class Catalog:
+    """
+    Lazily loaded station and city tables shared by the services and views
+
+    ...
+
+    The tables and their spatial indexes are loaded from the database on the
+    first access and kept until they are invalidated. The invalidation is
+    made on 'post_save' and 'post_delete' of Station and City (see
+    signals.py). Bulk operations do not send these signals, so the code that
+    uses them has to call invalidate() itself. Every process keeps its own
+    catalog, so the changes made by other processes are not seen until the
+    catalog is invalidated.
+
+    Attributes
+    ----------
+    stations : StationTable
+        The station table.
+    cities : DataFrame
+        The city table.
+    station_index : SpatialIndex
+        The spatial index of the stations.
+    city_index : SpatialIndex
+        The spatial index of the cities.
+    city_search_index : PrefixIndex
+        The index of the cities by their normalized names and countries
+        separated with CITY_KEY_SEP.
+
+    Methods
+    -------
+    read_table -> DataFrame:
+        Reading a model table from the database.
+    invalidate -> None:
+        Dropping the loaded tables of a model or all tables.
+    """
+
+    # It is less than any printable character, so the cities are ordered by
+    # names first
+    CITY_KEY_SEP = "\t"
+
+    def __init__(self):
+        self._tables = {}
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def read_table(model: type[models.Model]) -> pd.DataFrame:
+        # The columns of the table itself, so the foreign keys are the
+        # identifiers ('nearest_station_id') that values() gives
+        return pd.DataFrame(
+            model.objects.values(),
+            columns=[field.attname for field in model._meta.concrete_fields],
+        )
+
+    def _get(self, name: str, load):
+        table = self._tables.get(name)
+        if table is None:
+            # Only one thread loads a table, the others wait for it
+            with self._lock:
+                table = self._tables.get(name)
+                if table is None:
+                    table = self._tables[name] = load()
+        return table
+
+    @property
+    def stations(self) -> StationTable:
+        return self._get(
+            "stations",
+            lambda: StationTable.from_queryset(Station.objects.all()),
+        )
+
+    @property
+    def cities(self) -> pd.DataFrame:
+        return self._get("cities", lambda: self.read_table(City))
+
+    @property
+    def station_index(self) -> SpatialIndex:
+        return self._get(
+            "station_index",
+            lambda: SpatialIndex(self.stations.lat, self.stations.lng),
+        )
+
+    @property
+    def city_index(self) -> SpatialIndex:
+        return self._get(
+            "city_index",
+            lambda: SpatialIndex(self.cities["lat"], self.cities["lng"]),
+        )
+
+    @property
+    def city_search_index(self) -> PrefixIndex:
+        return self._get(
+            "city_search_index",
+            lambda: PrefixIndex(
+                list(
+                    self.cities["search_name"]
+                    + self.CITY_KEY_SEP
+                    + self.cities["search_country"]
+                )
+            ),
+        )
+
+    def invalidate(self, model: type[models.Model] = None) -> None:
+        names = {
+            Station: ["stations", "station_index"],
+            City: ["cities", "city_index", "city_search_index"],
+        }.get(model, list(self._tables))
+        with self._lock:
+            for name in names:
+                self._tables.pop(name, None)
+
+
+class CatalogTable:
+    """A class attribute that gives a table of the shared catalog"""
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __get__(self, instance, owner):
+        return getattr(catalog, self.name)
+
+
+catalog = Catalog()
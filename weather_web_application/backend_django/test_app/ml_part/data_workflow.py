@@ -1,15 +1,24 @@
-import io
-import time
+import logging
 import warnings
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
 from datetime import date, datetime, timedelta
+from pathlib import Path
 from typing import Union
 
 import numpy as np
 import pandas as pd
-import requests
-from haversine import haversine
+from haversine import haversine_vector
 
+from ..config.config import CACHE_DIR
 from ..models import City, Station
+from .cache import ERA5Store, NOAACache
+from .catalog import Catalog, CatalogTable, catalog
+from .dtypes import MEASUREMENT_DTYPE, apply_dtypes
+from .instrumentation import bind_context, current_span, event, span
+from .metrics import record_cache_lookups
+from .spatial import SpatialIndex
+from .transport import RateLimiter, get_transport
 
 
 class DataCollection:
@@ -108,17 +117,11 @@ class DataCollection:
 
     @staticmethod
     def get_stations():
-        return pd.DataFrame(
-            Station.objects.values(),
-            columns=[field.name for field in Station._meta.get_fields()],
-        )
+        return Catalog.read_table(Station)
 
     @staticmethod
     def get_cities():
-        return pd.DataFrame(
-            City.objects.values(),
-            columns=[field.name for field in City._meta.get_fields()],
-        )
+        return Catalog.read_table(City)
 
 
 class NOAAService(DataCollection):
@@ -167,10 +170,12 @@ class NOAAService(DataCollection):
     BASE_API_URL = "https://www.ncei.noaa.gov/access/services/data/v1/?"
 
     MIN_NUM_STATIONS = 1
+    MAX_STATION_DIST = 150
     DATA_TYPES = {"pandas", "text"}
 
-    stations = DataCollection.get_stations()
-    cities = DataCollection.get_cities()
+    stations = CatalogTable("stations")
+    cities = CatalogTable("cities")
+    cache = NOAACache()
 
     def __init__(
         self,
@@ -218,79 +223,111 @@ class NOAAService(DataCollection):
         }
         print(data_types)
 
-    def _call_api(self, station_ids: list) -> Union[str, pd.DataFrame]:
+    def _call_api(
+        self, station_ids: list, start_date: str = None, transform="pandas"
+    ) -> Union[str, pd.DataFrame]:
         """Obtaining NOAA data"""
         stations = ",".join(station_ids)
         full_url = (
             f"{self.BASE_API_URL}dataset=daily-summaries&dataTypes="
             f"{','.join(self.data_types)}&stations={stations}"
-            f"&startDate={self.start_date}&endDate={self.end_date}"
+            f"&startDate={start_date or self.start_date}"
+            f"&endDate={self.end_date}"
             "&boundingBox=90,-180,-90,180&units=metric"
         )
-        response = requests.get(full_url)
-        if response.status_code != 200:
-            response.raise_for_status()
-        return response.text
+        with span("noaa.request", stations=station_ids) as request_span:
+            if transform == "text":
+                response = get_transport().get(full_url)
+                request_span.set(bytes=len(response.content))
+                return response.text
+
+            # The body is parsed while it is being downloaded, so the
+            # response is never kept in memory as a whole
+            response = get_transport().get(full_url, stream=True)
+            try:
+                response.raw.decode_content = True
+                data = self.cache.read_csv(response.raw, self.data_types)
+                # The number of bytes received (before decompression)
+                request_span.set(rows=len(data), bytes=response.raw.tell())
+                return data
+            finally:
+                response.close()
+
+    def _get_station_datasets(self, station_ids: list) -> pd.DataFrame:
+        """Reading the cached station data and requesting only the dates
+        that are not in the cache"""
+        # The stations with the same first missing date are requested together
+        fetch_groups = {}
+        for station_id in station_ids:
+            fetch_start = self.cache.get_fetch_start(
+                station_id, self.data_types, self.start_date, self.end_date
+            )
+            if fetch_start is not None:
+                fetch_groups.setdefault(fetch_start, []).append(station_id)
+        num_misses = sum(len(group_ids) for group_ids in fetch_groups.values())
+        num_hits = len(station_ids) - num_misses
+        current_span().set(cache_hits=num_hits, cache_misses=num_misses)
+        record_cache_lookups("noaa", num_hits, num_misses)
+
+        for fetch_start, group_ids in fetch_groups.items():
+            fetched_data = self._call_api(group_ids, start_date=fetch_start)
+            for station_id in group_ids:
+                self.cache.update(
+                    station_id,
+                    self.data_types,
+                    self.start_date,
+                    self.end_date,
+                    fetch_start,
+                    fetched_data[fetched_data["STATION"] == station_id],
+                )
 
-    def get_nearest_stations(self) -> list[str]:
-        stations_locs = pd.DataFrame(
-            {
-                "Id": self.stations["name"],
-                "Coords": tuple(
-                    zip(self.stations["lat"], self.stations["lng"])
-                ),
-            }
+        # The datasets are ordered by the distance to the location
+        station_datasets = pd.concat(
+            [
+                self.cache.read(
+                    station_id, self.data_types, self.start_date, self.end_date
+                )
+                for station_id in station_ids
+            ],
+            ignore_index=True,
         )
-        cities_locs = pd.DataFrame(
-            {
-                "City": self.cities["name"],
-                "Coords": tuple(zip(self.cities["lat"], self.cities["lng"])),
-            }
+        # Concatenating categoricals with different categories gives objects
+        station_datasets["STATION"] = pd.Categorical(
+            station_datasets["STATION"], categories=station_ids
         )
+        # The stations without cached data give object columns
+        return apply_dtypes(station_datasets)
 
-        station_ids = []
-        for i in range(self.num_nearby_stations):
-            stations_locs["Dist"] = stations_locs["Coords"].map(
-                lambda x: haversine(self.loc_coords, x)
-            )
-            cities_locs["Dist"] = cities_locs["Coords"].map(
-                lambda x: haversine(self.loc_coords, x)
+    def get_nearest_stations(self) -> list[str]:
+        # The nearest station is always used and the others only if they are
+        # located within MAX_STATION_DIST
+        station_inds, station_dists = catalog.station_index.query(
+            self.loc_coords,
+            k=self.num_nearby_stations,
+            max_dist=self.MAX_STATION_DIST,
+        )
+        station_ids = list(catalog.stations.ids[station_inds])
+        city_inds, city_dists = catalog.city_index.query(self.loc_coords)
+
+        if len(city_inds) > 0:
+            event(
+                "nearest_city",
+                city=catalog.cities["name"].iloc[city_inds[0]],
+                dist_km=float(city_dists[0]),
             )
-
-            station_ind = stations_locs["Dist"].idxmin()
-            station = stations_locs.loc[station_ind]
-            city = cities_locs.loc[cities_locs["Dist"].idxmin()]
-
-            if i > 0 and station["Dist"] >= 150:
-                print(
-                    f"{i} stations were only used. The rest are located > 150km"
-                )
-                break
-
-            if i == 0:
-                print(
-                    "The nearest city is {city} -> {dist} km".format_map(
-                        {
-                            "city": city["City"],
-                            "dist": round(city["Dist"], 3),
-                        }
-                    )
-                )
-                print("*" * 10 + " Stations " + "*" * 10)
-
-            print(
-                "{counter}. {id} -> {dist} km".format_map(
-                    {
-                        "counter": i + 1,
-                        "id": station["Id"],
-                        "dist": round(station["Dist"], 3),
-                    }
-                )
+        event(
+            "nearest_stations",
+            stations=station_ids,
+            dists_km=[round(float(dist), 3) for dist in station_dists],
+        )
+        if len(station_ids) < self.num_nearby_stations:
+            event(
+                "few_stations",
+                level=logging.WARNING,
+                num_stations=len(station_ids),
+                max_dist_km=self.MAX_STATION_DIST,
             )
 
-            station_ids.append(station["Id"])
-            stations_locs.drop(station_ind, inplace=True)
-
         self.station_ids_ = station_ids
         return station_ids
 
@@ -308,35 +345,33 @@ class NOAAService(DataCollection):
                 f"{self.DATA_TYPES}"
             )
 
-        self.station_ids_ = self.get_nearest_stations()
-        station_datasets = self._call_api(self.station_ids_)
+        with span(
+            "noaa.get_data",
+            loc_coords=self.loc_coords,
+            data_types=self.data_types,
+        ) as data_span:
+            self.station_ids_ = self.get_nearest_stations()
+            if len(self.station_ids_) == 0:
+                raise ValueError("There are no stations in the database.")
+            station_datasets_ = self._get_station_datasets(self.station_ids_)
+            data_span.set(
+                rows=len(station_datasets_),
+                bytes_in_memory=int(station_datasets_.memory_usage().sum()),
+            )
 
-        station_datasets_ = pd.read_csv(io.StringIO(station_datasets))
-        stations_without_data = set(self.station_ids_) - set(
-            station_datasets_["STATION"].unique()
-        )
-        if len(stations_without_data) > 0:
-            print(
-                f"\nStation(-s) {stations_without_data}\n",
-                "do(-es) not have the data for this date range."
+            stations_without_data = set(self.station_ids_) - set(
+                station_datasets_["STATION"].unique()
             )
-            """
-            if (len(stations_without_data) ==
-                station_datasets_['STATION'].nunique()):
-                print(
-                    "As the dataset will be empty because all stations",
-                    "found do not have data for this date range, we will",
-                    "continue the search for the other nearest stations"
+            if len(stations_without_data) > 0:
+                event(
+                    "stations_without_data",
+                    level=logging.WARNING,
+                    stations=sorted(stations_without_data),
                 )
-                station_idx = [
-                    self.stations[self.stations['name'] == station_id]
-                    for station_id in nearest_stations
-                ]
-                self.stations = self.stations.drop(station_idx)
-                return self.get_noaa_data()
-            """
 
-        return station_datasets if transform == "text" else station_datasets_
+            if transform == "text":
+                return station_datasets_.to_csv(index=False)
+            return station_datasets_
 
 
 class NOAACleaning:
@@ -374,7 +409,7 @@ class NOAACleaning:
 
     MIN_DATE = datetime.strptime("1940-01-01", TIME_FORMAT)
 
-    stations = DataCollection.get_stations()
+    stations = CatalogTable("stations")
     renamed_types = {
         "PRCP": "precip_sum",
         "TMAX": "temp_max",
@@ -391,12 +426,66 @@ class NOAACleaning:
 
     @classmethod
     def get_station_coords(cls, station_id: str) -> tuple[float, float]:
-        lat, lng = np.ravel(
-            cls.stations.loc[
-                cls.stations["name"] == station_id, ["lat", "lng"]
-            ].values
+        return cls.stations.get_coords(station_id)
+
+    @staticmethod
+    def _stack_stations(
+        df: pd.DataFrame, station_names: list[str], columns: list[str]
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Getting a (date, station, type) array of the values and the sorted
+        dates. The missing dates of the stations are NaN."""
+        dates, date_inds = np.unique(df.index.values, return_inverse=True)
+        station_inds = pd.Categorical(
+            df["STATION"], categories=station_names
+        ).codes
+        values = np.full(
+            (len(dates), len(station_names), len(columns)),
+            np.nan,
+            dtype=MEASUREMENT_DTYPE,
         )
-        return (lat, lng)
+        values[date_inds, station_inds] = df[columns].to_numpy(
+            MEASUREMENT_DTYPE
+        )
+        return values, dates
+
+    @staticmethod
+    def _fill_with_era_data(
+        data: pd.DataFrame, era_data: pd.DataFrame
+    ) -> pd.DataFrame:
+        """Filling the missing values and dates of the station data with the
+        ERA5 data. The result is the same as of combine_first()."""
+        if not data.index.is_unique:  # In any case
+            data = data[~data.index.duplicated(keep="first")]
+        # We align both datasets on the sorted union of their dates once, and
+        # each column is filled by positions without Python sets of dates
+        missing_dates = era_data.index.difference(data.index)
+        index = data.index
+        if len(missing_dates):
+            index = index.append(missing_dates).sort_values()
+        if data.columns.equals(era_data.columns):
+            columns = data.columns
+        else:
+            columns = data.columns.union(era_data.columns)
+        data_positions = index.get_indexer(data.index)
+        era_positions = index.get_indexer(era_data.index)
+
+        filled_columns = {}
+        for col in columns:
+            # The columns absent in one of the datasets are NaN there
+            dtypes = [
+                frame[col].dtype if col in frame else np.float64
+                for frame in (data, era_data)
+            ]
+            values = np.full(len(index), np.nan, np.result_type(*dtypes))
+            if col in era_data:
+                values[era_positions] = era_data[col].to_numpy()
+            if col in data:
+                col_values = data[col].to_numpy()
+                has_value = ~pd.isna(col_values)
+                values[data_positions[has_value]] = col_values[has_value]
+            filled_columns[col] = values
+
+        return pd.DataFrame(filled_columns, index=index, columns=columns)
 
     def get_combined_dataset(self) -> pd.DataFrame:
         df = self.station_datasets.copy()
@@ -413,101 +502,77 @@ class NOAACleaning:
         # At first if there are the data from several stations, we will fill
         # missing values taken the nearest one as the main. The next stations
         # will be used to fill in the nearest one in order.
-        num_stations = df["STATION"].nunique()
-        all_needed_dates = pd.date_range(df.index[0], df.index[-1], freq="D")
-        if num_stations > 1:
-            station_names = list(df["STATION"].unique())
-            print(f"The nearest station is '{station_names[0]}'")
-            nearest_station_data = df[df["STATION"] == station_names.pop(0)]
-            df_comb = nearest_station_data.copy()
-            print("Total missing values:", df_comb.isna().sum().sum())
-            print(
-                "Total missing days: {}".format(
-                    len(set(all_needed_dates) - set(df_comb.index))
-                )
-            )
-            print(
-                "Filling them using the other stations: {}".format(
-                    ", ".join(station_names)
-                ),
-                end="\n\n",
-            )
-            while df_comb.isna().values.any() and station_names:
-                station_name = station_names.pop(0)
-                next_station_data = df[df["STATION"] == station_name]
-
-                # Filling missing values in the same location
-                df_comb = df_comb.combine_first(
-                    # We have to have the same dataframes by shapes
-                    next_station_data.loc[
-                        list(set(next_station_data.index) & set(df_comb.index))
-                    ]
-                )
-
-                # If there are missing dates from the start date to the last.
-                # The last rest of the dates are filled with ERA5 data.
-                missing_inds = missing_inds = list(
-                    set(next_station_data.index) - set(df_comb.index)
-                )
-                if missing_inds:
-                    df_comb = pd.concat(
-                        [df_comb, next_station_data.loc[missing_inds]]
-                    ).sort_index()
-
-                print(f"Station '{station_name}'")
-                print(
-                    "Left missing values -> {num_mis_vals}".format(
-                        num_mis_vals=df_comb.isna().sum().sum()
-                    )
+        station_names = list(pd.unique(df["STATION"]))
+        columns = [col for col in df.columns if col != "STATION"]
+        with span("noaa.combine", stations=len(station_names)) as combine_span:
+            values, dates = self._stack_stations(df, station_names, columns)
+            has_value = ~np.isnan(values)
+            # The first station with a value for every date and type, as the
+            # stations are ordered by the distance
+            first_stations = has_value.argmax(axis=1)
+            combined = np.take_along_axis(
+                values, first_stations[:, np.newaxis, :], axis=1
+            )[:, 0, :]
+
+            # The diagnostics are computed only if they are logged
+            if combine_span.enabled:
+                all_needed_dates = pd.date_range(dates[0], dates[-1], freq="D")
+                is_nearest = (df["STATION"] == station_names[0]).to_numpy()
+                # The number of values taken from every station
+                num_filled_values = np.bincount(
+                    first_stations[has_value.any(axis=1)],
+                    minlength=len(station_names),
                 )
-                print(
-                    "Left missing days -> {left_dates}".format(
-                        left_dates=len(
-                            set(all_needed_dates) - set(df_comb.index)
-                        )
+                combine_span.set(
+                    nearest_station=station_names[0],
+                    nearest_missing_values=int(
+                        df.loc[is_nearest, columns].isna().sum().sum()
                     ),
-                    end="\n\n",
+                    nearest_missing_days=len(all_needed_dates)
+                    - df.index[is_nearest].nunique(),
+                    filled_values=dict(
+                        zip(station_names, num_filled_values.tolist())
+                    ),
+                    rows=len(dates),
+                    missing_values=int(np.isnan(combined).sum()),
+                    missing_days=len(all_needed_dates) - len(dates),
                 )
 
-            df = df_comb
-
-        print(
-            "There were left {} missing values and {} missing days".format(
-                df.isna().sum().sum(),
-                len(set(all_needed_dates) - set(df.index)),
-            ),
-            end=". \nNow they will be filled data from ERA5 dataset",
+        return pd.DataFrame(
+            combined,
+            index=pd.DatetimeIndex(dates, name="date"),
+            columns=columns,
         )
-        return df.drop("STATION", axis=1)
 
     def get_cleaned_data(self):
         self.first_station_coords_ = self.get_station_coords(
             self.station_datasets.loc[1, "STATION"]
         )
-        self.combined_dataset_ = self.get_combined_dataset()
+        # The ERA5 data are obtained before the cleaning stage starts, so
+        # the stage does not include the network time ('era5.get_data')
+        dates = pd.to_datetime(self.station_datasets["DATE"])
         era_data_types = ERA5Service.daily_types | ERA5Service.hourly_types
         data_types = [
-            era_data_types[col] for col in self.combined_dataset_.columns
+            era_data_types[self.renamed_types.get(col, col)]
+            for col in self.station_datasets.columns
+            if col not in ("STATION", "DATE")
         ]
         self.era_data_ = ERA5Service(
             self.first_station_coords_,
             data_types,
-            self.combined_dataset_.index[0].strftime(self.TIME_FORMAT),
-            self.combined_dataset_.index[-1].strftime(self.TIME_FORMAT),
+            dates.min().strftime(self.TIME_FORMAT),
+            dates.max().strftime(self.TIME_FORMAT),
         ).get_era_data()
 
-        # Then we will fill the rest of missing values and dates in station
-        # data using ERA5 data
-        missing_inds = list(
-            set(self.era_data_.index) - set(self.combined_dataset_.index)
-        )
-        data = pd.concat(
-            [self.combined_dataset_, self.era_data_.loc[missing_inds]]
-        ).sort_index()
-        if not data.index.is_unique:  # In any case
-            data = data[~data.index.duplicated(keep="first")]
-
-        return data.combine_first(self.era_data_)
+        with span("noaa.clean") as clean_span:
+            self.combined_dataset_ = self.get_combined_dataset()
+            # Then we will fill the rest of missing values and dates in
+            # station data using ERA5 data
+            data = apply_dtypes(
+                self._fill_with_era_data(self.combined_dataset_, self.era_data_)
+            )
+            clean_span.set(rows=len(data))
+            return data
 
 
 class ERA5Service(DataCollection):
@@ -569,8 +634,32 @@ class ERA5Service(DataCollection):
         "wind_speed": "windspeed_10m",
     }
     era_data_types = daily_types | hourly_types
+    # Daily means that open-meteo can aggregate itself. They are requested
+    # instead of hourly data if 'use_daily_aggregates' is set.
+    daily_aggregate_types = {
+        "pressure_level": "pressure_msl_mean",
+        "relat_humidity": "relativehumidity_2m_mean",
+        "cloud_cover": "cloudcover_mean",
+        "wind_speed": "windspeed_10m_mean",
+    }
+    use_daily_aggregates = False
+
+    stations = CatalogTable("stations")
+
+    # Neighbouring stations are requested in batches of 'max_batch_size'
+    # locations per request (1 disables batching). Every batch makes up to
+    # 'requests_per_batch' requests at once (the daily and the hourly archive
+    # and forecast), and open-meteo limits the rate of requests, so the
+    # batches are requested concurrently only up to 'max_concurrent_requests'.
+    max_batch_size = 50
+    max_concurrent_requests = 8
+    requests_per_batch = 4
+    rate_limiter = RateLimiter(requests_per_second=5)
 
-    stations = DataCollection.get_stations()
+    store_dir = Path(CACHE_DIR, "era5")
+    # The archive is usually 5 days behind, so the forecast for this number
+    # of last days is requested together with the archive
+    forecast_days = 10
 
     def __init__(
         self,
@@ -624,305 +713,471 @@ class ERA5Service(DataCollection):
         ERA5Service.show_era_data_types()
 
     def get_era_data(self) -> pd.DataFrame:
-        self.station_dataset_ = self._call_api()
-        if len(self.intermidiate_dists) >= 2:
-            with warnings.catch_warnings():
-                warnings.simplefilter("ignore")
-                warnings.warn(
-                    "default", category=pd.errors.SettingWithCopyWarning
+        with span(
+            "era5.get_data",
+            loc_coords=self.loc_coords,
+            data_types=self.data_types,
+        ) as data_span:
+            era_data = self.station_dataset_ = self._call_api(self.loc_coords)
+            if len(self.intermidiate_dists) >= 2:
+                self.station_ids_ = (
+                    self.get_station_ids_bw_dists_of_card_points()
+                )
+                era_data = self._combine_station_datasets(
+                    self.station_dataset_, self.station_ids_
                 )
-                station_ids = self.get_station_ids_bw_dists_of_card_points()
-                self.station_ids_ = station_ids
-            return self._combine_station_datasets(
-                self.station_dataset_, self.station_ids_
+            data_span.set(
+                rows=len(era_data),
+                columns=era_data.shape[1],
+                bytes_in_memory=int(era_data.memory_usage().sum()),
             )
-        return self.station_dataset_
+            return era_data
 
     def _combine_station_datasets(
         self, station_dataset: pd.DataFrame, station_ids: dict
     ) -> pd.DataFrame:
         """Combining datasets into one dataset via adding their columns."""
-        combined_dataset = station_dataset.copy()
+        prefixes, stations_coords = [], []
         for sector in station_ids.keys():
             for side, station_id in station_ids[sector].items():
-                try:
-                    station_coords = self.stations.loc[
-                        self.stations["name"] == station_id, ["lat", "lng"]
-                    ].values[0]
-                    time.sleep(0.2)
-                    station_era_data = self._call_api(station_coords)
-                    station_era_data = station_era_data.rename(
-                        columns={
-                            old_col: sector[:-2] + "_" + side + "_" + old_col
-                            for old_col in station_era_data.columns
-                        }
+                if station_id not in self.stations:
+                    event(
+                        "no_sector_station",
+                        level=logging.WARNING,
+                        sector=sector,
+                        side=side,
                     )
-                    combined_dataset = combined_dataset.merge(
-                        station_era_data, on="date"
+                    continue
+                prefixes.append(sector[:-2] + "_" + side + "_")
+                stations_coords.append(self.stations.get_coords(station_id))
+
+        # Open-meteo accepts several locations in one request, so the
+        # stations are requested in batches
+        batches = [
+            stations_coords[i : i + self.max_batch_size]
+            for i in range(0, len(stations_coords), self.max_batch_size)
+        ]
+        num_workers = min(
+            len(batches),
+            self.max_concurrent_requests // self.requests_per_batch,
+        )
+        with ThreadPoolExecutor(max_workers=max(num_workers, 1)) as executor:
+            station_datasets = [
+                station_era_data
+                for batch_datasets in executor.map(
+                    bind_context(self._call_api_batch), batches
+                )
+                for station_era_data in batch_datasets
+            ]
+            # The datasets are joined on dates at once
+            return pd.concat(
+                [station_dataset]
+                + [
+                    station_era_data.add_prefix(prefix)
+                    for prefix, station_era_data in zip(
+                        prefixes, station_datasets
                     )
-                except IndexError:
-                    print(f"There was no found a station from {side} side.")
-
-        return combined_dataset
+                ],
+                axis=1,
+                join="inner",
+            )
 
-    def get_station_ids_bw_dists_of_card_points(self, degree_step=1e-3) -> dict:
+    def get_station_ids_bw_dists_of_card_points(self) -> dict:
         lat, long = self.loc_coords
         dists = sorted(self.intermidiate_dists)
 
-        def calc_coords(lat, long, min_dist):
-            north_lat, south_lat = lat, lat
-            while haversine([lat, long], [int(north_lat), long]) < min_dist:
-                if north_lat >= 90 - degree_step:
-                    break
-                north_lat += degree_step
-            while haversine([lat, long], [int(south_lat), long]) < min_dist:
-                if south_lat <= -(90 - degree_step):
-                    break
-                south_lat -= degree_step
-
-            west_long, east_long = long, long
-            while haversine([lat, long], [lat, int(west_long)]) < min_dist:
-                if west_long <= -(180 - degree_step):
-                    break
-                west_long -= degree_step
-            while haversine([lat, long], [lat, int(east_long)]) < min_dist:
-                if east_long >= 180 - degree_step:
-                    break
-                east_long += degree_step
-
-            return (north_lat, south_lat, west_long, east_long)
-
-        extreme_points = {}
-        for dist in dists:
-            extreme_points[dist] = calc_coords(
-                # int() because of 90.000000000043
-                int(lat),
-                int(long),
-                min_dist=dist,
+        def calc_coords(dist):
+            # A meridian arc of 'dist' km spans dist / R radians, and an arc
+            # along the parallel of the location spans
+            # 2 * asin(sin(dist / 2R) / cos(lat)) radians of longitude
+            lat_delta = np.degrees(dist / SpatialIndex.EARTH_RADIUS)
+            ratio = np.sin(dist / (2 * SpatialIndex.EARTH_RADIUS)) / np.cos(
+                np.radians(lat)
+            )
+            long_delta = 180 if ratio >= 1 else np.degrees(2 * np.arcsin(ratio))
+            return (
+                min(lat + lat_delta, 90),
+                max(lat - lat_delta, -90),
+                max(long - long_delta, -180),
+                min(long + long_delta, 180),
             )
 
-        stations_locs = self.stations.copy().rename(
-            columns={"name": "Id", "lat": "Latitude", "lng": "Longitude"}
-        )
-        stations_locs["Coords"] = tuple(
-            zip(stations_locs["Latitude"], stations_locs["Longitude"])
-        )
+        extreme_points = {dist: calc_coords(dist) for dist in dists}
+
+        # All sectors are selected from the same coordinate arrays
+        stations_lat = self.stations.lat
+        stations_long = self.stations.lng
+        stations_ids = self.stations.ids
 
         dist_station = {}
-        card_points = {"north": 0, "south": 1, "west": 2, "east": 3}
         for i in range(len(dists) - 1):
             start_dist, end_dist = dists[i], dists[i + 1]
-            station_ids = {
-                card_point: None for card_point in card_points.keys()
+            (
+                near_north_lat,
+                near_south_lat,
+                near_west_long,
+                near_east_long,
+            ) = extreme_points[start_dist]
+            (
+                far_north_lat,
+                far_south_lat,
+                far_west_long,
+                far_east_long,
+            ) = extreme_points[end_dist]
+            in_lat_band = (stations_lat < far_north_lat) & (
+                stations_lat > far_south_lat
+            )
+            in_long_band = (stations_long > far_west_long) & (
+                stations_long < far_east_long
+            )
+            # The masks of the sectors and their central points
+            sectors = {
+                "west": (
+                    in_lat_band
+                    & (stations_long < near_west_long)
+                    & (stations_long > far_west_long),
+                    (lat, (near_west_long + far_west_long) / 2),
+                ),
+                "east": (
+                    in_lat_band
+                    & (stations_long > near_east_long)
+                    & (stations_long < far_east_long),
+                    (lat, (near_east_long + far_east_long) / 2),
+                ),
+                "north": (
+                    in_long_band
+                    & (stations_lat > near_north_lat)
+                    & (stations_lat < far_north_lat),
+                    ((near_north_lat + far_north_lat) / 2, long),
+                ),
+                "south": (
+                    in_long_band
+                    & (stations_lat < near_south_lat)
+                    & (stations_lat > far_south_lat),
+                    ((near_south_lat + far_south_lat) / 2, long),
+                ),
             }
 
-            # WEST
-            near_west_long = extreme_points[start_dist][card_points["west"]]
-            far_west_long = extreme_points[end_dist][card_points["west"]]
-            far_north_lat = extreme_points[end_dist][card_points["north"]]
-            far_south_lat = extreme_points[end_dist][card_points["south"]]
-            west_sector = stations_locs[
-                (stations_locs["Longitude"] < near_west_long)
-                & (stations_locs["Longitude"] > far_west_long)
-                & (stations_locs["Latitude"] < far_north_lat)
-                & (stations_locs["Latitude"] > far_south_lat)
-            ].copy()
-            if len(west_sector) > 0:
-                mean_long = (near_west_long + far_west_long) / 2
-                mean_lat = (far_north_lat + far_south_lat) / 2
-                central_west = (mean_lat, mean_long)
-                west_sector["Dist"] = west_sector["Coords"].map(
-                    lambda stat_coords: haversine(central_west, stat_coords)
-                )
-                station_ind = west_sector["Dist"].idxmin()
-                station_id = west_sector.loc[station_ind]["Id"]
-                while station_id in station_ids.values():
-                    west_sector.drop(station_ind, inplace=True)
-                    station_ind = west_sector["Dist"].idxmin()
-                    station_id = west_sector.loc[station_ind]["Id"]
-                station_ids["west"] = station_id
-
-            # EAST
-            near_east_long = extreme_points[start_dist][card_points["east"]]
-            far_east_long = extreme_points[end_dist][card_points["east"]]
-            far_north_lat = extreme_points[end_dist][card_points["north"]]
-            far_south_lat = extreme_points[end_dist][card_points["south"]]
-            east_sector = stations_locs[
-                (stations_locs["Longitude"] > near_east_long)
-                & (stations_locs["Longitude"] < far_east_long)
-                & (stations_locs["Latitude"] < far_north_lat)
-                & (stations_locs["Latitude"] > far_south_lat)
-            ].copy()
-            if len(east_sector) > 0:
-                mean_long = (near_east_long + far_east_long) / 2
-                mean_lat = (far_north_lat + far_south_lat) / 2
-                central_east = (mean_lat, mean_long)
-                east_sector["Dist"] = east_sector["Coords"].map(
-                    lambda stat_coords: haversine(central_east, stat_coords)
-                )
-                station_ind = east_sector["Dist"].idxmin()
-                station_id = east_sector.loc[station_ind]["Id"]
-                while station_id in station_ids.values():
-                    east_sector.drop(station_ind, inplace=True)
-                    station_ind = east_sector["Dist"].idxmin()
-                    station_id = east_sector.loc[station_ind]["Id"]
-                station_ids["east"] = station_id
-
-            # NORTH
-            near_north_lat = extreme_points[start_dist][card_points["north"]]
-            far_north_lat = extreme_points[end_dist][card_points["north"]]
-            far_west_long = extreme_points[end_dist][card_points["west"]]
-            far_east_long = extreme_points[end_dist][card_points["east"]]
-            north_sector = stations_locs[
-                (stations_locs["Longitude"] > far_west_long)
-                & (stations_locs["Longitude"] < far_east_long)
-                & (stations_locs["Latitude"] < far_north_lat)
-                & (stations_locs["Latitude"] > near_north_lat)
-            ].copy()
-            if len(north_sector) > 0:
-                mean_long = (near_east_long + far_east_long) / 2
-                mean_lat = (far_north_lat + near_north_lat) / 2
-                central_north = (mean_lat, mean_long)
-                north_sector["Dist"] = north_sector["Coords"].map(
-                    lambda stat_coords: haversine(central_north, stat_coords)
-                )
-                station_ind = north_sector["Dist"].idxmin()
-                station_id = north_sector.loc[station_ind]["Id"]
-                while station_id in station_ids.values():
-                    north_sector.drop(station_ind, inplace=True)
-                    station_ind = north_sector["Dist"].idxmin()
-                    station_id = north_sector.loc[station_ind]["Id"]
-                station_ids["north"] = station_id
-
-            # SOUTH
-            near_south_lat = extreme_points[start_dist][card_points["south"]]
-            far_south_lat = extreme_points[end_dist][card_points["south"]]
-            far_west_long = extreme_points[end_dist][card_points["west"]]
-            far_east_long = extreme_points[end_dist][card_points["east"]]
-            south_sector = stations_locs[
-                (stations_locs["Longitude"] > far_west_long)
-                & (stations_locs["Longitude"] < far_east_long)
-                & (stations_locs["Latitude"] > far_south_lat)
-                & (stations_locs["Latitude"] < near_south_lat)
-            ].copy()
-            if len(south_sector) > 0:
-                mean_long = (near_east_long + far_east_long) / 2
-                mean_lat = (far_south_lat + near_south_lat) / 2
-                central_south = (mean_lat, mean_long)
-                south_sector["Dist"] = south_sector["Coords"].map(
-                    lambda stat_coords: haversine(central_south, stat_coords)
-                )
-                station_ind = south_sector["Dist"].idxmin()
-                station_id = south_sector.loc[station_ind]["Id"]
-                while station_id in station_ids.values():
-                    south_sector.drop(station_ind, inplace=True)
-                    station_ind = south_sector["Dist"].idxmin()
-                    station_id = south_sector.loc[station_ind]["Id"]
-                station_ids["south"] = station_id
+            station_ids = {
+                card_point: None
+                for card_point in ["north", "south", "west", "east"]
+            }
+            for card_point, (mask, central_point) in sectors.items():
+                inds = np.flatnonzero(mask)
+                if len(inds) == 0:
+                    continue
+                central_dists = haversine_vector(
+                    [central_point],
+                    np.column_stack([stations_lat[inds], stations_long[inds]]),
+                    comb=True,
+                )[:, 0]
+                # The same station is not used for two sectors
+                for ind in inds[np.argsort(central_dists, kind="stable")]:
+                    if stations_ids[ind] not in station_ids.values():
+                        station_ids[card_point] = stations_ids[ind]
+                        break
 
             dist_station[f"{start_dist}-{end_dist}km"] = station_ids
 
         return dist_station
 
-    def _call_api(self, loc_coords: tuple([float, float])):
-        """Obtaining ERA5 data"""
+    def _execute_request(
+        self, url: str, data_types: list[str], dataset_type: str
+    ) -> list[pd.DataFrame]:
+        """Requesting historical or forecasted ERA5 data for one or several
+        locations"""
+        # The throttling is not a part of the upstream latency
+        self.rate_limiter.wait()
+        with span(
+            "era5.request", dataset_type=dataset_type, data_types=data_types
+        ) as request_span:
+            response = get_transport().get(url)
+            result = response.json()
+            request_span.set(bytes=len(response.content))
+        # The API returns a list only if several locations were requested
+        results = result if isinstance(result, list) else [result]
+        time_types = self._get_time_types(dataset_type)
+
+        def collect_data(result: dict) -> pd.DataFrame:
+            columns = {
+                key: val for key, val in time_types.items() if val in data_types
+            }
+            if dataset_type == "hourly":
+                return self._aggregate_hourly(result[dataset_type], columns)
 
-        lat, lng = loc_coords
-        era_data = pd.DataFrame(
-            {"date": pd.date_range(self.start_date, self.end_date)}
+            data = {
+                key: result[dataset_type][val] for key, val in columns.items()
+            }
+            data["date"] = pd.to_datetime(result[dataset_type]["time"])
+            data = pd.DataFrame(data)
+            # The daily aggregates are rounded as the hourly means
+            aggregated_cols = list(set(columns) & set(self.hourly_types))
+            data[aggregated_cols] = data[aggregated_cols].round()
+            return data
+
+        return [collect_data(result) for result in results]
+
+    def _get_time_types(self, dataset_type: str) -> dict[str, str]:
+        """Getting the column names and the API names of the variables that
+        are requested with the 'dataset_type' parameter"""
+        if dataset_type == "daily":
+            if self.use_daily_aggregates:
+                return self.daily_types | self.daily_aggregate_types
+            return self.daily_types
+        if self.use_daily_aggregates:
+            return {
+                key: val
+                for key, val in self.hourly_types.items()
+                if key not in self.daily_aggregate_types
+            }
+        return self.hourly_types
+
+    @staticmethod
+    def _aggregate_hourly(
+        hourly: dict[str, list], columns: dict[str, str]
+    ) -> pd.DataFrame:
+        """Getting rounded daily means from the hourly lists of the API
+        response"""
+        times = hourly["time"]
+        # The local days start at midnight and have 24 values each, so the
+        # lists are reshaped into (days, 24) blocks without building an hourly
+        # frame
+        if len(times) % 24 == 0 and all(
+            time.endswith("T00:00") for time in times[::24]
+        ):
+            data = {"date": pd.to_datetime(times[::24])}
+            with warnings.catch_warnings():
+                # The days without values give NaN
+                warnings.simplefilter("ignore", category=RuntimeWarning)
+                for key, val in columns.items():
+                    values = np.array(hourly[val], dtype=float)
+                    data[key] = np.nanmean(values.reshape(-1, 24), axis=1)
+            return pd.DataFrame(data).round()
+
+        data = pd.DataFrame(
+            {key: hourly[val] for key, val in columns.items()}, dtype=float
         )
+        data["date"] = pd.to_datetime(times)
+        data = data.resample("D", on="date").mean()
+        return data.round().reset_index()
 
-        # We request historical or forecasted ERA5 data
-        def execute_request(
-            url: str, data_types: list[str], dataset_type: str
-        ) -> pd.DataFrame:
-            response = requests.get(url)
-            if response.status_code != 200:
-                response.raise_for_status()
-            result = response.json()
+    def _request_data(
+        self,
+        stations_coords: list[tuple[float, float]],
+        dataset_type: str,
+        data_types: list[str],
+        start_date: str,
+    ) -> list[tuple[pd.DataFrame, pd.DataFrame]]:
+        """Requesting archive data for several locations at once and the
+        forecast for the days that are not in the archive yet"""
+
+        def join_coords(inds: list[int]) -> str:
+            lats = ",".join(str(stations_coords[i][0]) for i in inds)
+            lngs = ",".join(str(stations_coords[i][1]) for i in inds)
+            return f"latitude={lats}&longitude={lngs}"
+
+        def build_forecast_url(inds: list[int], start_date_fc: str) -> str:
+            return (
+                "https://api.open-meteo.com/v1/forecast?"
+                f"{join_coords(inds)}&"
+                f'{dataset_type}={",".join(data_types)}&windspeed_unit=ms&'
+                f"start_date={start_date_fc}&end_date={self.end_date}"
+                "&timezone=auto"
+            )
 
-            def collect_data(
-                dataset_type: str, time_types: dict
-            ) -> pd.DataFrame:
-                data = {}
-                for data_type in data_types:
-                    for key, val in time_types.items():
-                        if val == data_type:
-                            data[key] = result[dataset_type][data_type]
-                            break
-                data["date"] = pd.to_datetime(result[dataset_type]["time"])
-                return pd.DataFrame(data)
-
-            if dataset_type == "daily":
-                daily_data = collect_data(dataset_type, self.daily_types)
-                return daily_data
-
-            elif dataset_type == "hourly":
-                hourly_data = collect_data(dataset_type, self.hourly_types)
-                hourly_data = hourly_data.resample("D", on="date").mean()
-                return hourly_data.round().reset_index()
-
-        def obtain_data(dataset_type, data_types):
-            url_history = (
-                f"https://archive-api.open-meteo.com/v1/archive?latitude={lat}&"
-                f"longitude={lng}&start_date={self.start_date}&end_date="
-                f"{self.end_date}&{dataset_type}={','.join(data_types)}&"
-                "timezone=auto"
+        url_history = (
+            "https://archive-api.open-meteo.com/v1/archive?"
+            f"{join_coords(range(len(stations_coords)))}&"
+            f"start_date={start_date}&end_date={self.end_date}&"
+            f"{dataset_type}={','.join(data_types)}&timezone=auto"
+        )
+        end_date = datetime.strptime(self.end_date, self.TIME_FORMAT)
+        # The archive lags several days behind, so the forecast for the last
+        # 'forecast_days' is requested at the same time and used where needed
+        prefetch_start = max(
+            datetime.strptime(start_date, self.TIME_FORMAT),
+            end_date - timedelta(days=self.forecast_days - 1),
+        )
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            historical_future = executor.submit(
+                bind_context(self._execute_request),
+                url_history,
+                data_types,
+                dataset_type,
             )
-            historical_data = execute_request(
-                url_history, data_types, dataset_type
+            prefetched_future = None
+            if end_date >= datetime.today() - timedelta(
+                days=self.forecast_days
+            ):
+                prefetched_future = executor.submit(
+                    bind_context(self._execute_request),
+                    build_forecast_url(
+                        range(len(stations_coords)),
+                        prefetch_start.strftime(self.TIME_FORMAT),
+                    ),
+                    data_types,
+                    dataset_type,
+                )
+            historical_datasets = historical_future.result()
+            prefetched_datasets = (
+                prefetched_future.result()
+                if prefetched_future is not None
+                else None
             )
+
+        # The locations with the same first unknown date share the request
+        forecast_groups = {}
+        forecasted_datasets = [None] * len(stations_coords)
+        for i, historical_data in enumerate(historical_datasets):
             # There is a delay of several days in the data, so we remove
             # unknown data for recenst days
             last_idx = historical_data.drop("date", axis=1).last_valid_index()
-            historical_data = historical_data.loc[:last_idx]
+            if last_idx is None:
+                historical_data = historical_data.iloc[:0]
+                last_date = datetime.strptime(
+                    start_date, self.TIME_FORMAT
+                ) - timedelta(days=1)
+            else:
+                historical_data = historical_data.loc[:last_idx]
+                last_date = historical_data["date"].iloc[-1]
+            historical_datasets[i] = historical_data
+
             # We will use the weather forecast from the same data source to
             # fill in the gaps created by the delay of several days
-            last_date = historical_data["date"].iloc[-1]
-            if last_date == datetime.strptime(self.end_date, self.TIME_FORMAT):
-                return historical_data
-            else:
-                start_date_fc = str(
-                    (
-                        datetime.strptime(
-                            last_date.strftime(self.TIME_FORMAT),
-                            self.TIME_FORMAT,
-                        )
-                        + timedelta(days=1)
-                    ).strftime(self.TIME_FORMAT)
+            if last_date == end_date:
+                continue
+            start_date_fc = last_date + timedelta(days=1)
+            if (
+                prefetched_datasets is not None
+                and start_date_fc >= prefetch_start
+            ):
+                prefetched_data = prefetched_datasets[i]
+                forecasted_datasets[i] = prefetched_data[
+                    prefetched_data["date"] >= start_date_fc
+                ]
+            else:  # The delay is longer than 'forecast_days'
+                forecast_groups.setdefault(
+                    start_date_fc.strftime(self.TIME_FORMAT), []
+                ).append(i)
+
+        for start_date_fc, inds in forecast_groups.items():
+            for i, forecasted_data in zip(
+                inds,
+                self._execute_request(
+                    build_forecast_url(inds, start_date_fc),
+                    data_types,
+                    dataset_type,
+                ),
+            ):
+                forecasted_datasets[i] = forecasted_data
+
+        return list(zip(historical_datasets, forecasted_datasets))
+
+    def _obtain_data(
+        self,
+        stations_coords: list[tuple[float, float]],
+        dataset_type: str,
+        data_types: list[str],
+    ) -> list[pd.DataFrame]:
+        time_types = self._get_time_types(dataset_type)
+        columns = [key for key, val in time_types.items() if val in data_types]
+        stores = [
+            ERA5Store(loc_coords, dataset_type, columns, self.store_dir)
+            for loc_coords in stations_coords
+        ]
+
+        # Only the days that are not in the local stores are requested.
+        # The stores are locked in the same order to avoid deadlocks.
+        with ExitStack() as stack:
+            for store in sorted(stores, key=lambda store: str(store.path)):
+                stack.enter_context(store.lock())
+
+            fetch_groups = {}
+            for i, store in enumerate(stores):
+                fetch_start = store.get_fetch_start(
+                    self.start_date, self.end_date
                 )
-                url_fc = (
-                    "https://api.open-meteo.com/v1/forecast?"
-                    f"latitude={lat}&longitude={lng}&"
-                    f'{dataset_type}={",".join(data_types)}&windspeed_unit=ms&'
-                    f"start_date={start_date_fc}&end_date={self.end_date}"
-                    "&timezone=auto"
+                if fetch_start is not None:
+                    fetch_groups.setdefault(fetch_start, []).append(i)
+            num_misses = sum(len(inds) for inds in fetch_groups.values())
+            num_hits = len(stores) - num_misses
+            current_span().add(cache_hits=num_hits, cache_misses=num_misses)
+            record_cache_lookups("era5", num_hits, num_misses)
+
+            for fetch_start, inds in fetch_groups.items():
+                requested_data = self._request_data(
+                    [stations_coords[i] for i in inds],
+                    dataset_type,
+                    data_types,
+                    fetch_start,
                 )
-                forecasted_data = execute_request(
-                    url_fc, data_types, dataset_type
+                for i, (historical_data, forecasted_data) in zip(
+                    inds, requested_data
+                ):
+                    stores[i].update(
+                        self.start_date, historical_data, forecasted_data
+                    )
+
+            return [
+                store.read(self.start_date, self.end_date) for store in stores
+            ]
+
+    def _call_api_batch(
+        self, stations_coords: list[tuple[float, float]]
+    ) -> list[pd.DataFrame]:
+        """Obtaining ERA5 data for several locations with shared requests.
+        The number of locations should not exceed 'max_batch_size'."""
+        unique_coords = list(dict.fromkeys(stations_coords))
+        # All datasets are aligned on the same dates
+        dates = pd.date_range(self.start_date, self.end_date, name="date")
+        era_datasets = [pd.DataFrame(index=dates) for _ in unique_coords]
+
+        columns = [
+            key
+            for key, val in self.era_data_types.items()
+            if val in self.data_types
+        ]
+        time_types = self._get_time_types("daily")
+        daily_types = [time_types[key] for key in columns if key in time_types]
+        time_types = self._get_time_types("hourly")
+        hourly_types = [time_types[key] for key in columns if key in time_types]
+        # Daily and hourly data are requested at the same time
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            futures = [
+                executor.submit(
+                    bind_context(self._obtain_data),
+                    unique_coords,
+                    dataset_type,
+                    data_types,
                 )
-                return pd.concat([historical_data, forecasted_data])
+                for dataset_type, data_types in [
+                    ("daily", daily_types),
+                    ("hourly", hourly_types),
+                ]
+                if len(data_types) > 0
+            ]
+            for future in futures:
+                era_datasets = [
+                    era_data.join(data.set_index("date"), how="inner")
+                    for era_data, data in zip(era_datasets, future.result())
+                ]
 
-        daily_types = list(
-            set(self.daily_types.values()) & set(self.data_types)
-        )
-        hourly_types = list(
-            set(self.hourly_types.values()) & set(self.data_types)
+        era_datasets = dict(
+            zip(unique_coords, map(self._fill_era_data, era_datasets))
         )
+        return [era_datasets[loc_coords] for loc_coords in stations_coords]
 
-        if len(daily_types) > 0:
-            daily_data = obtain_data("daily", daily_types)
-            era_data = era_data.merge(daily_data, on="date")
-        if len(hourly_types) > 0:
-            hourly_data = obtain_data("hourly", hourly_types)
-            era_data = era_data.merge(hourly_data, on="date")
+    def _call_api(self, loc_coords: tuple([float, float])):
+        """Obtaining ERA5 data"""
+        return self._call_api_batch([tuple(loc_coords)])[0]
 
+    @staticmethod
+    def _fill_era_data(era_data: pd.DataFrame) -> pd.DataFrame:
         # There can be missing values on January 1, 1940, so we fill them in
-        era_data = era_data.set_index("date").interpolate(
+        era_data = era_data.interpolate(
             method="linear", limit_direction="backward"
         )
         # Some weather parameters are expressed in integer digits
         non_int_cols = {"precip_sum", "temp_min", "temp_max"}
         int_cols = list(set(era_data.columns) - non_int_cols)
-        era_data[int_cols] = era_data[int_cols].astype(int)
-        return era_data
+        return apply_dtypes(era_data, whole_number_columns=int_cols)
@@ -0,0 +1,38 @@
+import pandas as pd
+
+# The dtypes of the weather data at every stage of the pipeline. The frames
+# are kept for the whole forecast, so their size limits the number of
+# workers.
+
+# Temperatures, precipitation and the other measurements
+MEASUREMENT_DTYPE = "float32"
+# The parameters that ERA5Service rounds to whole numbers: the wind direction
+# (0-360 degrees), the pressure (hPa), the humidity and the cloud cover (%)
+# and the wind speed (m/s)
+WHOLE_NUMBER_DTYPE = "int16"
+# Binary and categorical features of the models
+FLAG_DTYPE = "int8"
+STATION_DTYPE = "category"
+
+# The columns that are not measurements
+KEY_COLUMNS = {"STATION", "DATE", "date"}
+
+
+def apply_dtypes(
+    data: pd.DataFrame, whole_number_columns: list[str] = []
+) -> pd.DataFrame:
+    """Casting the station identifiers to categories, the whole number
+    columns to small integers and the other measurements to the measurement
+    dtype. The frame is returned as is if it already has the dtypes."""
+    dtypes = {}
+    for col in data.columns:
+        if col == "STATION":
+            dtypes[col] = STATION_DTYPE
+        elif col in whole_number_columns:
+            dtypes[col] = WHOLE_NUMBER_DTYPE
+        elif col not in KEY_COLUMNS:
+            dtypes[col] = MEASUREMENT_DTYPE
+    dtypes = {
+        col: dtype for col, dtype in dtypes.items() if data[col].dtype != dtype
+    }
+    return data.astype(dtypes) if dtypes else data
@@ -0,0 +1,190 @@
+import itertools
+import json
+import logging
+import threading
+import time
+from contextvars import ContextVar, copy_context
+from functools import wraps
+from typing import Optional
+
+from ..config.config import logger
+from .metrics import STAGE_SPANS, UPSTREAM_SPANS, observe_span
+
+# The stages are logged by a child of the configured logger, so they can be
+# switched off by raising its level above INFO
+pipeline_logger = logger.getChild("pipeline")
+
+_trace_ids = itertools.count(1)
+_current_span: ContextVar[Optional["Span"]] = ContextVar(
+    "current_span", default=None
+)
+
+
+def _format_value(val) -> str:
+    if isinstance(val, float):
+        return f"{val:.3f}".rstrip("0").rstrip(".")
+    if isinstance(val, dict):
+        return ",".join(f"{key}:{item}" for key, item in val.items())
+    if isinstance(val, (list, tuple, set)):
+        return ",".join(str(item) for item in val)
+    text = str(val)
+    # Quoting only the values that would break 'key=value' pairs
+    return json.dumps(text) if " " in text or "=" in text else text
+
+
+def format_fields(fields: dict) -> str:
+    return " ".join(
+        f"{key}={_format_value(val)}" for key, val in fields.items()
+    )
+
+
+class Span:
+    """
+    A timed stage of the pipeline
+
+    ...
+
+    A span is logged with its duration and fields when it is exited. The
+    spans opened inside it are its children: their names are prefixed with
+    its name, and they share the trace identifier of the outermost span, so
+    the records of concurrent requests can be told apart. The durations of
+    the stages and the upstream requests are also recorded in the metrics
+    (see metrics.py).
+
+    Parameters
+    ----------
+    name : str
+        The name of the stage, for example 'noaa.fetch'.
+    fields : dict
+        The values that describe the stage: row counts, fetched bytes, cache
+        hits and misses and so on.
+    logged : bool
+        Whether the span is logged. The spans that are only measured for the
+        metrics are not logged.
+
+    Methods
+    -------
+    set -> None:
+        Setting the fields of the span.
+    add -> None:
+        Adding numbers to the fields of the span (counters).
+    event -> None:
+        Logging a progress event within the span.
+    """
+
+    def __init__(self, name: str, logged: bool = True, **fields):
+        self.metric_name = name
+        self.enabled = logged
+        self.fields = fields
+        self._lock = threading.Lock()
+        parent = _current_span.get()
+        if parent is None:
+            self.name, self.trace_id = name, next(_trace_ids)
+        else:
+            self.name = f"{parent.name}/{name}"
+            self.trace_id = parent.trace_id
+
+    def set(self, **fields) -> None:
+        self.fields.update(fields)
+
+    def add(self, **counters) -> None:
+        # The spans can be shared by worker threads
+        with self._lock:
+            for key, val in counters.items():
+                self.fields[key] = self.fields.get(key, 0) + val
+
+    def event(self, name: str, level: int = logging.INFO, **fields) -> None:
+        _log(level, f"{self.name}:{name}", self.trace_id, fields)
+
+    def __enter__(self) -> "Span":
+        self._token = _current_span.set(self)
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        duration = time.perf_counter() - self._start
+        _current_span.reset(self._token)
+        observe_span(self.metric_name, duration, exc_type is not None)
+        if not self.enabled:
+            return
+        if exc_type is not None:
+            self.fields["error"] = exc_type.__name__
+        self.fields["duration_ms"] = duration * 1000
+        _log(logging.INFO, self.name, self.trace_id, self.fields)
+
+
+class _NullSpan:
+    """The span that is used when the instrumentation is switched off"""
+
+    enabled = False
+
+    def set(self, **fields) -> None:
+        pass
+
+    def add(self, **counters) -> None:
+        pass
+
+    def event(self, name: str, level: int = logging.INFO, **fields) -> None:
+        pass
+
+    def __enter__(self) -> "_NullSpan":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        pass
+
+
+NULL_SPAN = _NullSpan()
+
+
+def _log(level: int, name: str, trace_id: Optional[int], fields: dict):
+    pipeline_logger.log(
+        level,
+        "%s trace=%s %s",
+        name,
+        trace_id,
+        format_fields(fields),
+        extra={"span": name, "trace_id": trace_id, "fields": dict(fields)},
+    )
+
+
+def span(name: str, **fields):
+    """Getting a context manager that times a stage. If the pipeline logger
+    does not log INFO, only the stages of the metrics are measured and
+    nothing is formatted."""
+    if pipeline_logger.isEnabledFor(logging.INFO):
+        return Span(name, **fields)
+    if name in STAGE_SPANS or name in UPSTREAM_SPANS:
+        return Span(name, logged=False)
+    return NULL_SPAN
+
+
+def current_span():
+    """Getting the innermost open span, so that the stages can add their
+    counters to it without passing it around"""
+    return _current_span.get() or NULL_SPAN
+
+
+def event(name: str, level: int = logging.INFO, **fields) -> None:
+    """Logging a progress event within the current span"""
+    if not pipeline_logger.isEnabledFor(level):
+        return
+    parent = _current_span.get()
+    if parent is not None:
+        parent.event(name, level, **fields)
+    else:
+        _log(level, name, None, fields)
+
+
+def bind_context(func):
+    """Running a function in worker threads with the spans of the caller.
+    The context is copied when the function is bound."""
+    context = copy_context()
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        # Every call needs its own copy, since a context cannot be entered
+        # by several threads at once
+        return context.copy().run(func, *args, **kwargs)
+
+    return wrapper
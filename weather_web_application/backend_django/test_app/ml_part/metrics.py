@@ -0,0 +1,414 @@
+import bisect
+import math
+import threading
+from contextlib import contextmanager
+
+# The upper bounds of the latency buckets in seconds. The stages take from
+# milliseconds (cached fetches) to minutes (LSTM training).
+LATENCY_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+    25,
+    50,
+    100,
+    250,
+    500,
+)
+# The quantiles that are estimated in the process, so they can be read
+# without a Prometheus server
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+def _format_number(val: float) -> str:
+    if math.isinf(val):
+        return "+Inf" if val > 0 else "-Inf"
+    return repr(float(val)) if val != int(val) else str(int(val))
+
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    pairs = ",".join(
+        '{}="{}"'.format(
+            key,
+            str(val)
+            .replace("\\", r"\\")
+            .replace("\n", r"\n")
+            .replace('"', r"\""),
+        )
+        for key, val in labels.items()
+    )
+    return "{" + pairs + "}"
+
+
+class Metric:
+    """
+    A base class of the metrics kept in the process memory
+
+    ...
+
+    Parameters
+    ----------
+    name : str
+        The name of the metric.
+    documentation : str
+        The description of the metric (HELP line).
+    labelnames : tuple[str]
+        The names of the labels. The values are kept for every combination of
+        the label values that was used.
+
+    Methods
+    -------
+    samples -> list[tuple[str, dict, float]]:
+        Getting the samples of the metric: names, labels and values.
+    render -> str:
+        Getting the metric in Prometheus text exposition format.
+    """
+
+    type_ = None
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(
+                f"The labels of '{self.name}' must be {self.labelnames}."
+            )
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _labels(self, key: tuple) -> dict:
+        return dict(zip(self.labelnames, key))
+
+    def samples(self) -> list[tuple[str, dict, float]]:
+        with self._lock:
+            return [
+                (self.name, self._labels(key), val)
+                for key, val in sorted(self._values.items())
+            ]
+
+    def render(self) -> str:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type_}",
+        ]
+        lines.extend(
+            f"{name}{_format_labels(labels)} {_format_number(val)}"
+            for name, labels, val in self.samples()
+        )
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    """A number that only grows: requests, errors, cache lookups"""
+
+    type_ = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        # A metric without labels is rendered before it is changed
+        if not self.labelnames:
+            self._values[()] = 0
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        if amount < 0:
+            raise ValueError("Counters can only be increased.")
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+
+class Gauge(Metric):
+    """A number that goes up and down: forecasts in progress, ratios"""
+
+    type_ = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        if not self.labelnames:
+            self._values[()] = 0
+
+    def set(self, val: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = val
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    def get(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    @contextmanager
+    def track_inprogress(self, **labels):
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+
+class Histogram(Metric):
+    """
+    The distribution of observed values in cumulative buckets
+
+    ...
+
+    Besides the buckets, the sums and the counts that Prometheus expects,
+    the quantiles estimated from the buckets are rendered as the
+    '<name>_quantile' gauge. They are interpolated linearly within a bucket
+    like histogram_quantile() of Prometheus does, so their precision is
+    limited by the bucket bounds.
+
+    Parameters
+    ----------
+    buckets : tuple[float]
+        The increasing upper bounds of the buckets. The '+Inf' bucket is
+        added.
+    quantiles : tuple[float]
+        The quantiles to estimate.
+
+    Methods
+    -------
+    observe -> None:
+        Adding a value to the distribution.
+    quantile -> float:
+        Estimating a quantile of the distribution.
+    """
+
+    type_ = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames=(),
+        buckets=LATENCY_BUCKETS,
+        quantiles=QUANTILES,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self.quantiles = quantiles
+
+    def observe(self, val: float, **labels) -> None:
+        key = self._key(labels)
+        # The first bucket whose bound is not less than the value
+        ind = bisect.bisect_left(self.buckets, val)
+        with self._lock:
+            counts, total = self._values.get(
+                key, ([0] * len(self.buckets), 0.0)
+            )
+            counts[ind] += 1
+            self._values[key] = (counts, total + val)
+
+    def quantile(self, q: float, **labels) -> float:
+        counts, _ = self._values.get(self._key(labels), (None, 0.0))
+        return self._estimate(q, counts)
+
+    def _estimate(self, q: float, counts: list[int]) -> float:
+        num_values = sum(counts) if counts else 0
+        if num_values == 0:
+            return math.nan
+        rank = q * num_values
+        cumulative = 0
+        for ind, count in enumerate(counts):
+            if cumulative + count >= rank and count > 0:
+                break
+            cumulative += count
+        upper = self.buckets[ind]
+        # The values of the '+Inf' bucket are only known to exceed the
+        # highest bound
+        if math.isinf(upper):
+            return self.buckets[-2]
+        lower = self.buckets[ind - 1] if ind > 0 else 0.0
+        return lower + (upper - lower) * (rank - cumulative) / count
+
+    def samples(self) -> list[tuple[str, dict, float]]:
+        with self._lock:
+            values = [
+                (key, list(counts), total)
+                for key, (counts, total) in sorted(self._values.items())
+            ]
+        samples = []
+        for key, counts, total in values:
+            labels = self._labels(key)
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                samples.append(
+                    (
+                        f"{self.name}_bucket",
+                        {**labels, "le": _format_number(bound)},
+                        cumulative,
+                    )
+                )
+            samples.append((f"{self.name}_sum", labels, total))
+            samples.append((f"{self.name}_count", labels, cumulative))
+        return samples
+
+    def render(self) -> str:
+        text = super().render()
+        if not self.quantiles:
+            return text
+        with self._lock:
+            values = [
+                (key, list(counts))
+                for key, (counts, _) in sorted(self._values.items())
+            ]
+        name = f"{self.name}_quantile"
+        lines = [
+            f"# HELP {name} The quantiles of {self.name} estimated from the "
+            "buckets.",
+            f"# TYPE {name} gauge",
+        ]
+        for key, counts in values:
+            labels = self._labels(key)
+            for q in self.quantiles:
+                val = self._estimate(q, counts)
+                lines.append(
+                    f"{name}{_format_labels({**labels, 'quantile': q})} "
+                    f"{'NaN' if math.isnan(val) else _format_number(val)}"
+                )
+        return "\n".join([text] + lines)
+
+
+class Registry:
+    """
+    The metrics of the process
+
+    ...
+
+    Every process (worker) keeps its own registry, so the metrics of
+    several workers have to be collected from every one of them.
+
+    Methods
+    -------
+    register -> Metric:
+        Adding a metric to the registry.
+    render -> str:
+        Getting all metrics in Prometheus text exposition format.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: Metric) -> Metric:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(
+                    f"The metric '{metric.name}' is already registered."
+                )
+            self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(metric.render() for metric in metrics) + "\n"
+
+
+registry = Registry()
+
+# The spans (see instrumentation.py) whose durations are observed. They are
+# measured even if the pipeline logger is switched off.
+STAGE_SPANS = {
+    "forecast",
+    "noaa.get_data",
+    "noaa.clean",
+    "era5.get_data",
+    "sarima.fit",
+    "holt_winters.fit",
+    "lstm.fit",
+    "lstm.predict",
+}
+# The spans of the requests to the upstream APIs and their services
+UPSTREAM_SPANS = {"noaa.request": "noaa", "era5.request": "open-meteo"}
+
+stage_duration = registry.register(
+    Histogram(
+        "forecast_stage_duration_seconds",
+        "The duration of the forecast pipeline stages.",
+        labelnames=("stage",),
+    )
+)
+upstream_requests = registry.register(
+    Counter(
+        "upstream_requests_total",
+        "The requests to the weather data APIs.",
+        labelnames=("service",),
+    )
+)
+upstream_errors = registry.register(
+    Counter(
+        "upstream_errors_total",
+        "The requests to the weather data APIs that failed.",
+        labelnames=("service",),
+    )
+)
+upstream_duration = registry.register(
+    Histogram(
+        "upstream_request_duration_seconds",
+        "The duration of the requests to the weather data APIs.",
+        labelnames=("service",),
+    )
+)
+cache_lookups = registry.register(
+    Counter(
+        "cache_lookups_total",
+        "The lookups of the local data caches.",
+        labelnames=("cache", "result"),
+    )
+)
+cache_hit_ratio = registry.register(
+    Gauge(
+        "cache_hit_ratio",
+        "The share of the cache lookups that were hits.",
+        labelnames=("cache",),
+    )
+)
+forecasts_in_flight = registry.register(
+    Gauge("forecasts_in_flight", "The forecasts that are being made.")
+)
+
+
+def observe_span(name: str, duration: float, failed: bool) -> None:
+    """Recording a span if it is a stage or an upstream request"""
+    if name in STAGE_SPANS:
+        stage_duration.observe(duration, stage=name)
+    service = UPSTREAM_SPANS.get(name)
+    if service is not None:
+        upstream_requests.inc(service=service)
+        upstream_duration.observe(duration, service=service)
+        if failed:
+            upstream_errors.inc(service=service)
+
+
+def record_cache_lookups(cache: str, hits: int, misses: int) -> None:
+    cache_lookups.inc(hits, cache=cache, result="hit")
+    cache_lookups.inc(misses, cache=cache, result="miss")
+    total_hits = cache_lookups.get(cache=cache, result="hit")
+    total = total_hits + cache_lookups.get(cache=cache, result="miss")
+    if total:
+        cache_hit_ratio.set(total_hits / total, cache=cache)
@@ -1,10 +1,13 @@
+import logging
 import warnings
 
 import numpy as np
 import pandas as pd
 import torch
 from sklearn.preprocessing import StandardScaler
-from tqdm import trange
+
+from .dtypes import FLAG_DTYPE, MEASUREMENT_DTYPE
+from .instrumentation import event, span
 
 
 def lstm(combined_dataset: pd.DataFrame) -> list[int]:
@@ -71,24 +74,19 @@ def lstm(combined_dataset: pd.DataFrame) -> list[int]:
         early_stopping=early_stopping,
     )
     lstm_trainer.fit(window.train, window.valid)
-    print(
-        "VALIDATION: Loss={loss:.4f} | Metric={accuracy:.2f}".format_map(
-            {
-                "loss": lstm_trainer.valid_loss[-early_stopping],
-                "accuracy": lstm_trainer.valid_acc[-early_stopping],
-            }
-        )
+    event(
+        "lstm.validation",
+        loss=lstm_trainer.valid_loss[-early_stopping],
+        metric=lstm_trainer.valid_acc[-early_stopping],
     )
     lstm_trainer.evaluate(window.test)
 
-    inputs = torch.unsqueeze(torch.Tensor(test_df[-input_width:].values), dim=0)
-    return [
-        int(i)
-        for i in (
-            np.round(lstm_trainer.best_model(inputs).detach().numpy()[0], 2)
-            * 100
+    with span("lstm.predict"):
+        inputs = torch.unsqueeze(
+            torch.Tensor(test_df[-input_width:].values), dim=0
         )
-    ]
+        preds = lstm_trainer.best_model(inputs).detach().numpy()[0]
+    return [int(i) for i in (np.round(preds, 2) * 100)]
 
 
 def data_preparation(df: pd.DataFrame) -> tuple[pd.DataFrame]:
@@ -101,7 +99,7 @@ def data_preparation(df: pd.DataFrame) -> tuple[pd.DataFrame]:
 
     for col in precip_sum_feats:
         dist_side = col.removesuffix("precip_sum")
-        df[dist_side + "precip"] = df[col].map(precip_coder).astype(int)
+        df[dist_side + "precip"] = df[col].map(precip_coder).astype(FLAG_DTYPE)
 
     # FOURIER TERMS
     # ==================================================================
@@ -111,8 +109,12 @@ def data_preparation(df: pd.DataFrame) -> tuple[pd.DataFrame]:
         day = 24 * 60 * 60
         year = (365.2425) * day
         # summer-winter and spring-autumn
-        new_df["year_sin"] = np.sin(timestamp_s * (2 * np.pi / year))
-        new_df["year_cos"] = np.cos(timestamp_s * (2 * np.pi / year))
+        new_df["year_sin"] = np.sin(timestamp_s * (2 * np.pi / year)).astype(
+            MEASUREMENT_DTYPE
+        )
+        new_df["year_cos"] = np.cos(timestamp_s * (2 * np.pi / year)).astype(
+            MEASUREMENT_DTYPE
+        )
         return new_df
 
     df = add_fourier_terms(df)
@@ -133,7 +135,9 @@ def data_preparation(df: pd.DataFrame) -> tuple[pd.DataFrame]:
         col for col in df.columns if col.endswith("winddirection_dominant")
     ]
     for col in winddir_feats:
-        df[col] = df[col].map(convert_degrees_to_wind_direction)
+        df[col] = (
+            df[col].map(convert_degrees_to_wind_direction).astype(FLAG_DTYPE)
+        )
 
     # TEMPERATURE
     # ==================================================================
@@ -161,6 +165,13 @@ def data_preparation(df: pd.DataFrame) -> tuple[pd.DataFrame]:
     precip_cols = [col for col in df.columns if col.endswith("precip")]
     non_scaled_feats = precip_cols + winddir_feats
     scaled_feats = list(set(df.columns) - set(non_scaled_feats))
+    # The scaler keeps float32, and the integer features would be scaled
+    # into float64
+    float_dtypes = {col: MEASUREMENT_DTYPE for col in scaled_feats}
+    train_df, valid_df, test_df = (
+        split_df.astype(float_dtypes)
+        for split_df in (train_df, valid_df, test_df)
+    )
 
     scaler = StandardScaler().set_output(transform="pandas")
     train_df[scaled_feats] = scaler.fit_transform(train_df[scaled_feats])
@@ -373,46 +384,16 @@ class Trainer:
         self.early_stopping_delta = early_stopping_delta
 
     def fit(self, train_data, valid_data):
-        model = self.start_model.to(self.device)
-        if self.scheduler is not None:
-            self.lrs = []
-        pbar = trange(self.epochs)
-        best_valid_loss, best_epoch = float("inf"), 0
-        for epoch in pbar:
-            # TRAINING
-            model.train()
-            epoch_loss, epoch_acc = 0, 0
-            for step, (inputs, labels) in enumerate(train_data):
-                inputs = inputs.to(self.device)
-                labels = labels.to(self.device)
-
-                preds = model(inputs)
-                labels = torch.squeeze(labels, dim=2)
-                loss_value = self.loss(preds, labels)
-                metric_value = self.metric(preds, labels)
-
-                epoch_loss += loss_value.item()
-                epoch_acc += metric_value.item()
-
-                loss_value.backward()
-
-                # Clip gradient
-                if self.gradient_clipping:
-                    torch.nn.utils.clip_grad_value_(
-                        model.parameters(), self.gradient_clipping
-                    )
-
-                self.optim.step()
-
-            self.optim.zero_grad()
-            self.train_loss.append(epoch_loss / len(train_data))
-            self.train_acc.append(epoch_acc / len(train_data))
-
-            with torch.no_grad():
-                # VALIDATION
-                model.eval()
+        with span("lstm.fit", max_epochs=self.epochs) as fit_span:
+            model = self.start_model.to(self.device)
+            if self.scheduler is not None:
+                self.lrs = []
+            best_valid_loss, best_epoch = float("inf"), 0
+            for epoch in range(self.epochs):
+                # TRAINING
+                model.train()
                 epoch_loss, epoch_acc = 0, 0
-                for step, (inputs, labels) in enumerate(valid_data):
+                for step, (inputs, labels) in enumerate(train_data):
                     inputs = inputs.to(self.device)
                     labels = labels.to(self.device)
 
@@ -424,32 +405,69 @@ class Trainer:
                     epoch_loss += loss_value.item()
                     epoch_acc += metric_value.item()
 
-                mean_valid_loss = epoch_loss / len(valid_data)
-                mean_valid_acc = epoch_acc / len(valid_data)
+                    loss_value.backward()
 
-                self.valid_loss.append(mean_valid_loss)
-                self.valid_acc.append(mean_valid_acc)
+                    # Clip gradient
+                    if self.gradient_clipping:
+                        torch.nn.utils.clip_grad_value_(
+                            model.parameters(), self.gradient_clipping
+                        )
 
-            if self.verbose and epoch % 10 == 0:
-                pbar.set_description(
-                    f"loss={mean_valid_loss:.6f}|"
-                    f"metric={mean_valid_acc:.2f}"
-                )
+                    self.optim.step()
+
+                self.optim.zero_grad()
+                self.train_loss.append(epoch_loss / len(train_data))
+                self.train_acc.append(epoch_acc / len(train_data))
+
+                with torch.no_grad():
+                    # VALIDATION
+                    model.eval()
+                    epoch_loss, epoch_acc = 0, 0
+                    for step, (inputs, labels) in enumerate(valid_data):
+                        inputs = inputs.to(self.device)
+                        labels = labels.to(self.device)
+
+                        preds = model(inputs)
+                        labels = torch.squeeze(labels, dim=2)
+                        loss_value = self.loss(preds, labels)
+                        metric_value = self.metric(preds, labels)
+
+                        epoch_loss += loss_value.item()
+                        epoch_acc += metric_value.item()
+
+                    mean_valid_loss = epoch_loss / len(valid_data)
+                    mean_valid_acc = epoch_acc / len(valid_data)
+
+                    self.valid_loss.append(mean_valid_loss)
+                    self.valid_acc.append(mean_valid_acc)
+
+                if self.verbose and epoch % 10 == 0:
+                    fit_span.event(
+                        "epoch",
+                        level=logging.DEBUG,
+                        epoch=epoch,
+                        loss=mean_valid_loss,
+                        metric=mean_valid_acc,
+                    )
 
-            if mean_valid_loss < best_valid_loss - self.early_stopping_delta:
-                best_valid_loss = mean_valid_loss
-                best_epoch = epoch
-                self.best_model = model
-            elif epoch - best_epoch >= self.early_stopping:
-                print(f"{self.early_stopping} epochs without improvements.")
-                print("Stop fitting...")
-                break
+                if (
+                    mean_valid_loss
+                    < best_valid_loss - self.early_stopping_delta
+                ):
+                    best_valid_loss = mean_valid_loss
+                    best_epoch = epoch
+                    self.best_model = model
+                elif epoch - best_epoch >= self.early_stopping:
+                    fit_span.set(early_stopped=True)
+                    break
+
+                if self.scheduler is not None:
+                    self.scheduler.step()
+                    self.lrs.append(
+                        self.optim.state_dict()["param_groups"][0]["lr"]
+                    )
 
-            if self.scheduler is not None:
-                self.scheduler.step()
-                self.lrs.append(
-                    self.optim.state_dict()["param_groups"][0]["lr"]
-                )
+            fit_span.set(epochs=len(self.train_loss), best_epoch=best_epoch)
 
     def evaluate(self, test_data: list[tuple]) -> None:
         # TEST
@@ -468,6 +486,8 @@ class Trainer:
                 test_loss += loss_value.item()
                 test_acc += metric_value.item()
 
-            print("TEST: ", end="")
-            print(f"Loss={test_loss / len(test_data):.4f}", end=" | ")
-            print(f"Metric={test_acc / len(test_data):.2f}")
+            event(
+                "lstm.test",
+                loss=test_loss / len(test_data),
+                metric=test_acc / len(test_data),
+            )
@@ -0,0 +1,53 @@
+import unicodedata
+from bisect import bisect_left, bisect_right
+
+import numpy as np
+
+
+def normalize(text: str) -> str:
+    """Getting a search key: accents are removed, the case is folded and
+    whitespaces are collapsed"""
+    text = unicodedata.normalize("NFKD", text)
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    return " ".join(text.casefold().split())
+
+
+class PrefixIndex:
+    """
+    Sorted in-memory index for the prefix search
+
+    ...
+
+    The keys are kept sorted, so the keys with the same prefix form a
+    contiguous run that is found with two binary searches.
+
+    Parameters
+    ----------
+    keys : list[str]
+        Normalized keys of the rows.
+
+    Methods
+    -------
+    search -> ndarray:
+        Getting the rows whose keys start with a prefix in the order of the
+        keys.
+    """
+
+    # The greatest code point, so every key with a prefix is less than
+    # the prefix followed by it
+    MAX_CHAR = "\U0010ffff"
+
+    def __init__(self, keys: list[str]):
+        order = sorted(range(len(keys)), key=keys.__getitem__)
+        self.keys = [keys[row] for row in order]
+        self.rows = np.array(order, dtype=int)
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def search(self, prefix: str, limit: int = None) -> np.ndarray:
+        start = bisect_left(self.keys, prefix)
+        end = bisect_right(self.keys, prefix + self.MAX_CHAR, lo=start)
+        if limit is not None:
+            end = min(end, start + limit)
+        return self.rows[start:end]
@@ -0,0 +1,104 @@
+from typing import Optional
+
+import numpy as np
+from sklearn.neighbors import BallTree
+
+
+class SpatialIndex:
+    """
+    Spatial index for the nearest neighbour search among locations
+
+    ...
+
+    The locations are put into a ball tree with the haversine metric, so the
+    k nearest locations are found without computing the distances to all of
+    them.
+
+    Parameters
+    ----------
+    lat : array-like
+        Latitudes of the locations in degrees.
+    lng : array-like
+        Longitudes of the locations in degrees.
+
+    Methods
+    -------
+    query -> tuple[ndarray, ndarray]:
+        Getting the row numbers of the nearest locations and the distances
+        (km) to them ordered by the distance.
+    query_nearest -> tuple[ndarray, ndarray]:
+        Getting the row numbers of the nearest location for many points at
+        once and the distances (km) to them.
+    """
+
+    # The same mean Earth radius as the haversine package uses
+    EARTH_RADIUS = 6371.0088
+
+    def __init__(self, lat, lng):
+        coords = np.radians(np.column_stack([lat, lng]).astype(float))
+        # A ball tree cannot be built without points
+        self.tree = (
+            BallTree(coords, metric="haversine") if len(coords) > 0 else None
+        )
+        self.num_locations = len(coords)
+
+    def __len__(self) -> int:
+        return self.num_locations
+
+    def query(
+        self,
+        loc_coords: tuple[float, float],
+        k: int = 1,
+        max_dist: Optional[float] = None,
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Getting up to 'k' nearest locations. The locations farther than
+        'max_dist' km are dropped, but the nearest one is always kept."""
+        if len(self) == 0:
+            return np.empty(0, dtype=int), np.empty(0, dtype=float)
+
+        dists, inds = self.tree.query(
+            np.radians([loc_coords]), k=min(k, len(self))
+        )
+        dists, inds = dists[0] * self.EARTH_RADIUS, inds[0]
+        if max_dist is not None:
+            is_near = dists < max_dist
+            is_near[0] = True
+            dists, inds = dists[is_near], inds[is_near]
+
+        return inds, dists
+
+    def query_nearest(self, lat, lng) -> tuple[np.ndarray, np.ndarray]:
+        """Getting the nearest location for every point in a single
+        query"""
+        if len(self) == 0:
+            raise ValueError("The index has no locations.")
+
+        coords = np.radians(np.column_stack([lat, lng]).astype(float))
+        if len(coords) == 0:
+            return np.empty(0, dtype=int), np.empty(0, dtype=float)
+        dists, inds = self.tree.query(coords, k=1)
+        return inds[:, 0], dists[:, 0] * self.EARTH_RADIUS
+
+
+def get_bounding_box(
+    loc_coords: tuple[float, float], radius: float
+) -> tuple[float, float, list[tuple[float, float]]]:
+    """Getting the latitude range and the longitude ranges (two if the box
+    crosses the antimeridian) that contain the circle of 'radius' km around
+    the location"""
+    lat, lng = loc_coords
+    angle = radius / SpatialIndex.EARTH_RADIUS
+    lat_delta = np.degrees(angle)
+    min_lat, max_lat = lat - lat_delta, lat + lat_delta
+    # The circle contains a pole or the box is wider than the Earth
+    ratio = np.sin(angle) / np.cos(np.radians(lat))
+    if min_lat <= -90 or max_lat >= 90 or angle >= np.pi / 2 or ratio >= 1:
+        return max(min_lat, -90), min(max_lat, 90), [(-180, 180)]
+
+    lng_delta = np.degrees(np.arcsin(ratio))
+    min_lng, max_lng = lng - lng_delta, lng + lng_delta
+    if min_lng < -180:
+        return min_lat, max_lat, [(min_lng + 360, 180), (-180, max_lng)]
+    if max_lng > 180:
+        return min_lat, max_lat, [(min_lng, 180), (-180, max_lng - 360)]
+    return min_lat, max_lat, [(min_lng, max_lng)]
@@ -7,17 +7,34 @@ import statsmodels.api as sm
 from scipy.optimize import minimize
 from sklearn.metrics import mean_absolute_error
 from sklearn.model_selection import TimeSeriesSplit
+from statsmodels.tsa.statespace.initialization import Initialization
 
+from .cache import HoltWintersParamsStore, SARIMAXStateStore
+from .instrumentation import current_span, span
 
-def sarima_and_es(series: pd.Series, test_size: int = 7) -> list[int]:
+# The fitted Holt-Winters parameters and SARIMA models of the stations
+params_store = HoltWintersParamsStore()
+sarima_store = SARIMAXStateStore()
+
+
+def sarima_and_es(
+    series: pd.Series, test_size: int = 7, station_id: str = None
+) -> list[int]:
     """Training SARIMA and ES on temperature time series and making predictions.
 
     Parameters
     ----------
     series (Series):
-        Temperature time series.
+        Temperature time series. Its name is the target of the stored
+        Holt-Winters parameters ('temp_max' or 'temp_min').
     test_size (int):
         The number of predicted days (default is 7).
+    station_id (str):
+        The station of the series. If it is passed, the Holt-Winters
+        parameters are taken from 'params_store' while they are fresh, and
+        the stale ones warm-start the fit. The SARIMA model is taken from
+        'sarima_store' and extended with the new observations
+        (default is None).
 
     Returns
     -------
@@ -28,8 +45,11 @@ def sarima_and_es(series: pd.Series, test_size: int = 7) -> list[int]:
         end=series.index[-1] + datetime.timedelta(days=test_size),
         freq="D",
     )
+    # The name is kept, since it is the target of the stored parameters
     empty_ser = pd.Series(
-        np.full(test_size, fill_value=np.NaN), index=future_dates
+        np.full(test_size, fill_value=np.NaN),
+        index=future_dates,
+        name=series.name,
     )
     series = pd.concat([series, empty_ser])
 
@@ -51,22 +71,157 @@ def sarima_and_es(series: pd.Series, test_size: int = 7) -> list[int]:
         exog_train.index.values, freq=exog_train.index.inferred_freq
     )
 
-    sarima = sm.tsa.statespace.SARIMAX(
-        y_train,
-        exog=exog_train,
+    with span("sarima.fit", rows=len(y_train)):
+        sarima_fc = forecast_sarima(
+            y_train, exog_train, y_test, exog_test, station_id=station_id
+        )
+    with span("holt_winters.fit", rows=len(series) - test_size):
+        es = fit_holt_winters(
+            series, test_size=test_size, station_id=station_id
+        )
+
+    es_fc = pd.Series(es.result[-test_size:], index=y_test.index)
+    comb_fc = (sarima_fc + es_fc) / 2
+
+    return list(np.around(comb_fc.values))
+
+
+def make_sarima(endog: pd.Series, exog: pd.DataFrame):
+    return sm.tsa.statespace.SARIMAX(
+        endog,
+        exog=exog,
         freq="D",
         order=(3, 0, 1),
         seasonal_order=(2, 1, 0, 7),
-    ).fit(disp=-1)
-    es = fitting(series, test_size=test_size, n_preds=0, verbose=False)
+    )
+
+
+def forecast_sarima(
+    y_train: pd.Series,
+    exog_train: pd.DataFrame,
+    y_test: pd.Series,
+    exog_test: pd.DataFrame,
+    station_id: str = None,
+) -> pd.Series:
+    """Forecasting with SARIMA. The models of the stations are kept in
+    'sarima_store': the observations that follow the stored state are
+    filtered with the stored parameters (like extend() of statsmodels), and
+    the model is fitted again only on a schedule or if its errors on the new
+    observations have grown."""
+    target = y_train.name
+    record = sarima_store.get(station_id, target) if station_id else None
+    start_date = y_train.index[0].strftime(sarima_store.TIME_FORMAT)
+    end_date = y_train.index[-1].strftime(sarima_store.TIME_FORMAT)
+    if (
+        record is not None
+        # The Fourier terms depend on the first date of the series
+        and record[0]["start_date"] == start_date
+        and record[0]["end_date"] <= end_date
+        and sarima_store.is_fresh(record[0])
+    ):
+        meta, arrays = record
+        new_dates = y_train.index > pd.Timestamp(meta["end_date"])
+        num_new_obs = int(new_dates.sum())
+        # The forecast days are filtered as missing observations
+        endog = pd.concat([y_train[new_dates], y_test])
+        endog.index = pd.DatetimeIndex(endog.index.values, freq="D")
+        exog = pd.concat([exog_train[new_dates], exog_test])
+        exog.index = endog.index
+        model = make_sarima(endog, exog)
+        model.ssm.initialization = Initialization(
+            model.k_states,
+            "known",
+            constant=arrays["state"],
+            stationary_cov=arrays["state_cov"],
+        )
+        results = model.filter(arrays["params"])
 
-    sarima_fc = sarima.predict(
+        meta["num_new_obs"] += num_new_obs
+        meta["new_abs_error"] += float(
+            np.abs(np.asarray(results.resid)[:num_new_obs]).sum()
+        )
+        if not sarima_store.has_drifted(meta):
+            current_span().set(model="extended", new_obs=num_new_obs)
+            if num_new_obs > 0:
+                meta["end_date"] = end_date
+                sarima_store.save(
+                    station_id,
+                    target,
+                    meta,
+                    params=arrays["params"],
+                    state=results.predicted_state[:, num_new_obs],
+                    state_cov=results.predicted_state_cov[:, :, num_new_obs],
+                )
+            return results.predict(start=y_test.index[0], end=y_test.index[-1])
+        current_span().set(drift=True)
+
+    current_span().set(model="fitted")
+    results = make_sarima(y_train, exog_train).fit(disp=-1)
+    if station_id:
+        sarima_store.save(
+            station_id,
+            target,
+            {
+                "start_date": start_date,
+                "end_date": end_date,
+                "fitted_on": datetime.date.today().strftime(
+                    sarima_store.TIME_FORMAT
+                ),
+                # The mean absolute one-step-ahead error after the
+                # differencing burn-in
+                "baseline_error": float(
+                    np.mean(
+                        np.abs(
+                            np.asarray(results.resid)[
+                                results.loglikelihood_burn :
+                            ]
+                        )
+                    )
+                ),
+                "num_new_obs": 0,
+                "new_abs_error": 0.0,
+            },
+            params=results.params.to_numpy(),
+            state=results.predicted_state[:, -1],
+            state_cov=results.predicted_state_cov[:, :, -1],
+        )
+    return results.predict(
         start=y_test.index[0], end=y_test.index[-1], exog=exog_test
     )
-    es_fc = pd.Series(es.result[-test_size:], index=y_test.index)
-    comb_fc = (sarima_fc + es_fc) / 2
 
-    return list(np.around(comb_fc.values))
+
+def fit_holt_winters(
+    series: pd.Series, test_size: int = 7, station_id: str = None, slen=365
+) -> "HoltWinters":
+    """Fitting Holt-Winters with the parameters of the station: the fresh
+    stored parameters are used as they are, the stale ones warm-start the
+    optimizer, and the newly fitted ones are stored"""
+    record = params_store.get(station_id, series.name) if station_id else None
+    if params_store.is_fresh(record):
+        current_span().set(params="stored")
+        return fitting(
+            series,
+            test_size=test_size,
+            slen=slen,
+            n_preds=0,
+            verbose=False,
+            params=record["params"],
+        )
+
+    current_span().set(params="warm_start" if record else "cold_start")
+    es = fitting(
+        series,
+        test_size=test_size,
+        slen=slen,
+        n_preds=0,
+        verbose=False,
+        x0=record["params"] if record else (0, 0, 0),
+    )
+    if station_id:
+        params_store.save(
+            station_id, series.name, (es.alpha, es.beta, es.gamma)
+        )
+    return es
 
 
 class HoltWinters:
@@ -80,6 +235,9 @@ class HoltWinters:
     # n_preds - predictions horizon
     # scaling_factor - sets the width of the confidence interval by Brutlag (usually takes values from 2 to 3)
 
+    # The outputs (result, Smooth, Trend, Season, PredictedDeviation,
+    # UpperBond and LowerBond) are arrays of len(series) + n_preds values
+
     """
 
     def __init__(
@@ -102,111 +260,108 @@ class HoltWinters:
         self.test_size = test_size
         self.scaling_factor = scaling_factor
 
+    # The sums are accumulated in order (np.cumsum) rather than pairwise
+    # (np.sum), so the components are the same as the ones of the former
+    # loops to the last bit. fitting() is sensitive to these bits: its
+    # optimizer starts on the bounds, where the loss is flat.
+
     def initial_trend(self):
-        sum = 0.0
-        for i in range(self.slen):
-            sum += (
-                float(self.series[i + self.slen] - self.series[i]) / self.slen
-            )
-        return sum / self.slen
+        # The differences are taken in the dtype of the series
+        values = np.asarray(self.series)
+        diffs = values[self.slen : 2 * self.slen] - values[: self.slen]
+        return np.cumsum(diffs.astype(float) / self.slen)[-1] / self.slen
 
     def initial_seasonal_components(self):
-        seasonals = {}
-        season_averages = []
-        n_seasons = int(len(self.series) / self.slen)
-        # let's calculate season averages
-        for j in range(n_seasons):
-            season_averages.append(
-                sum(self.series[self.slen * j : self.slen * j + self.slen])
-                / float(self.slen)
-            )
-        # let's calculate initial values
-        for i in range(self.slen):
-            sum_of_vals_over_avg = 0.0
-            for j in range(n_seasons):
-                sum_of_vals_over_avg += (
-                    self.series[self.slen * j + i] - season_averages[j]
-                )
-            seasonals[i] = sum_of_vals_over_avg / n_seasons
-        return seasonals
+        values = np.asarray(self.series, dtype=float)
+        n_seasons = int(len(values) / self.slen)
+        # The rows of the matrix are the seasons
+        seasons = values[: n_seasons * self.slen].reshape(n_seasons, self.slen)
+        season_averages = np.cumsum(seasons, axis=1)[:, -1] / float(self.slen)
+        # The initial value of every day of the season is its average
+        # deviation from the season averages
+        return (
+            np.cumsum(seasons - season_averages[:, None], axis=0)[-1]
+            / n_seasons
+        )
 
     def triple_exponential_smoothing(self):
-        self.result = []
-        self.Smooth = []
-        self.Season = []
-        self.Trend = []
-        self.PredictedDeviation = []
-        self.UpperBond = []
-        self.LowerBond = []
-
-        seasonals = self.initial_seasonal_components()
-
-        for i in range(len(self.series) + self.n_preds):
-            if i == 0:  # components initialization
-                smooth = self.series[0]
-                trend = self.initial_trend()
-                self.result.append(self.series[0])
-                self.Smooth.append(smooth)
-                self.Trend.append(trend)
-                self.Season.append(seasonals[i % self.slen])
-
-                self.PredictedDeviation.append(0)
-
-                self.UpperBond.append(
-                    self.result[0]
-                    + self.scaling_factor * self.PredictedDeviation[0]
-                )
-
-                self.LowerBond.append(
-                    self.result[0]
-                    - self.scaling_factor * self.PredictedDeviation[0]
-                )
-                continue
-
-            if i >= len(self.series):  # predicting
-                m = i - len(self.series) + 1
-                self.result.append(
-                    (smooth + m * trend) + seasonals[i % self.slen]
-                )
-
-                # when predicting we increase uncertainty on each step
-                self.PredictedDeviation.append(
-                    self.PredictedDeviation[-1] * 1.01
-                )
-
-            else:
-                val = self.series[i]
-                last_smooth, smooth = smooth, self.alpha * (
-                    val - seasonals[i % self.slen]
-                ) + (1 - self.alpha) * (smooth + trend)
-                trend = (
-                    self.beta * (smooth - last_smooth) + (1 - self.beta) * trend
-                )
-                seasonals[i % self.slen] = (
-                    self.gamma * (val - smooth)
-                    + (1 - self.gamma) * seasonals[i % self.slen]
-                )
-                self.result.append(smooth + trend + seasonals[i % self.slen])
-
-                # Deviation is calculated according to Brutlag algorithm.
-                self.PredictedDeviation.append(
-                    self.gamma * np.abs(self.series[i] - self.result[i])
-                    + (1 - self.gamma) * self.PredictedDeviation[-1]
-                )
-
-            self.UpperBond.append(
-                self.result[-1]
-                + self.scaling_factor * self.PredictedDeviation[-1]
+        values = np.asarray(self.series, dtype=float)
+        n_values = len(values)
+        n_total = n_values + self.n_preds
+        alpha, beta, gamma = map(float, (self.alpha, self.beta, self.gamma))
+        slen = self.slen
+
+        # The outputs are preallocated. The recursion over the observed values
+        # runs on Python floats, which are faster to index and update one by
+        # one than the array elements.
+        self.result = np.empty(n_total)
+        self.Smooth = np.empty(n_total)
+        self.Season = np.empty(n_total)
+        self.Trend = np.empty(n_total)
+        self.PredictedDeviation = np.empty(n_total)
+
+        seasonals = self.initial_seasonal_components().tolist()
+        series = values.tolist()
+        result = [0.0] * n_values
+        smooths = [0.0] * n_values
+        trends = [0.0] * n_values
+        season = [0.0] * n_values
+        deviations = [0.0] * n_values
+
+        # Components initialization
+        smooth = series[0]
+        trend = float(self.initial_trend())
+        result[0], smooths[0], trends[0] = series[0], smooth, trend
+        season[0] = seasonals[0]
+        deviation = 0.0
+
+        one_alpha, one_beta, one_gamma = 1 - alpha, 1 - beta, 1 - gamma
+        for i in range(1, n_values):
+            val = series[i]
+            ind = i % slen
+            last_smooth = smooth
+            smooth = alpha * (val - seasonals[ind]) + one_alpha * (
+                smooth + trend
             )
-
-            self.LowerBond.append(
-                self.result[-1]
-                - self.scaling_factor * self.PredictedDeviation[-1]
+            trend = beta * (smooth - last_smooth) + one_beta * trend
+            seasonal = seasonals[ind] = (
+                gamma * (val - smooth) + one_gamma * seasonals[ind]
             )
-
-            self.Smooth.append(smooth)
-            self.Trend.append(trend)
-            self.Season.append(seasonals[i % self.slen])
+            res = result[i] = smooth + trend + seasonal
+            # Deviation is calculated according to Brutlag algorithm.
+            deviation = deviations[i] = (
+                gamma * abs(val - res) + one_gamma * deviation
+            )
+            smooths[i] = smooth
+            trends[i] = trend
+            season[i] = seasonal
+
+        self.result[:n_values] = result
+        self.Smooth[:n_values] = smooths
+        self.Trend[:n_values] = trends
+        self.Season[:n_values] = season
+        self.PredictedDeviation[:n_values] = deviations
+
+        # The components are not updated when predicting, so the predictions
+        # are computed at once
+        if self.n_preds > 0:
+            seasonals = np.array(seasonals)[np.arange(n_values, n_total) % slen]
+            steps = np.arange(1, self.n_preds + 1)
+            self.result[n_values:] = (smooth + steps * trend) + seasonals
+            self.Smooth[n_values:] = smooth
+            self.Trend[n_values:] = trend
+            self.Season[n_values:] = seasonals
+            # When predicting we increase uncertainty on each step
+            growth = np.full(self.n_preds, 1.01)
+            growth[0] = deviation * 1.01
+            self.PredictedDeviation[n_values:] = np.cumprod(growth)
+
+        self.UpperBond = (
+            self.result + self.scaling_factor * self.PredictedDeviation
+        )
+        self.LowerBond = (
+            self.result - self.scaling_factor * self.PredictedDeviation
+        )
 
 
 def timeseriesCVscore(
@@ -249,24 +404,219 @@ def timeseriesCVscore(
     return np.mean(np.array(errors))
 
 
-def fitting(series, n_preds=10, test_size=10, slen=365, verbose=True):
+class HoltWintersCV:
+    """
+    Cross-validation errors of Holt-Winters models for batches of parameters
+
+    ...
+
+    The folds of TimeSeriesSplit and the initial components of every fold
+    are computed once. The smoothing runs over the series once for all
+    candidates and folds: the components of the candidates are the columns
+    of arrays, and the folds are dropped from the arrays when their training
+    part ends (the folds are growing windows). The errors are the same as
+    the ones of timeseriesCVscore with mean_absolute_error.
+
+    Parameters
+    ----------
+    series : Series | ndarray
+        The time series.
+    slen : int
+        The length of a season.
+    n_splits : int
+        The number of folds.
+
+    Methods
+    -------
+    score -> ndarray:
+        Getting the mean absolute errors of the candidates.
+    """
+
+    def __init__(self, series, slen: int = 365, n_splits: int = 3):
+        self.values = np.asarray(series)
+        self.slen = slen
+        # The training parts of the folds start at the beginning of the
+        # series, so a fold is described by its length and its test part
+        self.folds = []
+        for train, test in TimeSeriesSplit(n_splits=n_splits).split(
+            self.values
+        ):
+            model = HoltWinters(
+                self.values[train],
+                slen=slen,
+                alpha=0,
+                beta=0,
+                gamma=0,
+                n_preds=len(test),
+                test_size=len(test),
+            )
+            self.folds.append(
+                (
+                    len(train),
+                    self.values[test].astype(float),
+                    float(model.initial_trend()),
+                    model.initial_seasonal_components(),
+                )
+            )
+
+    def score(self, params) -> np.ndarray:
+        """Getting the errors of the candidates (the rows of 'params' with
+        alpha, beta and gamma) averaged over the folds"""
+        params = np.asarray(params, dtype=float).reshape(-1, 3)
+        n_candidates, n_folds = len(params), len(self.folds)
+        series = self.values.astype(float)
+        slen = self.slen
+
+        # The columns are the candidates of the first fold, then the ones of
+        # the second fold and so on
+        alpha, beta, gamma = np.tile(params, (n_folds, 1)).T
+        one_alpha, one_beta, one_gamma = 1 - alpha, 1 - beta, 1 - gamma
+        smooth = np.full(n_candidates * n_folds, series[0])
+        trend = np.repeat(
+            [trend for _, _, trend, _ in self.folds], n_candidates
+        )
+        seasonals = np.repeat(
+            np.stack([seasonals for _, _, _, seasonals in self.folds], axis=1),
+            n_candidates,
+            axis=1,
+        )
+
+        errors = np.zeros(n_candidates)
+        fold_ind = 0
+        for i in range(1, self.folds[-1][0] + 1):
+            # The folds whose training part has ended are predicted and
+            # dropped
+            while fold_ind < n_folds and self.folds[fold_ind][0] == i:
+                _, actual, _, _ = self.folds[fold_ind]
+                steps = np.arange(1, len(actual) + 1)
+                season = seasonals[(i + steps - 1) % slen, :n_candidates]
+                predictions = (
+                    smooth[:n_candidates]
+                    + steps[:, None] * trend[:n_candidates]
+                ) + season
+                errors += np.abs(predictions - actual[:, None]).mean(axis=0)
+                alpha, beta, gamma = (
+                    alpha[n_candidates:],
+                    beta[n_candidates:],
+                    gamma[n_candidates:],
+                )
+                one_alpha, one_beta, one_gamma = (
+                    one_alpha[n_candidates:],
+                    one_beta[n_candidates:],
+                    one_gamma[n_candidates:],
+                )
+                smooth = smooth[n_candidates:]
+                trend = trend[n_candidates:]
+                seasonals = seasonals[:, n_candidates:]
+                fold_ind += 1
+            if fold_ind == n_folds:
+                break
+
+            val = series[i]
+            ind = i % slen
+            season = seasonals[ind]
+            last_smooth = smooth
+            smooth = alpha * (val - season) + one_alpha * (smooth + trend)
+            trend = beta * (smooth - last_smooth) + one_beta * trend
+            seasonals[ind] = gamma * (val - smooth) + one_gamma * season
+
+        return errors / n_folds
+
+
+def fit_coarse_to_fine(
+    cv: HoltWintersCV,
+    grid_size: int = 11,
+    refine_size: int = 7,
+    n_best: int = 4,
+    tol: float = 1e-3,
+) -> tuple[np.ndarray, float]:
+    """Finding the parameters with the least error on a grid over [0, 1]^3.
+    The grid is refined around the 'n_best' best candidates until its step
+    is less than 'tol', so that a single rough basin of the error does not
+    decide the result. Every level is evaluated as one batch.
+
+    Returns
+    -------
+    tuple: The best parameters (alpha, beta, gamma) and their error.
+    """
+
+    def make_grid(axes: list[np.ndarray]) -> np.ndarray:
+        return np.stack(
+            [grid.ravel() for grid in np.meshgrid(*axes, indexing="ij")],
+            axis=1,
+        )
+
+    candidates = make_grid([np.linspace(0, 1, grid_size)] * 3)
+    step = 1 / (grid_size - 1)
+    while True:
+        errors = cv.score(candidates)
+        best_inds = np.argsort(errors)[:n_best]
+        if step < tol:
+            return candidates[best_inds[0]], errors[best_inds[0]]
+        # The next grids span the neighbouring points of the best candidates
+        candidates = np.unique(
+            np.concatenate(
+                [
+                    make_grid(
+                        [
+                            np.linspace(
+                                max(val - step, 0),
+                                min(val + step, 1),
+                                refine_size,
+                            )
+                            for val in candidates[ind]
+                        ]
+                    )
+                    for ind in best_inds
+                ]
+            ),
+            axis=0,
+        )
+        step = 2 * step / (refine_size - 1)
+
+
+def fitting(
+    series,
+    n_preds=10,
+    test_size=10,
+    slen=365,
+    verbose=True,
+    method="tnc",
+    x0=(0, 0, 0),
+    params=None,
+):
+    """Fitting the parameters of Holt-Winters on the series without the
+    last 'test_size' values and training the model with them.
+
+    The 'tnc' method minimizes timeseriesCVscore with TNC starting from
+    'x0' (the parameters of the previous fit can be passed to warm-start
+    it). The 'grid' method evaluates grids of candidates in batches and
+    refines the grid around the best one (see fit_coarse_to_fine), so it
+    needs no numerical gradients. If 'params' (alpha, beta, gamma) are
+    passed, the model is trained with them without fitting.
+    """
     data = series.copy()
     train_data = data[:-test_size]
 
-    # initializing model parameters alpha, beta and gamma
-    x = [0, 0, 0]
-
-    # Minimizing the loss function
-    opt = minimize(
-        timeseriesCVscore,
-        x0=x,
-        args=(train_data, mean_absolute_error, test_size, slen),
-        method="TNC",
-        bounds=((0, 1), (0, 1), (0, 1)),  # bounds for params
-    )
+    if params is not None:
+        pass
+    elif method == "grid":
+        cv = HoltWintersCV(train_data, slen=slen)
+        params, _ = fit_coarse_to_fine(cv)
+    elif method == "tnc":
+        # Minimizing the loss function
+        params = minimize(
+            timeseriesCVscore,
+            x0=list(x0),
+            args=(train_data, mean_absolute_error, test_size, slen),
+            method="TNC",
+            bounds=((0, 1), (0, 1), (0, 1)),  # bounds for params
+        ).x
+    else:
+        raise ValueError("'method' must be 'tnc' or 'grid'.")
 
     # Take optimal values...
-    alpha_final, beta_final, gamma_final = opt.x
+    alpha_final, beta_final, gamma_final = params
     if verbose:
         print(
             "alpha=%f, beta=%f, gamma=%f"
@@ -0,0 +1,161 @@
+import random
+import threading
+import time
+from typing import Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class BaseTransport:
+    """
+    A base class for the transports that the services use to call the
+    weather APIs
+
+    A transport has to return an object with the interface of
+    requests.Response for the status codes below 400 and raise
+    requests.HTTPError otherwise. Local stand-ins (for example, the ones that
+    read saved responses) are installed with set_transport().
+    """
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        raise NotImplementedError(
+            "This method must be overridden in child classes"
+        )
+
+
+class HTTPTransport(BaseTransport):
+    """
+    Pooled HTTP transport with keep-alive connections, compression, timeouts
+    and bounded retries
+
+    ...
+
+    Parameters
+    ----------
+    timeout : float | tuple[float, float], default=(5, 60)
+        Connect and read timeouts in seconds.
+    max_retries : int, default=3
+        The number of additional attempts after connection errors, timeouts
+        and the responses with RETRY_STATUSES.
+    backoff_factor : float, default=0.5
+        The base of the exponential delay between attempts. The delay is
+        drawn uniformly from [0, backoff_factor * 2 ** attempt] (full
+        jitter), so that concurrent workers do not retry at the same time.
+    max_backoff : float, default=10
+        The upper bound of the delay between attempts.
+    pool_size : int, default=20
+        The number of connections kept alive for each host.
+    """
+
+    RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+    def __init__(
+        self,
+        timeout=(5, 60),
+        max_retries: int = 3,
+        backoff_factor: float = 0.5,
+        max_backoff: float = 10,
+        pool_size: int = 20,
+    ):
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+
+        self.session = requests.Session()
+        # Retries are made here rather than by urllib3 to add jitter
+        adapter = HTTPAdapter(
+            pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0
+        )
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({"Accept-Encoding": "gzip, deflate"})
+
+    def get_backoff(
+        self, attempt: int, response: Optional[requests.Response] = None
+    ) -> float:
+        # The server can tell how long to wait
+        if response is not None and "Retry-After" in response.headers:
+            try:
+                return min(
+                    float(response.headers["Retry-After"]), self.max_backoff
+                )
+            except ValueError:
+                pass
+        return random.uniform(
+            0, min(self.backoff_factor * 2**attempt, self.max_backoff)
+        )
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        kwargs.setdefault("timeout", self.timeout)
+        for attempt in range(self.max_retries + 1):
+            response = None
+            try:
+                response = self.session.get(url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt == self.max_retries:
+                    raise
+            else:
+                if (
+                    response.status_code not in self.RETRY_STATUSES
+                    or attempt == self.max_retries
+                ):
+                    response.raise_for_status()
+                    return response
+                response.close()
+            time.sleep(self.get_backoff(attempt, response))
+
+
+class RateLimiter:
+    """
+    Limiting the rate of requests made from several threads
+
+    ...
+
+    Parameters
+    ----------
+    requests_per_second : float
+        The maximum number of requests started per second. The requests are
+        spread evenly, i.e. they start at least 1 / requests_per_second
+        seconds apart.
+    """
+
+    def __init__(self, requests_per_second: float):
+        self.interval = 1 / requests_per_second
+        self.next_time = time.monotonic()
+        self.lock = threading.Lock()
+
+    def wait(self) -> None:
+        """Blocking until the next request is allowed"""
+        with self.lock:
+            now = time.monotonic()
+            start_time = max(now, self.next_time)
+            self.next_time = start_time + self.interval
+        if start_time > now:
+            time.sleep(start_time - now)
+
+
+_transport = None
+# The services call get_transport() from worker threads, and only one
+# transport (one connection pool) may be created
+_transport_lock = threading.Lock()
+
+
+def get_transport() -> BaseTransport:
+    """Getting the transport shared by all services"""
+    global _transport
+    transport = _transport
+    if transport is None:
+        with _transport_lock:
+            if _transport is None:
+                _transport = HTTPTransport()
+            transport = _transport
+    return transport
+
+
+def set_transport(transport: Optional[BaseTransport]) -> None:
+    """Replacing the shared transport. None restores the default one."""
+    global _transport
+    with _transport_lock:
+        _transport = transport
@@ -1,11 +1,54 @@
+from typing import Optional
+
+import numpy as np
 from django.conf import settings
 from django.db import models
+from haversine import haversine_vector
+
+from .ml_part.search import normalize
+from .ml_part.spatial import SpatialIndex, get_bounding_box
+
+
+class LocationQuerySet(models.QuerySet):
+    def nearest(
+        self, lat: float, lng: float, radius: float = 25
+    ) -> Optional[tuple[models.Model, float]]:
+        """Getting the nearest location and the distance (km) to it.
+
+        Only the locations within a bounding box are fetched with the index
+        on coordinates, and the box is expanded until it has a location
+        within 'radius' km."""
+        max_radius = np.pi * SpatialIndex.EARTH_RADIUS
+        while True:
+            min_lat, max_lat, lng_ranges = get_bounding_box((lat, lng), radius)
+            lng_filter = models.Q()
+            for min_lng, max_lng in lng_ranges:
+                lng_filter |= models.Q(lng__range=(min_lng, max_lng))
+            candidates = list(
+                self.filter(lng_filter, lat__range=(min_lat, max_lat))
+            )
+            if candidates:
+                dists = haversine_vector(
+                    [(lat, lng)],
+                    [(location.lat, location.lng) for location in candidates],
+                    comb=True,
+                )[:, 0]
+                # A closer location can be outside the box only if the
+                # nearest candidate is outside the circle
+                ind = int(np.argmin(dists))
+                if dists[ind] <= radius or radius >= max_radius:
+                    return candidates[ind], float(dists[ind])
+            if radius >= max_radius:
+                return None
+            radius *= 4
 
 
 class Location(models.Model):
     lat = models.FloatField()
     lng = models.FloatField()
 
+    objects = LocationQuerySet.as_manager()
+
     class Meta:
         # It will cause a single table to be generated from a subclass
         # with added columns from this base class
@@ -22,16 +65,34 @@ class Station(Location):
 class City(Location):
     name = models.CharField(max_length=50)
     country = models.CharField(max_length=50)
-    nearest_station = models.OneToOneField(
+    # Many cities can share a station. It is filled with the
+    # fill_nearest_stations command.
+    nearest_station = models.ForeignKey(
         Station, null=True, on_delete=models.SET_NULL
     )
+    # Normalized names for the case- and accent-insensitive search. They are
+    # set on save(), so the rows added with bulk_create() must have them set.
+    search_name = models.CharField(max_length=50, default="", editable=False)
+    search_country = models.CharField(max_length=50, default="", editable=False)
 
     class Meta:
         db_table = "world_cities"
+        indexes = [
+            models.Index(fields=["lat", "lng"], name="city_coords_idx"),
+            models.Index(
+                fields=["search_name", "search_country"],
+                name="city_search_idx",
+            ),
+        ]
 
     def __str__(self) -> str:
         return f"{self.name}, {self.country}"
 
+    def save(self, *args, **kwargs):
+        self.search_name = normalize(self.name)
+        self.search_country = normalize(self.country)
+        super().save(*args, **kwargs)
+
 
 class Datetime(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
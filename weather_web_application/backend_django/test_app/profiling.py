@@ -0,0 +1,164 @@
+import cProfile
+import io
+import pstats
+import re
+import time
+from datetime import datetime
+from functools import wraps
+from pathlib import Path
+
+from django.conf import settings
+from django.http import HttpRequest, HttpResponse
+
+from .config.config import MAX_PROFILES, PROFILES_DIR
+
+# The request is profiled if it has the header or the query parameter
+PROFILE_HEADER = "X-Profile"
+PROFILE_PARAM = "profile"
+# The response header with the name of the stored report
+REPORT_HEADER = "X-Profile-Report"
+
+# The groups of the functions in the report summary. The names of the
+# built-in functions are matched for the network and the thread waits, the
+# paths of the files for the libraries.
+LIBRARY_GROUPS = [
+    (
+        "network",
+        re.compile(
+            r"_socket|_ssl|select\.|selectors|urllib3|requests/|http/client"
+        ),
+    ),
+    (
+        "thread waits",
+        re.compile(r"_thread\.lock|threading\.py|concurrent/futures"),
+    ),
+    ("pandas", re.compile(r"pandas/")),
+    ("numpy", re.compile(r"numpy/")),
+    ("statsmodels", re.compile(r"statsmodels/")),
+    ("pmdarima", re.compile(r"pmdarima/")),
+    ("scipy", re.compile(r"scipy/")),
+    ("sklearn", re.compile(r"sklearn/")),
+    ("torch", re.compile(r"torch/|torch\._C")),
+    ("django", re.compile(r"django/|rest_framework/")),
+    ("test_app", re.compile(r"test_app/")),
+]
+NUM_TOP_FUNCTIONS = 40
+
+
+def is_profiling_requested(request: HttpRequest) -> bool:
+    flag = request.headers.get(PROFILE_HEADER) or request.GET.get(PROFILE_PARAM)
+    if flag is None or flag.lower() in ("", "0", "false", "no"):
+        return False
+    # Profiling is available only for the staff or in debug mode
+    user = getattr(request, "user", None)
+    return settings.DEBUG or bool(user and user.is_staff)
+
+
+def get_library(key: tuple) -> str:
+    filename, _, func_name = key
+    # The built-in functions have the file name '~'
+    location = func_name if filename == "~" else filename.replace("\\", "/")
+    for name, pattern in LIBRARY_GROUPS:
+        if pattern.search(location):
+            return name
+    # The standard library and the built-in functions
+    return "other" if "site-packages" in location else "python"
+
+
+def summarize_libraries(stats: pstats.Stats) -> list[tuple[str, float, int]]:
+    """Getting the own time and the number of calls of the functions of
+    every library, sorted by the time"""
+    summary = {}
+    for key, (_, num_calls, own_time, _, _) in stats.stats.items():
+        library = get_library(key)
+        total_time, total_calls = summary.get(library, (0.0, 0))
+        summary[library] = (total_time + own_time, total_calls + num_calls)
+    return sorted(
+        ((name, *vals) for name, vals in summary.items()),
+        key=lambda row: row[1],
+        reverse=True,
+    )
+
+
+def format_report(
+    request: HttpRequest, stats: pstats.Stats, wall_time: float
+) -> str:
+    out = io.StringIO()
+    out.write(f"{request.method} {request.get_full_path()}\n")
+    out.write(f"Wall time: {wall_time:.3f} s\n\n")
+
+    out.write("Own time by library:\n")
+    for name, own_time, num_calls in summarize_libraries(stats):
+        share = own_time / wall_time * 100 if wall_time else 0
+        out.write(
+            f"  {name:<14}{own_time:10.3f} s{share:7.1f} %{num_calls:12} calls\n"
+        )
+    out.write("\n")
+
+    # The call tree: the functions with the largest cumulative time and the
+    # functions they call
+    stats.stream = out
+    stats.sort_stats(pstats.SortKey.CUMULATIVE)
+    stats.print_stats(NUM_TOP_FUNCTIONS)
+    stats.print_callees(NUM_TOP_FUNCTIONS)
+    return out.getvalue()
+
+
+def remove_old_reports(profiles_dir: Path, max_reports: int) -> None:
+    reports = sorted(profiles_dir.glob("*.txt"), reverse=True)
+    for report in reports[max_reports:]:
+        report.unlink(missing_ok=True)
+        report.with_suffix(".prof").unlink(missing_ok=True)
+
+
+def store_report(request: HttpRequest, profiler: cProfile.Profile, wall_time):
+    """Storing the text report and the raw statistics (for snakeviz or
+    pstats) of a request. The names start with the time, so the oldest
+    reports are removed first."""
+    PROFILES_DIR.mkdir(parents=True, exist_ok=True)
+    view_name = request.path.strip("/").replace("/", "-") or "root"
+    name = f"{datetime.now():%Y%m%d-%H%M%S-%f}-{view_name}"
+    stats = pstats.Stats(profiler)
+    stats.dump_stats(Path(PROFILES_DIR, f"{name}.prof"))
+    Path(PROFILES_DIR, f"{name}.txt").write_text(
+        format_report(request, stats, wall_time)
+    )
+    remove_old_reports(PROFILES_DIR, MAX_PROFILES)
+    return name
+
+
+def profile_view(view):
+    """
+    Profiling the view on request
+
+    ...
+
+    The view is run under cProfile if the request has the 'X-Profile' header
+    or the 'profile' query parameter and it is made by a staff member or in
+    debug mode. The report is stored in logs/profiles and its name is
+    returned in the 'X-Profile-Report' header. The profiler measures the
+    wall time, so the waits for the network show up as the time of the
+    socket reads. The functions run in worker threads are not profiled,
+    their time shows up as thread waits.
+    """
+
+    @wraps(view)
+    def wrapper(request: HttpRequest, *args, **kwargs) -> HttpResponse:
+        if not is_profiling_requested(request):
+            return view(request, *args, **kwargs)
+
+        # The profiler is enabled only for the thread of the request, so the
+        # concurrent requests are not included
+        profiler = cProfile.Profile()
+        start = time.perf_counter()
+        profiler.enable()
+        try:
+            response = view(request, *args, **kwargs)
+        finally:
+            profiler.disable()
+            wall_time = time.perf_counter() - start
+            name = store_report(request, profiler, wall_time)
+        response[REPORT_HEADER] = name
+        return response
+
+    return wrapper
@@ -6,4 +6,4 @@ from .models import City
 class CitySerializer(serializers.ModelSerializer):
     class Meta:
         model = City
-        fields = "__all__"
+        exclude = ["search_name", "search_country"]
@@ -0,0 +1,14 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .ml_part.catalog import catalog
+from .models import City, Station
+
+
+@receiver(post_save, sender=Station)
+@receiver(post_delete, sender=Station)
+@receiver(post_save, sender=City)
+@receiver(post_delete, sender=City)
+def invalidate_catalog(sender, **kwargs):
+    """Reloading the changed table on the next access"""
+    catalog.invalidate(sender)
@@ -0,0 +1,388 @@
+import io
+import json
+import multiprocessing
+import tempfile
+
+import numpy as np
+import pandas as pd
+from django.test import SimpleTestCase
+
+from ...ml_part.cache import (
+    ERA5Store,
+    HoltWintersParamsStore,
+    NOAACache,
+    SARIMAXStateStore,
+)
+
+
+class NOAACacheTestCase(SimpleTestCase):
+    STATION_ID = "BOM00033008"
+    DATA_TYPES = ["TMAX", "TMIN"]
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.cache = NOAACache(self.temp_dir.name, refresh_days=2)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def make_rows(self, start_date, end_date, value):
+        dates = pd.date_range(start_date, end_date).strftime("%Y-%m-%d")
+        return pd.DataFrame(
+            {
+                "STATION": self.STATION_ID,
+                "DATE": dates,
+                "TMAX": value,
+                "TMIN": value - 10,
+            }
+        )
+
+    def test_get_fetch_start(self):
+        # If a station was not cached, the whole range is requested
+        self.assertEqual(
+            self.cache.get_fetch_start(
+                self.STATION_ID, self.DATA_TYPES, "2020-01-01", "2020-01-10"
+            ),
+            "2020-01-01",
+        )
+
+        self.cache.update(
+            self.STATION_ID,
+            self.DATA_TYPES,
+            "2020-01-01",
+            "2020-01-10",
+            "2020-01-01",
+            self.make_rows("2020-01-01", "2020-01-10", 1.0),
+        )
+        # If the cache covered the range, nothing is requested
+        self.assertIsNone(
+            self.cache.get_fetch_start(
+                self.STATION_ID, self.DATA_TYPES, "2020-01-05", "2020-01-10"
+            )
+        )
+        # If the range was extended, only the last days are requested again
+        self.assertEqual(
+            self.cache.get_fetch_start(
+                self.STATION_ID, self.DATA_TYPES, "2020-01-01", "2020-01-20"
+            ),
+            "2020-01-09",
+        )
+        # If the range started earlier or new data types were requested,
+        # the whole range is requested
+        self.assertEqual(
+            self.cache.get_fetch_start(
+                self.STATION_ID, self.DATA_TYPES, "2019-12-01", "2020-01-10"
+            ),
+            "2019-12-01",
+        )
+        self.assertEqual(
+            self.cache.get_fetch_start(
+                self.STATION_ID, ["PRCP"], "2020-01-01", "2020-01-10"
+            ),
+            "2020-01-01",
+        )
+
+    def test_late_observations(self):
+        self.cache.update(
+            self.STATION_ID,
+            self.DATA_TYPES,
+            "2020-10-01",
+            "2020-10-10",
+            "2020-10-01",
+            self.make_rows("2020-10-01", "2020-10-05", 1.0),
+        )
+        # If the days after the last observation were requested again
+        self.assertEqual(
+            self.cache.get_fetch_start(
+                self.STATION_ID, self.DATA_TYPES, "2020-10-01", "2020-10-11"
+            ),
+            "2020-10-04",
+        )
+
+        self.cache.update(
+            self.STATION_ID,
+            self.DATA_TYPES,
+            "2020-10-01",
+            "2020-10-11",
+            "2020-10-04",
+            self.make_rows("2020-10-04", "2020-10-07", 2.0),
+        )
+        data = self.cache.read(
+            self.STATION_ID, self.DATA_TYPES, "2020-10-01", "2020-10-11"
+        )
+        self.assertEqual(data["DATE"].iloc[-1], pd.Timestamp("2020-10-07"))
+
+        # If a station without observations for a long time was requested
+        # again only for the last 'max_delay_days'
+        cache = NOAACache(self.temp_dir.name, refresh_days=2, max_delay_days=5)
+        self.assertEqual(
+            cache.get_fetch_start(
+                self.STATION_ID, self.DATA_TYPES, "2020-10-01", "2020-12-31"
+            ),
+            "2020-10-07",
+        )
+        cache.update(
+            self.STATION_ID,
+            self.DATA_TYPES,
+            "2020-10-01",
+            "2020-12-31",
+            "2020-10-06",
+            self.make_rows("2020-10-06", "2020-10-07", 2.0),
+        )
+        self.assertEqual(
+            cache.get_fetch_start(
+                self.STATION_ID, self.DATA_TYPES, "2020-10-01", "2021-01-01"
+            ),
+            "2020-12-27",
+        )
+
+    def test_read_csv(self):
+        body = (
+            b'"STATION","DATE","TMAX","TMIN"\n'
+            b'"BOM00033008","2020-01-01"," 1.5"," -3.0"\n'
+            b'"BOM00033008","2020-01-02",,"-2.5"\n'
+        )
+        data = NOAACache.read_csv(io.BytesIO(body), self.DATA_TYPES)
+
+        # If the columns got the compact dtypes
+        self.assertEqual(data["STATION"].dtype, "category")
+        self.assertTrue(pd.api.types.is_datetime64_dtype(data["DATE"]))
+        self.assertListEqual(
+            list(data[self.DATA_TYPES].dtypes), ["float32", "float32"]
+        )
+        self.assertEqual(data["TMIN"].iloc[1], -2.5)
+
+        # If an empty response body gave an empty dataset
+        data = NOAACache.read_csv(io.BytesIO(b""), self.DATA_TYPES)
+        self.assertEqual(len(data), 0)
+        self.assertListEqual(
+            list(data.columns), ["STATION", "DATE"] + self.DATA_TYPES
+        )
+
+    def test_update(self):
+        self.cache.update(
+            self.STATION_ID,
+            self.DATA_TYPES,
+            "2020-01-01",
+            "2020-01-10",
+            "2020-01-01",
+            self.make_rows("2020-01-01", "2020-01-10", 1.0),
+        )
+        self.cache.update(
+            self.STATION_ID,
+            self.DATA_TYPES,
+            "2020-01-01",
+            "2020-01-15",
+            "2020-01-09",
+            self.make_rows("2020-01-09", "2020-01-15", 2.0),
+        )
+        data = self.cache.read(
+            self.STATION_ID, self.DATA_TYPES, "2020-01-01", "2020-01-15"
+        )
+
+        # If the new rows were merged without duplicates
+        self.assertEqual(len(data), 15)
+        self.assertTrue(data["DATE"].is_unique)
+        self.assertListEqual(
+            list(data.columns), ["STATION", "DATE"] + self.DATA_TYPES
+        )
+        # If the requested rows replaced the cached ones
+        self.assertEqual(data["TMAX"].iloc[7], 1.0)
+        self.assertEqual(data["TMAX"].iloc[8], 2.0)
+
+
+def update_era5_store(store_dir: str, columns: list[str], num_days: int):
+    """Extending the store day by day as a worker does"""
+    store = ERA5Store((52.1, 23.7), "daily", columns, store_dir)
+    for end in pd.date_range("2020-01-02", periods=num_days):
+        with store.lock():
+            fetch_start = store.get_fetch_start("2020-01-01", str(end.date()))
+            if fetch_start is None:
+                continue
+            dates = pd.date_range(fetch_start, end)
+            rows = pd.DataFrame({"date": dates})
+            for col in columns:
+                rows[col] = dates.day_of_year.astype(float)
+            # The last day is a forecast day, so it is truncated next time
+            store.update("2020-01-01", rows[:-1], rows[-1:])
+
+
+class ERA5StoreTestCase(SimpleTestCase):
+    COLUMNS = ["temp_max", "temp_min"]
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.store = ERA5Store(
+            (52.1, 23.7), "daily", self.COLUMNS, self.temp_dir.name
+        )
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def make_rows(self, start_date, end_date, value):
+        return pd.DataFrame(
+            {
+                "date": pd.date_range(start_date, end_date),
+                "temp_max": value,
+                "temp_min": value - 10,
+            }
+        )
+
+    def test_update(self):
+        # If nothing was stored, the whole range is requested
+        self.assertEqual(
+            self.store.get_fetch_start("2020-01-01", "2020-01-10"),
+            "2020-01-01",
+        )
+
+        self.store.update(
+            "2020-01-01",
+            self.make_rows("2020-01-01", "2020-01-07", 1.0),
+            self.make_rows("2020-01-08", "2020-01-10", 2.0),
+        )
+        # If the archive days were stored, only the forecast days are
+        # requested again on the next days
+        self.assertIsNone(
+            self.store.get_fetch_start("2020-01-02", "2020-01-07")
+        )
+        self.assertEqual(
+            self.store.get_fetch_start("2020-01-01", "2020-01-12"),
+            "2020-01-08",
+        )
+
+        self.store.update(
+            "2020-01-01",
+            self.make_rows("2020-01-08", "2020-01-09", 3.0),
+            self.make_rows("2020-01-10", "2020-01-12", 4.0),
+        )
+        data = self.store.read("2020-01-01", "2020-01-12")
+
+        # If the forecast days were replaced by the archive ones
+        self.assertEqual(len(data), 12)
+        self.assertListEqual(list(data.columns), ["date"] + self.COLUMNS)
+        self.assertListEqual(
+            list(data["temp_max"]), [1.0] * 7 + [3.0] * 2 + [4.0] * 3
+        )
+
+        # If the range started earlier than the stored one, it is replaced
+        self.assertEqual(
+            self.store.get_fetch_start("2019-12-01", "2020-01-12"),
+            "2019-12-01",
+        )
+
+    def test_thread_locks(self):
+        # If the stores of the same location shared the lock
+        store = ERA5Store(
+            (52.1, 23.7), "daily", self.COLUMNS, self.temp_dir.name
+        )
+        self.assertIs(store._thread_lock, self.store._thread_lock)
+
+        # If the lock was dropped with the last store of the location
+        path = str(store.path)
+        del store, self.store
+        self.assertNotIn(path, ERA5Store._locks)
+
+    def test_concurrent_updates(self):
+        # If two processes updated the same store at once, every day was
+        # stored once at its position
+        context = multiprocessing.get_context("fork")
+        workers = [
+            context.Process(
+                target=update_era5_store,
+                args=(self.temp_dir.name, self.COLUMNS, 100),
+            )
+            for _ in range(2)
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.assertTrue(all(worker.exitcode == 0 for worker in workers))
+
+        data = self.store.read("2020-01-01", "2020-04-10")
+        self.assertEqual(len(data), 101)
+        self.assertListEqual(
+            list(data["temp_max"]),
+            list(data["date"].dt.day_of_year.astype(float)),
+        )
+
+
+class HoltWintersParamsStoreTestCase(SimpleTestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.store = HoltWintersParamsStore(self.temp_dir.name, max_age_days=2)
+
+    def test_params(self):
+        # If nothing was stored
+        record = self.store.get("BOM00033008", "temp_max")
+        self.assertIsNone(record)
+        self.assertFalse(self.store.is_fresh(record))
+
+        # If the parameters were stored per station and target
+        self.store.save("BOM00033008", "temp_max", (0.1, 0, 0.5))
+        record = self.store.get("BOM00033008", "temp_max")
+        self.assertListEqual(record["params"], [0.1, 0, 0.5])
+        self.assertTrue(self.store.is_fresh(record))
+        self.assertIsNone(self.store.get("BOM00033008", "temp_min"))
+
+        # If the parameters became stale after 'max_age_days'
+        record["fitted_on"] = "2000-01-01"
+        self.store._path("BOM00033008", "temp_max").write_text(
+            json.dumps(record)
+        )
+        self.assertFalse(
+            self.store.is_fresh(self.store.get("BOM00033008", "temp_max"))
+        )
+
+
+class SARIMAXStateStoreTestCase(SimpleTestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.store = SARIMAXStateStore(
+            self.temp_dir.name, refit_days=30, drift_factor=2, drift_min_obs=3
+        )
+        self.meta = {
+            "start_date": "2015-01-01",
+            "end_date": "2020-01-01",
+            "fitted_on": "2000-01-01",
+            "baseline_error": 1.0,
+            "num_new_obs": 0,
+            "new_abs_error": 0.0,
+        }
+
+    def test_save(self):
+        self.assertIsNone(self.store.get("BOM00033008", "temp_max"))
+
+        # If the meta information and the arrays were stored
+        self.store.save(
+            "BOM00033008",
+            "temp_max",
+            self.meta,
+            params=np.array([0.5, 1.0]),
+            state=np.zeros(3),
+            state_cov=np.eye(3),
+        )
+        meta, arrays = self.store.get("BOM00033008", "temp_max")
+        self.assertDictEqual(meta, self.meta)
+        np.testing.assert_array_equal(arrays["params"], [0.5, 1.0])
+        np.testing.assert_array_equal(arrays["state_cov"], np.eye(3))
+        self.assertIsNone(self.store.get("BOM00033008", "temp_min"))
+
+    def test_refit(self):
+        # If the model was fitted too long ago
+        self.assertFalse(self.store.is_fresh(self.meta))
+
+        # If the drift was detected only on enough new observations
+        for num_new_obs, new_abs_error, has_drifted in [
+            (2, 10.0, False),
+            (3, 6.0, False),
+            (3, 6.5, True),
+        ]:
+            meta = {
+                **self.meta,
+                "num_new_obs": num_new_obs,
+                "new_abs_error": new_abs_error,
+            }
+            self.assertEqual(self.store.has_drifted(meta), has_drifted)
@@ -0,0 +1,62 @@
+from django.test import TestCase
+
+from ...ml_part.catalog import StationTable, catalog
+from ...ml_part.data_workflow import ERA5Service, NOAACleaning, NOAAService
+from ...models import City, Station
+
+
+class StationTableTestCase(TestCase):
+    def test_from_queryset(self):
+        Station.objects.create(name="A", lat=52.1, lng=23.7)
+        Station.objects.create(name="B", lat=53.9, lng=27.5)
+        stations = StationTable.from_queryset(Station.objects.order_by("name"))
+
+        # If the table consisted of the arrays
+        self.assertListEqual(list(stations.ids), ["A", "B"])
+        self.assertEqual(stations.lat.dtype, float)
+        self.assertListEqual(list(stations.lng), [23.7, 27.5])
+
+        # If the stations were found by their identifiers
+        self.assertIn("B", stations)
+        self.assertNotIn("C", stations)
+        self.assertTupleEqual(stations.get_coords("B"), (53.9, 27.5))
+
+
+class CatalogTestCase(TestCase):
+    def setUp(self):
+        catalog.invalidate()
+        # The rolled back rows must not stay in the catalog
+        self.addCleanup(catalog.invalidate)
+
+    def test_shared_tables(self):
+        # If all services used the same tables
+        self.assertIs(NOAAService.stations, catalog.stations)
+        self.assertIs(NOAACleaning.stations, catalog.stations)
+        self.assertIs(ERA5Service.stations, catalog.stations)
+        self.assertIs(NOAAService.cities, catalog.cities)
+
+    def test_invalidate(self):
+        num_stations = len(catalog.stations)
+        station_index = catalog.station_index
+        cities = catalog.cities
+
+        # If the tables were reloaded after a station was saved
+        station = Station.objects.create(name="test station", lat=1, lng=1)
+        self.assertEqual(len(catalog.stations), num_stations + 1)
+        self.assertIsNot(catalog.station_index, station_index)
+        # If the other tables were kept
+        self.assertIs(catalog.cities, cities)
+
+        # If the tables were reloaded after a city was saved or deleted
+        city = City.objects.create(
+            name="test city",
+            country="test country",
+            lat=1,
+            lng=1,
+            nearest_station=station,
+        )
+        self.assertIsNot(catalog.cities, cities)
+        self.assertIn("test city", list(catalog.cities["name"]))
+        self.assertIn("test station", catalog.stations)
+        city.delete()
+        self.assertNotIn("test city", list(catalog.cities["name"]))
@@ -0,0 +1,69 @@
+from io import StringIO
+
+from django.core.management import CommandError, call_command
+from django.test import TestCase
+
+from ...ml_part.catalog import catalog
+from ...models import City, Station
+
+
+class FillNearestStationsCommandTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.brest_station = Station.objects.create(
+            name="brest station", lat=52.1, lng=23.7
+        )
+        cls.minsk_station = Station.objects.create(
+            name="minsk station", lat=53.9, lng=27.6
+        )
+        cls.brest = City.objects.create(
+            name="Brest", country="Belarus", lat=52.09, lng=23.73
+        )
+        cls.minsk = City.objects.create(
+            name="Minsk", country="Belarus", lat=53.9, lng=27.56
+        )
+
+    def setUp(self):
+        catalog.invalidate()
+        self.addCleanup(catalog.invalidate)
+
+    def call_command(self, *args) -> str:
+        out = StringIO()
+        call_command("fill_nearest_stations", *args, stdout=out)
+        return out.getvalue()
+
+    def test_fill_nearest_stations(self):
+        # If the nearest stations of all cities were filled
+        out = self.call_command()
+        self.assertIn("Updated 2 of 2 cities", out)
+        self.brest.refresh_from_db()
+        self.minsk.refresh_from_db()
+        self.assertEqual(self.brest.nearest_station, self.brest_station)
+        self.assertEqual(self.minsk.nearest_station, self.minsk_station)
+        # If the catalog was reloaded after the bulk update
+        self.assertTrue(catalog.cities["nearest_station_id"].notna().all())
+
+        # If nothing was updated on the rerun
+        self.assertIn("Updated 0 of 2 cities", self.call_command())
+
+        # If only the city with a new nearer station was updated
+        station = Station.objects.create(name="new", lat=53.9, lng=27.56)
+        self.assertIn("Updated 1 of 2 cities", self.call_command())
+        self.minsk.refresh_from_db()
+        self.assertEqual(self.minsk.nearest_station, station)
+
+    def test_only_missing(self):
+        self.minsk.nearest_station = self.brest_station
+        self.minsk.save()
+
+        # If the cities with a nearest station were skipped
+        out = self.call_command("--only-missing")
+        self.assertIn("Updated 1 of 1 cities", out)
+        self.minsk.refresh_from_db()
+        self.assertEqual(self.minsk.nearest_station, self.brest_station)
+
+    def test_no_stations(self):
+        # If there were no stations to choose from
+        Station.objects.all().delete()
+        with self.assertRaises(CommandError):
+            self.call_command()
@@ -9,17 +9,23 @@ So we will use a TestCase because one needs to get data from a database and
 not delete them after running tests.
 """
 
+import json
+import tempfile
 from datetime import datetime, timedelta
-from unittest import skip
+from unittest import mock, skip
 
-from django.test import TestCase
+import numpy as np
+import pandas as pd
+from django.test import SimpleTestCase, TestCase
 
+from ...ml_part.catalog import StationTable
 from ...ml_part.data_workflow import (
     DataCollection,
     ERA5Service,
     NOAACleaning,
     NOAAService,
 )
+from ...ml_part.transport import BaseTransport, RateLimiter, set_transport
 
 TIME_FORMAT = None
 start_date = None
@@ -290,3 +296,238 @@ class ERA5ServiceTestCase(TestCase):
         self.assertEqual(
             len(self.era5_service.get_era_data()), diff_in_days + 1
         )
+
+
+class StubTransport(BaseTransport):
+    """Answering open-meteo requests with a value per location"""
+
+    def __init__(self):
+        self.urls = []
+
+    def get(self, url, **kwargs):
+        self.urls.append(url)
+        params = dict(
+            param.split("=") for param in url.split("?")[1].split("&")
+        )
+        dates = pd.date_range(params["start_date"], params["end_date"])
+        results = [
+            {
+                "daily": {
+                    "time": list(dates.strftime(TIME_FORMAT)),
+                    "temperature_2m_max": [float(lat)] * len(dates),
+                }
+            }
+            for lat in params["latitude"].split(",")
+        ]
+        response = mock.Mock()
+        response.json.return_value = results if len(results) > 1 else results[0]
+        response.content = json.dumps(response.json.return_value).encode()
+        return response
+
+
+class ERA5BatchTestCase(SimpleTestCase):
+    def setUp(self):
+        self.transport = StubTransport()
+        set_transport(self.transport)
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.patches = [
+            mock.patch.object(ERA5Service, "store_dir", self.temp_dir.name),
+            mock.patch.object(
+                ERA5Service,
+                "rate_limiter",
+                RateLimiter(requests_per_second=1e6),
+            ),
+        ]
+        for patch in self.patches:
+            patch.start()
+
+    def tearDown(self):
+        for patch in self.patches:
+            patch.stop()
+        self.temp_dir.cleanup()
+        set_transport(None)
+
+    def test_call_api_batch(self):
+        era5_service = ERA5Service(
+            loc_coords=(50, 30),
+            data_types=["temperature_2m_max"],
+            start_date="2020-01-01",
+            end_date="2020-01-10",
+        )
+        stations_coords = [(50, 30), (51, 31), (50, 30)]
+        datasets = era5_service._call_api_batch(stations_coords)
+
+        # If all locations were requested at once
+        self.assertEqual(len(self.transport.urls), 1)
+        self.assertIn("latitude=50,51&", self.transport.urls[0])
+
+        # If the response was split into the datasets of the locations
+        self.assertEqual(len(datasets), len(stations_coords))
+        for (lat, _), era_data in zip(stations_coords, datasets):
+            self.assertEqual(len(era_data), 10)
+            self.assertTrue((era_data["temp_max"] == lat).all())
+
+        # If the stored data was used the next time
+        era5_service._call_api_batch(stations_coords)
+        self.assertEqual(len(self.transport.urls), 1)
+
+
+class NOAACombiningTestCase(SimpleTestCase):
+    def test_get_combined_dataset(self):
+        nan = np.nan
+        station_datasets = pd.DataFrame(
+            {
+                "DATE": [
+                    "2020-01-01",
+                    "2020-01-02",
+                    "2020-01-02",
+                    "2020-01-03",
+                    "2020-01-05",
+                    "2020-01-01",
+                    "2020-01-02",
+                ],
+                "STATION": ["A", "A", "B", "B", "B", "C", "C"],
+                "TMAX": [1, nan, 2, 3, nan, 10, 20],
+                "TMIN": [nan, nan, nan, -3, -5, -10, -20],
+            }
+        )
+
+        data = NOAACleaning(station_datasets).get_combined_dataset()
+
+        # If the values were taken from the nearest station with a value
+        self.assertListEqual(
+            list(data.index),
+            list(
+                pd.to_datetime(
+                    ["2020-01-01", "2020-01-02", "2020-01-03", "2020-01-05"]
+                )
+            ),
+        )
+        self.assertListEqual(list(data.columns), ["temp_max", "temp_min"])
+        self.assertListEqual(list(data["temp_max"].iloc[:3]), [1, 2, 3])
+        self.assertListEqual(list(data["temp_min"]), [-10, -20, -3, -5])
+        # If a value was left missing when no station had it
+        self.assertTrue(np.isnan(data["temp_max"].iloc[3]))
+
+
+class ERA5FillingTestCase(SimpleTestCase):
+    @staticmethod
+    def fill_with_combine_first(data, era_data):
+        """The previous way of filling based on sets of dates"""
+        missing_inds = list(set(era_data.index) - set(data.index))
+        data = pd.concat([data, era_data.loc[missing_inds]]).sort_index()
+        return data.combine_first(era_data)
+
+    def test_fill_with_era_data(self):
+        dates = pd.date_range("2020-01-01", periods=6, name="date")
+        data = pd.DataFrame(
+            {
+                "temp_max": [1, np.nan, 3, np.nan],
+                "temp_min": [-1, -2, np.nan, np.nan],
+            },
+            index=dates[[0, 1, 3, 4]],
+            dtype="float32",
+        )
+        era_data = pd.DataFrame(
+            {"temp_max": range(10, 16), "temp_min": range(-10, -16, -1)},
+            index=dates,
+            dtype=float,
+        )
+
+        filled_data = NOAACleaning._fill_with_era_data(data, era_data)
+        # If the missing values and dates were taken from the ERA5 data
+        self.assertListEqual(
+            list(filled_data["temp_max"]), [1, 11, 12, 3, 14, 15]
+        )
+        self.assertListEqual(
+            list(filled_data["temp_min"]), [-1, -2, -12, -13, -14, -15]
+        )
+
+        # If the result was the same as before for different date ranges,
+        # data types and orders of columns (the frequency of the dates
+        # depended on the concatenation)
+        for data, era_data in [
+            (data, era_data),
+            (data, era_data.iloc[1:3]),
+            (data.astype(float), era_data.astype("float32")),
+            (data, era_data[["temp_min", "temp_max"]]),
+            (data[["temp_max"]], era_data),
+            (era_data, data),
+        ]:
+            pd.testing.assert_frame_equal(
+                NOAACleaning._fill_with_era_data(data, era_data),
+                self.fill_with_combine_first(data, era_data),
+                check_freq=False,
+            )
+
+
+class ERA5AggregationTestCase(SimpleTestCase):
+    def test_aggregate_hourly(self):
+        times = pd.date_range("2020-01-01", periods=3 * 24, freq="H")
+        hourly = {
+            "time": list(times.strftime("%Y-%m-%dT%H:%M")),
+            "pressure_msl": [float(time.hour) for time in times],
+        }
+        hourly["pressure_msl"][:24] = [None] * 24
+        columns = {"pressure_level": "pressure_msl"}
+
+        data = ERA5Service._aggregate_hourly(hourly, columns)
+
+        # If the hourly values were turned into rounded daily means
+        self.assertListEqual(
+            list(data["date"]), list(pd.date_range("2020-01-01", "2020-01-03"))
+        )
+        self.assertTrue(data["pressure_level"].iloc[:1].isna().all())
+        self.assertListEqual(list(data["pressure_level"].iloc[1:]), [12, 12])
+
+        # If the result was the same when the days were not full
+        hourly = {key: val[1:] for key, val in hourly.items()}
+        expected_data = ERA5Service._aggregate_hourly(hourly, columns)
+        pd.testing.assert_frame_equal(
+            data.iloc[1:].reset_index(drop=True),
+            expected_data.iloc[1:].reset_index(drop=True),
+        )
+
+
+class ERA5SectorsTestCase(SimpleTestCase):
+    LOC_COORDS = (52.0, 24.0)
+
+    def setUp(self):
+        stations = StationTable(
+            ids=["N1", "N2", "S", "W", "E", "FAR", "NEAR"],
+            # About 300 km to the north and the south, 300 km to the west
+            # and the east, 2000 km and 50 km to the north
+            lat=[54.7, 54.8, 49.3, 52.0, 52.0, 70.0, 52.45],
+            lng=[24.0, 24.5, 24.0, 19.6, 28.4, 24.0, 24.0],
+        )
+        patch = mock.patch.object(ERA5Service, "stations", stations)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def test_get_station_ids_bw_dists_of_card_points(self):
+        era5_service = ERA5Service(
+            loc_coords=self.LOC_COORDS,
+            start_date="2020-01-01",
+            end_date="2020-01-10",
+            intermidiate_dists=[100, 500, 1000],
+        )
+        station_ids = era5_service.get_station_ids_bw_dists_of_card_points()
+
+        # If the stations were found in the sectors between the distances
+        self.assertDictEqual(
+            station_ids,
+            {
+                "100-500km": {
+                    "north": "N1",
+                    "south": "S",
+                    "west": "W",
+                    "east": "E",
+                },
+                "500-1000km": {
+                    "north": None,
+                    "south": None,
+                    "west": None,
+                    "east": None,
+                },
+            },
+        )
@@ -0,0 +1,50 @@
+import numpy as np
+import pandas as pd
+from django.test import SimpleTestCase
+
+from ...ml_part.data_workflow import ERA5Service
+from ...ml_part.dtypes import apply_dtypes
+
+
+class DtypesTestCase(SimpleTestCase):
+    def test_apply_dtypes(self):
+        data = pd.DataFrame(
+            {
+                "STATION": ["A", "B"],
+                "DATE": pd.to_datetime(["2020-01-01", "2020-01-02"]),
+                "TMAX": [1.5, np.nan],
+                "AWDR": [90.0, 180.0],
+            }
+        )
+
+        data = apply_dtypes(data, whole_number_columns=["AWDR"])
+        # If every column got its dtype and the dates were kept
+        self.assertDictEqual(
+            {col: str(dtype) for col, dtype in data.dtypes.items()},
+            {
+                "STATION": "category",
+                "DATE": "datetime64[ns]",
+                "TMAX": "float32",
+                "AWDR": "int16",
+            },
+        )
+        # If the frame was not copied when it already had the dtypes
+        self.assertIs(apply_dtypes(data, whole_number_columns=["AWDR"]), data)
+
+    def test_fill_era_data(self):
+        dates = pd.date_range("2020-01-01", periods=3, name="date")
+        era_data = pd.DataFrame(
+            {
+                "temp_max": [np.nan, 2.5, 3.5],
+                "wind_direction": [np.nan, 270.0, 90.0],
+            },
+            index=dates,
+        )
+
+        era_data = ERA5Service._fill_era_data(era_data)
+        # If the first missing values were filled and the directions are
+        # small integers
+        self.assertListEqual(list(era_data["temp_max"]), [2.5, 2.5, 3.5])
+        self.assertEqual(era_data["temp_max"].dtype, "float32")
+        self.assertListEqual(list(era_data["wind_direction"]), [270, 270, 90])
+        self.assertEqual(era_data["wind_direction"].dtype, "int16")
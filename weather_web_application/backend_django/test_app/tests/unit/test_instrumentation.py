@@ -0,0 +1,90 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+
+from django.test import SimpleTestCase
+
+from ...ml_part.instrumentation import (
+    NULL_SPAN,
+    bind_context,
+    current_span,
+    event,
+    pipeline_logger,
+    span,
+)
+from ...ml_part.metrics import stage_duration
+
+
+class InstrumentationTestCase(SimpleTestCase):
+    def test_span(self):
+        with self.assertLogs(pipeline_logger, level="INFO") as logs:
+            with span("noaa.get_data", stations=["A", "B"]) as data_span:
+                with span("noaa.request") as request_span:
+                    request_span.set(bytes=10)
+                    event("few_stations", num_stations=2)
+                data_span.add(cache_hits=1)
+                data_span.add(cache_hits=2)
+
+        # If the children were logged before the parent with its path
+        self.assertListEqual(
+            [record.span for record in logs.records],
+            [
+                "noaa.get_data/noaa.request:few_stations",
+                "noaa.get_data/noaa.request",
+                "noaa.get_data",
+            ],
+        )
+        # If the spans of a stage shared the trace identifier
+        self.assertEqual(len({record.trace_id for record in logs.records}), 1)
+        # If the fields and the duration were logged
+        fields = logs.records[-1].fields
+        self.assertEqual(fields["cache_hits"], 3)
+        self.assertGreaterEqual(fields["duration_ms"], 0)
+        self.assertIn("stations=A,B", logs.output[-1])
+        self.assertEqual(logs.records[1].fields["bytes"], 10)
+
+    def test_error(self):
+        # If the error was logged with the span
+        with self.assertLogs(pipeline_logger, level="INFO") as logs:
+            with self.assertRaises(ValueError):
+                with span("noaa.get_data"):
+                    raise ValueError()
+        self.assertEqual(logs.records[0].fields["error"], "ValueError")
+
+    def test_bind_context(self):
+        with self.assertLogs(pipeline_logger, level="INFO") as logs:
+            with span("era5.get_data"):
+                with ThreadPoolExecutor(max_workers=2) as executor:
+                    list(
+                        executor.map(
+                            bind_context(
+                                lambda _: current_span().add(cache_misses=1)
+                            ),
+                            range(4),
+                        )
+                    )
+
+        # If the worker threads added their counters to the caller's span
+        self.assertEqual(logs.records[0].fields["cache_misses"], 4)
+        self.assertIs(current_span(), NULL_SPAN)
+
+    def test_disabled(self):
+        pipeline_logger.setLevel(logging.WARNING)
+        self.addCleanup(pipeline_logger.setLevel, logging.INFO)
+
+        # If nothing was measured when the logger was switched off
+        # (assertNoLogs would lower the level again)
+        with patch.object(pipeline_logger, "log") as log:
+            with span("noaa.combine") as combine_span:
+                self.assertIs(combine_span, NULL_SPAN)
+                self.assertIs(current_span(), NULL_SPAN)
+                combine_span.set(rows=1)
+                event("few_stations")
+
+            # If the stages of the metrics were measured, but not logged
+            count = stage_duration.samples()
+            with span("noaa.get_data") as data_span:
+                self.assertFalse(data_span.enabled)
+                data_span.set(rows=1)
+            self.assertNotEqual(stage_duration.samples(), count)
+        log.assert_not_called()
@@ -0,0 +1,89 @@
+import math
+
+from django.test import SimpleTestCase
+
+from ...ml_part.instrumentation import span
+from ...ml_part.metrics import (
+    Counter,
+    Gauge,
+    Histogram,
+    Registry,
+    cache_hit_ratio,
+    record_cache_lookups,
+    upstream_errors,
+    upstream_requests,
+)
+
+
+class MetricsTestCase(SimpleTestCase):
+    def test_histogram(self):
+        histogram = Histogram(
+            "stage_seconds", "Stages.", labelnames=("stage",), buckets=(1, 2)
+        )
+        for val in [0.5, 1.5, 1.5, 3]:
+            histogram.observe(val, stage="fetch")
+
+        # If the values were counted in cumulative buckets
+        self.assertListEqual(
+            [sample[2] for sample in histogram.samples()], [1, 3, 4, 6.5, 4]
+        )
+        # If the quantiles were interpolated within the buckets
+        self.assertAlmostEqual(histogram.quantile(0.5, stage="fetch"), 1.5)
+        # If the values above the highest bound gave the bound
+        self.assertEqual(histogram.quantile(0.99, stage="fetch"), 2)
+        self.assertTrue(math.isnan(histogram.quantile(0.5, stage="clean")))
+
+        # If the labels did not match the label names
+        with self.assertRaises(ValueError):
+            histogram.observe(1)
+
+    def test_render(self):
+        registry = Registry()
+        counter = registry.register(
+            Counter("requests_total", "Requests.", labelnames=("service",))
+        )
+        gauge = registry.register(Gauge("in_flight", "In flight."))
+        histogram = registry.register(
+            Histogram("duration_seconds", "Durations.", buckets=(1,))
+        )
+        counter.inc(service='a"b')
+        with gauge.track_inprogress():
+            histogram.observe(0.5)
+            text = registry.render()
+
+        # If the metrics were rendered in the exposition format
+        for line in [
+            "# TYPE requests_total counter",
+            'requests_total{service="a\\"b"} 1',
+            "in_flight 1",
+            "# TYPE duration_seconds histogram",
+            'duration_seconds_bucket{le="1"} 1',
+            'duration_seconds_bucket{le="+Inf"} 1',
+            "duration_seconds_sum 0.5",
+            "duration_seconds_count 1",
+            'duration_seconds_quantile{quantile="0.95"} 0.95',
+        ]:
+            self.assertIn(line, text.splitlines())
+        self.assertEqual(gauge.get(), 0)
+
+        # If a metric was registered twice
+        with self.assertRaises(ValueError):
+            registry.register(Gauge("in_flight", "In flight."))
+
+    def test_upstream_requests(self):
+        requests = upstream_requests.get(service="noaa")
+        errors = upstream_errors.get(service="noaa")
+        with self.assertRaises(ConnectionError):
+            with span("noaa.request"):
+                raise ConnectionError()
+
+        # If the failed request was counted as an error
+        self.assertEqual(upstream_requests.get(service="noaa"), requests + 1)
+        self.assertEqual(upstream_errors.get(service="noaa"), errors + 1)
+
+    def test_cache_hit_ratio(self):
+        record_cache_lookups("test", 3, 1)
+        record_cache_lookups("test", 0, 4)
+
+        # If the ratio was computed over all lookups
+        self.assertEqual(cache_hit_ratio.get(cache="test"), 3 / 8)
@@ -79,3 +79,35 @@ class CurrentWeatherModelTest(TestCase):
         )
         self.assertEqual(self.current_weather.sunrise, self.SUNRISE)
         self.assertEqual(self.current_weather.sunset, self.SUNSET)
+
+
+class LocationQuerySetTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.brest = City.objects.create(
+            name="Brest", country="Belarus", lat=52.0976, lng=23.7341
+        )
+        cls.minsk = City.objects.create(
+            name="Minsk", country="Belarus", lat=53.9, lng=27.5667
+        )
+        cls.suva = City.objects.create(
+            name="Suva", country="Fiji", lat=-18.1416, lng=178.4419
+        )
+
+    def test_nearest(self):
+        # If the nearest city was found within the first radius
+        city, dist = City.objects.nearest(52.1, 23.72)
+        self.assertEqual(city, self.brest)
+        self.assertLess(dist, 2)
+
+        # If the radius was expanded until a city was found
+        city, dist = City.objects.nearest(53.0, 25.9)
+        self.assertEqual(city, self.minsk)
+        self.assertGreater(dist, 100)
+
+        # If a city was found across the antimeridian
+        city, _ = City.objects.nearest(-18.0, -179.5)
+        self.assertEqual(city, self.suva)
+
+        # If nothing was found in an empty table
+        self.assertIsNone(City.objects.none().nearest(0, 0))
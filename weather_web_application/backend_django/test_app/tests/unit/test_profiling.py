@@ -0,0 +1,66 @@
+import tempfile
+from pathlib import Path
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import pandas as pd
+from django.http import JsonResponse
+from django.test import RequestFactory, SimpleTestCase, override_settings
+
+from ...profiling import REPORT_HEADER, profile_view
+
+
+@profile_view
+def view(request):
+    # Some work for the library summary
+    pd.DataFrame({"a": range(100)}).groupby("a").sum()
+    return JsonResponse({})
+
+
+class ProfileViewTestCase(SimpleTestCase):
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.profiles_dir = Path(temp_dir.name)
+        patcher = patch("test_app.profiling.PROFILES_DIR", self.profiles_dir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.factory = RequestFactory()
+
+    def get(self, *args, user=None, **kwargs):
+        request = self.factory.get(*args, **kwargs)
+        request.user = user or SimpleNamespace(is_staff=False)
+        return view(request)
+
+    def test_profile_view(self):
+        # If the request was not profiled without the flag or the permission
+        self.assertNotIn(REPORT_HEADER, self.get("/forecast"))
+        self.assertNotIn(REPORT_HEADER, self.get("/forecast?profile=1"))
+        self.assertListEqual(list(self.profiles_dir.iterdir()), [])
+
+        # If the request of a staff member was profiled
+        resp = self.get(
+            "/forecast",
+            HTTP_X_PROFILE="1",
+            user=SimpleNamespace(is_staff=True),
+        )
+        report = Path(self.profiles_dir, resp[REPORT_HEADER] + ".txt")
+        self.assertTrue(report.with_suffix(".prof").exists())
+        text = report.read_text()
+        self.assertIn("GET /forecast", text)
+        self.assertRegex(text, r"\n  pandas +\d")
+        self.assertIn("function calls", text)
+
+    @override_settings(DEBUG=True)
+    def test_retention(self):
+        with patch("test_app.profiling.MAX_PROFILES", 2):
+            names = [
+                self.get("/forecast?profile=1")[REPORT_HEADER] for _ in range(3)
+            ]
+
+        # If only the newest reports were kept
+        self.assertListEqual(
+            sorted(path.stem for path in self.profiles_dir.glob("*.txt")),
+            names[1:],
+        )
+        self.assertEqual(len(list(self.profiles_dir.glob("*.prof"))), 2)
@@ -0,0 +1,84 @@
+import pandas as pd
+from django.test import SimpleTestCase
+from haversine import haversine
+
+from ...ml_part.spatial import SpatialIndex, get_bounding_box
+
+
+class SpatialIndexTestCase(SimpleTestCase):
+    LOC_COORDS = (52.1, 23.7)
+
+    def setUp(self):
+        self.locations = pd.DataFrame(
+            {
+                "name": ["A", "B", "C", "D"],
+                "lat": [52.0, 53.9, 52.2, 10.0],
+                "lng": [23.6, 27.5, 23.9, -70.0],
+            }
+        )
+        self.index = SpatialIndex(self.locations["lat"], self.locations["lng"])
+
+    def test_query(self):
+        # If the locations were ordered by the distance
+        inds, dists = self.index.query(self.LOC_COORDS, k=3)
+        nearest = self.locations.iloc[inds]
+        self.assertListEqual(list(nearest["name"]), ["A", "C", "B"])
+        for lat, lng, dist in zip(nearest["lat"], nearest["lng"], dists):
+            self.assertAlmostEqual(
+                dist, haversine(self.LOC_COORDS, (lat, lng)), places=6
+            )
+
+        # If 'k' was greater than the number of locations
+        inds, _ = self.index.query(self.LOC_COORDS, k=10)
+        self.assertEqual(len(inds), 4)
+
+        # If an empty index found nothing
+        inds, _ = SpatialIndex([], []).query(self.LOC_COORDS)
+        self.assertEqual(len(inds), 0)
+
+    def test_max_dist(self):
+        # If the locations farther than 'max_dist' were dropped
+        inds, _ = self.index.query(self.LOC_COORDS, k=4, max_dist=100)
+        self.assertListEqual(list(self.locations["name"][inds]), ["A", "C"])
+
+        # If the nearest location was kept anyway
+        inds, _ = self.index.query((10, -69), k=4, max_dist=100)
+        self.assertListEqual(list(self.locations["name"][inds]), ["D"])
+
+    def test_query_nearest(self):
+        # If every point got the same nearest location as a single query
+        points = [self.LOC_COORDS, (10, -69), (54, 27)]
+        inds, dists = self.index.query_nearest(*zip(*points))
+        for point, ind, dist in zip(points, inds, dists):
+            expected_inds, expected_dists = self.index.query(point)
+            self.assertEqual(ind, expected_inds[0])
+            self.assertAlmostEqual(dist, expected_dists[0])
+
+        # If an empty index could not find the nearest locations
+        with self.assertRaises(ValueError):
+            SpatialIndex([], []).query_nearest([0], [0])
+
+
+class BoundingBoxTestCase(SimpleTestCase):
+    def test_get_bounding_box(self):
+        # If the box contained the points at the radius in every direction
+        loc_coords, radius = (52.1, 23.7), 100
+        min_lat, max_lat, lng_ranges = get_bounding_box(loc_coords, radius)
+        self.assertEqual(len(lng_ranges), 1)
+        (min_lng, max_lng) = lng_ranges[0]
+        for coords in [
+            (min_lat, loc_coords[1]),
+            (max_lat, loc_coords[1]),
+            (loc_coords[0], min_lng),
+            (loc_coords[0], max_lng),
+        ]:
+            self.assertGreaterEqual(haversine(loc_coords, coords), radius - 1)
+
+        # If the box was split at the antimeridian
+        _, _, lng_ranges = get_bounding_box((0, 179.9), 100)
+        self.assertEqual(len(lng_ranges), 2)
+
+        # If the box covered all longitudes near the pole
+        _, max_lat, lng_ranges = get_bounding_box((89.5, 0), 100)
+        self.assertEqual(max_lat, 90)
+        self.assertListEqual(lng_ranges, [(-180, 180)])
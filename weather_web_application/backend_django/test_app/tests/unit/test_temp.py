@@ -0,0 +1,268 @@
+import json
+import tempfile
+from unittest.mock import patch
+
+import numpy as np
+import pandas as pd
+from django.test import SimpleTestCase
+
+from ...ml_part import temp
+from ...ml_part.cache import HoltWintersParamsStore, SARIMAXStateStore
+from ...ml_part.temp import (
+    HoltWinters,
+    HoltWintersCV,
+    fit_coarse_to_fine,
+    fit_holt_winters,
+    fitting,
+    forecast_sarima,
+    make_sarima,
+    timeseriesCVscore,
+)
+
+
+def smooth_with_loop(series, slen, alpha, beta, gamma, n_preds):
+    """The Holt-Winters recursion written step by step"""
+    n_seasons = len(series) // slen
+    averages = [
+        sum(series[slen * j : slen * (j + 1)]) / slen for j in range(n_seasons)
+    ]
+    seasonals = [
+        sum(series[slen * j + i] - averages[j] for j in range(n_seasons))
+        / n_seasons
+        for i in range(slen)
+    ]
+    trend = (
+        sum((series[i + slen] - series[i]) / slen for i in range(slen)) / slen
+    )
+    smooth, result = series[0], [series[0]]
+    for i in range(1, len(series)):
+        val, ind = series[i], i % slen
+        last_smooth = smooth
+        smooth = alpha * (val - seasonals[ind]) + (1 - alpha) * (smooth + trend)
+        trend = beta * (smooth - last_smooth) + (1 - beta) * trend
+        seasonals[ind] = gamma * (val - smooth) + (1 - gamma) * seasonals[ind]
+        result.append(smooth + trend + seasonals[ind])
+    for m in range(1, n_preds + 1):
+        i = len(series) + m - 1
+        result.append(smooth + m * trend + seasonals[i % slen])
+    return result
+
+
+class HoltWintersTestCase(SimpleTestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        days = np.arange(100)
+        self.series = (
+            10
+            + 0.1 * days
+            + 5 * np.sin(2 * np.pi * days / 7)
+            + rng.normal(size=100)
+        )
+
+    def test_triple_exponential_smoothing(self):
+        model = HoltWinters(
+            self.series,
+            slen=7,
+            alpha=0.3,
+            beta=0.1,
+            gamma=0.2,
+            n_preds=10,
+            test_size=10,
+        )
+        model.triple_exponential_smoothing()
+
+        # If the results were the same as the ones of the recursion
+        expected = smooth_with_loop(self.series.tolist(), 7, 0.3, 0.1, 0.2, 10)
+        np.testing.assert_allclose(model.result, expected, rtol=1e-12)
+        # If all outputs covered the series and the predictions
+        for output in [
+            model.Smooth,
+            model.Trend,
+            model.Season,
+            model.PredictedDeviation,
+            model.UpperBond,
+            model.LowerBond,
+        ]:
+            self.assertEqual(len(output), 110)
+        # If the uncertainty grew when predicting
+        deviation = model.PredictedDeviation
+        np.testing.assert_allclose(
+            deviation[100:], deviation[99] * 1.01 ** np.arange(1, 11)
+        )
+        np.testing.assert_allclose(
+            model.UpperBond - model.LowerBond, 2 * 2.5 * deviation
+        )
+
+    def test_float32_series(self):
+        # If a float32 series (the cleaned data) gave the results of the
+        # float64 one up to the rounding of the input
+        models = [
+            HoltWinters(
+                self.series.astype(dtype),
+                slen=7,
+                alpha=0.3,
+                beta=0.1,
+                gamma=0.2,
+                n_preds=10,
+                test_size=10,
+            )
+            for dtype in ["float32", "float64"]
+        ]
+        for model in models:
+            model.triple_exponential_smoothing()
+        np.testing.assert_allclose(
+            models[0].result, models[1].result, rtol=1e-5
+        )
+
+
+class HoltWintersFittingTestCase(SimpleTestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        days = np.arange(200)
+        self.series = pd.Series(
+            10
+            + 0.05 * days
+            + 5 * np.sin(2 * np.pi * days / 7)
+            + rng.normal(size=200)
+        )
+
+    def test_cv_score(self):
+        params = np.array([[0.3, 0.1, 0.2], [0, 0, 0], [1, 1, 1]])
+        cv = HoltWintersCV(self.series, slen=7)
+
+        # If the batch gave the errors of the candidates one by one
+        np.testing.assert_allclose(
+            cv.score(params),
+            [timeseriesCVscore(x, self.series, slen=7) for x in params],
+            rtol=1e-12,
+        )
+
+    def test_fit_coarse_to_fine(self):
+        cv = HoltWintersCV(self.series, slen=7)
+        params, error = fit_coarse_to_fine(cv, grid_size=6, tol=1e-2)
+
+        # If the refined candidate was better than the ones of the coarse grid
+        alphas, betas, gammas = np.meshgrid(*[np.linspace(0, 1, 6)] * 3)
+        grid = np.stack([alphas.ravel(), betas.ravel(), gammas.ravel()], axis=1)
+        self.assertLess(error, cv.score(grid).min())
+        self.assertAlmostEqual(error, cv.score(params)[0])
+        self.assertTrue(((params >= 0) & (params <= 1)).all())
+
+    def test_fitting(self):
+        # If the model was trained with the fitted parameters
+        model = fitting(
+            self.series,
+            n_preds=3,
+            test_size=7,
+            slen=7,
+            verbose=False,
+            method="grid",
+        )
+        self.assertEqual(len(model.result), 203)
+        self.assertTrue(0 <= model.gamma <= 1)
+
+        with self.assertRaises(ValueError):
+            fitting(self.series, slen=7, method="newton")
+
+    def test_fit_holt_winters(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        store = HoltWintersParamsStore(temp_dir.name)
+        series = self.series.rename("temp_max")
+
+        with patch.object(temp, "params_store", store), patch.object(
+            temp, "minimize", wraps=temp.minimize
+        ) as minimize:
+            # If the fitted parameters were stored for the station
+            model = fit_holt_winters(series, station_id="A", slen=7)
+            self.assertEqual(minimize.call_count, 1)
+            self.assertListEqual(
+                store.get("A", "temp_max")["params"],
+                [model.alpha, model.beta, model.gamma],
+            )
+
+            # If the fresh parameters were used without the optimizer
+            stored_model = fit_holt_winters(series, station_id="A", slen=7)
+            self.assertEqual(minimize.call_count, 1)
+            np.testing.assert_array_equal(stored_model.result, model.result)
+
+            # If the stale parameters were the starting point of the optimizer
+            path = store._path("A", "temp_max")
+            record = {"params": [0.3, 0.1, 0.2], "fitted_on": "2000-01-01"}
+            path.write_text(json.dumps(record))
+            fit_holt_winters(series, station_id="A", slen=7)
+            self.assertListEqual(
+                minimize.call_args.kwargs["x0"], [0.3, 0.1, 0.2]
+            )
+            self.assertNotEqual(store.get("A", "temp_max"), record)
+
+
+class SARIMAForecastTestCase(SimpleTestCase):
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.store = SARIMAXStateStore(temp_dir.name)
+        patcher = patch.object(temp, "sarima_store", self.store)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        rng = np.random.default_rng(0)
+        dates = pd.date_range("2020-01-01", periods=127, freq="D")
+        days = np.arange(127)
+        self.y = pd.Series(
+            10 + 5 * np.sin(2 * np.pi * days / 7) + rng.normal(size=127),
+            index=dates,
+            name="temp_max",
+        )
+        self.exog = pd.DataFrame(
+            {"trend": days / 100, "constant": 1.0}, index=dates
+        )
+
+    def forecast(self, num_obs: int) -> pd.Series:
+        y_train, y_test = self.y[:num_obs], self.y[num_obs : num_obs + 7]
+        return forecast_sarima(
+            y_train,
+            self.exog[:num_obs],
+            y_test * np.nan,
+            self.exog[num_obs : num_obs + 7],
+            station_id="A",
+        )
+
+    def test_forecast_sarima(self):
+        with patch.object(
+            temp.sm.tsa.statespace.SARIMAX,
+            "fit",
+            autospec=True,
+            side_effect=temp.sm.tsa.statespace.SARIMAX.fit,
+        ) as fit:
+            forecast = self.forecast(100)
+            self.assertEqual(fit.call_count, 1)
+            meta, arrays = self.store.get("A", "temp_max")
+            self.assertEqual(meta["end_date"], "2020-04-09")
+
+            # If the same data was forecasted without fitting
+            np.testing.assert_allclose(self.forecast(100), forecast)
+
+            # If the new observations were filtered with the stored parameters
+            extended_forecast = self.forecast(120)
+            self.assertEqual(fit.call_count, 1)
+            expected = (
+                make_sarima(self.y[:120], self.exog[:120])
+                .filter(arrays["params"])
+                .predict(
+                    start=self.y.index[120],
+                    end=self.y.index[126],
+                    exog=self.exog[120:127],
+                )
+            )
+            np.testing.assert_allclose(extended_forecast, expected)
+            meta, _ = self.store.get("A", "temp_max")
+            self.assertEqual(meta["num_new_obs"], 20)
+
+            # If the model was fitted again after the drift
+            meta["new_abs_error"] = 100 * meta["baseline_error"] * 20
+            self.store.save("A", "temp_max", meta, **arrays)
+            self.forecast(120)
+            self.assertEqual(fit.call_count, 2)
+            meta, _ = self.store.get("A", "temp_max")
+            self.assertEqual(meta["num_new_obs"], 0)
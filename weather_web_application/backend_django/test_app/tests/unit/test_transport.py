@@ -0,0 +1,121 @@
+import io
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+import requests
+from django.test import SimpleTestCase
+
+from ...ml_part.transport import (
+    BaseTransport,
+    HTTPTransport,
+    RateLimiter,
+    get_transport,
+    set_transport,
+)
+
+
+def make_response(status_code, headers=None):
+    response = requests.Response()
+    response.status_code = status_code
+    response.headers.update(headers or {})
+    response.raw = io.BytesIO()
+    return response
+
+
+class HTTPTransportTestCase(SimpleTestCase):
+    def setUp(self):
+        self.transport = HTTPTransport(max_retries=2, backoff_factor=0.1)
+        self.sleep = mock.patch("time.sleep").start()
+        self.addCleanup(mock.patch.stopall)
+
+    def test_session(self):
+        # If compression is negotiated
+        self.assertIn("gzip", self.transport.session.headers["Accept-Encoding"])
+
+    def test_get(self):
+        # If the request was retried after temporary errors
+        with mock.patch.object(
+            self.transport.session,
+            "get",
+            side_effect=[
+                requests.ConnectionError(),
+                make_response(503),
+                make_response(200),
+            ],
+        ) as session_get:
+            response = self.transport.get("https://example.com")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(session_get.call_count, 3)
+        self.assertEqual(self.sleep.call_count, 2)
+        # If the timeout was passed to the session
+        self.assertEqual(
+            session_get.call_args.kwargs["timeout"], self.transport.timeout
+        )
+
+        # If the errors were raised after the last attempt
+        with mock.patch.object(
+            self.transport.session, "get", return_value=make_response(503)
+        ):
+            with self.assertRaises(requests.HTTPError):
+                self.transport.get("https://example.com")
+
+        # If client errors were not retried
+        with mock.patch.object(
+            self.transport.session, "get", return_value=make_response(404)
+        ) as session_get:
+            with self.assertRaises(requests.HTTPError):
+                self.transport.get("https://example.com")
+        self.assertEqual(session_get.call_count, 1)
+
+    def test_get_backoff(self):
+        # If the delay was within the bounds
+        for attempt in range(10):
+            backoff = self.transport.get_backoff(attempt)
+            self.assertGreaterEqual(backoff, 0)
+            self.assertLessEqual(backoff, self.transport.max_backoff)
+
+        # If 'Retry-After' header was used
+        response = make_response(429, {"Retry-After": "3"})
+        self.assertEqual(self.transport.get_backoff(0, response), 3)
+
+
+class SetTransportTestCase(SimpleTestCase):
+    def tearDown(self):
+        set_transport(None)
+
+    def test_set_transport(self):
+        # If the shared transport was replaced and restored
+        transport = BaseTransport()
+        set_transport(transport)
+        self.assertIs(get_transport(), transport)
+
+        set_transport(None)
+        self.assertIsInstance(get_transport(), HTTPTransport)
+
+    def test_shared_transport(self):
+        set_transport(None)
+        self.addCleanup(set_transport, None)
+        barrier = threading.Barrier(8)
+
+        def get_shared_transport(_):
+            barrier.wait()
+            return get_transport()
+
+        # If the threads that asked for the transport at once got the same one
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            transports = list(executor.map(get_shared_transport, range(8)))
+        self.assertEqual(len({id(transport) for transport in transports}), 1)
+
+
+class RateLimiterTestCase(SimpleTestCase):
+    def test_wait(self):
+        # If the requests were spread by the interval
+        rate_limiter = RateLimiter(requests_per_second=100)
+        start_time = time.monotonic()
+        for _ in range(5):
+            rate_limiter.wait()
+        self.assertGreaterEqual(
+            time.monotonic() - start_time, 4 * rate_limiter.interval
+        )
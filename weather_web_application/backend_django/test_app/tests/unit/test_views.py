@@ -3,10 +3,12 @@ from unittest import skip
 
 import pandas as pd
 from django.apps import apps
-from django.test import TestCase
+from django.test import SimpleTestCase, TestCase
 from django.urls import reverse
 
+from ...ml_part.catalog import catalog
 from ...models import City, Station
+from ...views import get_nearest_station_coords
 
 '''
 def change_managed_settings_just_for_tests():
@@ -28,6 +30,12 @@ class CityViewTest(TestCase):
     @classmethod
     def setUpTestData(cls):
         cls.url = reverse("search-for-city")
+        for name, country, lat, lng in [
+            ("Brest", "Belarus", 52.0976, 23.7341),
+            ("Brest", "France", 48.3904, -4.4861),
+            ("Minsk", "Belarus", 53.9, 27.5667),
+        ]:
+            City.objects.create(name=name, country=country, lat=lat, lng=lng)
 
     def test_city_name(self):
         request_data = [
@@ -37,6 +45,9 @@ class CityViewTest(TestCase):
             ({"city": "Brest"}, 202),
             # If one city was found with such a name
             ({"city": "Minsk"}, 200),
+            # If the case and extra spaces were ignored
+            ({"city": " MINSK "}, 200),
+            ({"city": "brest,  belarus"}, 200),
         ]
         for data, expected_status_code in request_data:
             resp = self.client.get(self.url, data=data)
@@ -58,6 +69,98 @@ class CityViewTest(TestCase):
         self.assertEqual(city_data["country"], "Belarus")
 
 
+class AutocompleteCityViewTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.url = reverse("autocomplete-city")
+        for name, country, lat, lng in [
+            ("Brest", "Belarus", 52.0976, 23.7341),
+            ("Brest", "France", 48.3904, -4.4861),
+            ("Bremen", "Germany", 53.0758, 8.8072),
+            ("São Paulo", "Brazil", -23.5504, -46.6339),
+        ]:
+            City.objects.create(name=name, country=country, lat=lat, lng=lng)
+
+    def setUp(self):
+        # The cities of the other tests must not stay in the catalog
+        catalog.invalidate()
+        self.addCleanup(catalog.invalidate)
+
+    def get_cities(self, data):
+        resp = self.client.get(self.url, data=data)
+        return [
+            (city["name"], city["country"]) for city in resp.json()["cityData"]
+        ]
+
+    def test_autocomplete_city(self):
+        request_data = [
+            # If the cities were found by a prefix in the order of the names
+            (
+                {"city": "bre"},
+                [
+                    ("Bremen", "Germany"),
+                    ("Brest", "Belarus"),
+                    ("Brest", "France"),
+                ],
+            ),
+            # If the country prefix was taken into account
+            ({"city": "Brest, fr"}, [("Brest", "France")]),
+            # If the number of cities was limited
+            ({"city": "bre", "limit": 1}, [("Bremen", "Germany")]),
+            # If the limit was clamped to at least one city
+            ({"city": "bre", "limit": 0}, [("Bremen", "Germany")]),
+            ({"city": "bre", "limit": -5}, [("Bremen", "Germany")]),
+            # If the accents were ignored
+            ({"city": "sao p"}, [("São Paulo", "Brazil")]),
+            # If nothing was found
+            ({"city": "x"}, []),
+            ({"city": ""}, []),
+        ]
+        for data, expected_cities in request_data:
+            self.assertListEqual(self.get_cities(data), expected_cities)
+
+    def test_bad_limit(self):
+        # If the limit that is not an integer was rejected
+        resp = self.client.get(self.url, data={"city": "bre", "limit": "abc"})
+        self.assertEqual(resp.status_code, 400)
+        self.assertEqual(resp.json()["cityData"], [])
+
+
+class NearestStationCoordsTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.station = Station.objects.create(name="A", lat=52.1, lng=23.7)
+        cls.stored_station = Station.objects.create(name="B", lat=50, lng=20)
+        cls.city = City.objects.create(
+            name="Brest",
+            country="Belarus",
+            lat=52.09,
+            lng=23.73,
+            nearest_station=cls.stored_station,
+        )
+
+    def setUp(self):
+        catalog.invalidate()
+        self.addCleanup(catalog.invalidate)
+
+    def test_get_nearest_station_coords(self):
+        stored_coords = (self.stored_station.lat, self.stored_station.lng)
+        # If the stored station of a known city was used
+        self.assertTupleEqual(
+            get_nearest_station_coords({"city_id": self.city.id}, 0, 0),
+            stored_coords,
+        )
+
+        # If the nearest station was searched without a valid city identifier
+        for params in [{}, {"city_id": "abc"}, {"city_id": self.city.id + 1}]:
+            self.assertTupleEqual(
+                get_nearest_station_coords(
+                    params, self.city.lat, self.city.lng
+                ),
+                (self.station.lat, self.station.lng),
+            )
+
+
 @skip("It lasts too long")
 class WeeklyForecastViewTest(TestCase):
     @classmethod
@@ -120,3 +223,30 @@ class WeeklyForecastViewTest(TestCase):
             .to_list()
         )
         self.assertListEqual(forecast["calendar_date"], calendar_dates)
+
+
+class MetricsViewTest(SimpleTestCase):
+    def test_metrics(self):
+        url = reverse("metrics")
+
+        # If the metrics were served to a local collector
+        resp = self.client.get(url)
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn(
+            b"# TYPE forecast_stage_duration_seconds histogram", resp.content
+        )
+        self.assertIn(b"forecasts_in_flight 0", resp.content)
+
+        # If the metrics were not served to remote hosts
+        resp = self.client.get(url, REMOTE_ADDR="10.0.0.1")
+        self.assertEqual(resp.status_code, 403)
+
+        # If the metrics were not served through a proxy on the same host
+        for header in ["HTTP_X_FORWARDED_FOR", "HTTP_FORWARDED"]:
+            resp = self.client.get(url, **{header: "203.0.113.5"})
+            self.assertEqual(resp.status_code, 403)
+
+        # If the metrics were served to an allowed network
+        with self.settings(METRICS_ALLOWED_IPS=["10.0.0.0/24"]):
+            resp = self.client.get(url, REMOTE_ADDR="10.0.0.1")
+        self.assertEqual(resp.status_code, 200)
@@ -1,12 +1,19 @@
 from django.urls import path
 from rest_framework.routers import DefaultRouter
-from test_app.views import check_city, get_weekly_forecast
+from test_app.views import (
+    autocomplete_city,
+    check_city,
+    get_metrics,
+    get_weekly_forecast,
+)
 
 router = DefaultRouter()
 
 urlpatterns = [
     path("check-city", check_city, name="search-for-city"),
+    path("autocomplete-city", autocomplete_city, name="autocomplete-city"),
     path("forecast", get_weekly_forecast, name="weekly-forecast"),
+    path("metrics", get_metrics, name="metrics"),
 ]
 
 urlpatterns += router.urls
@@ -1,81 +1,109 @@
 import io
+import ipaddress
 from datetime import timedelta
-from time import time
 
 import pandas as pd
-from django.http import HttpRequest, JsonResponse
-from haversine import haversine
+from django.conf import settings
+from django.http import HttpRequest, HttpResponse, JsonResponse
 from rest_framework import status, viewsets
 
-from .config.config import logger
+from .ml_part.catalog import catalog
 from .ml_part.data_workflow import ERA5Service, NOAACleaning, NOAAService
+from .ml_part.instrumentation import span
+from .ml_part.metrics import forecasts_in_flight, registry
 from .ml_part.precip import lstm
+from .ml_part.search import normalize
 from .ml_part.temp import sarima_and_es
-from .models import City, Station
+from .models import City
+from .profiling import profile_view
 from .serializers import CitySerializer
 
+CITY_FIELDS = ["id", "name", "country", "lat", "lng", "nearest_station_id"]
+MAX_AUTOCOMPLETE_LIMIT = 50
+
+
+def get_nearest_station_coords(
+    params, lat: float, lng: float
+) -> tuple[float, float]:
+    """Getting the coordinates of the nearest station. The station stored
+    for a known city (by 'city_id') is used, and it is searched in the
+    spatial index otherwise"""
+    try:
+        city_id = int(params.get("city_id"))
+    except (TypeError, ValueError):  # There is no or a malformed identifier
+        city_id = None
+    if city_id is not None:
+        city = (
+            City.objects.select_related("nearest_station")
+            .filter(id=city_id, nearest_station__isnull=False)
+            .first()
+        )
+        if city is not None:
+            return (city.nearest_station.lat, city.nearest_station.lng)
+
+    nearest_station_ind = catalog.station_index.query((lat, lng))[0][0]
+    return (
+        float(catalog.stations.lat[nearest_station_ind]),
+        float(catalog.stations.lng[nearest_station_ind]),
+    )
+
 
+@profile_view
 def get_weekly_forecast(request: HttpRequest) -> JsonResponse:
     params = request.GET
     lat, lng = float(params.get("lat")), float(params.get("lng"))
     start_date = "2015-01-01"
 
-    logger.info("=" * 10 + " DATA COLLECTION " + "=" * 10)
-    # Not specify start date here because there may not be the data after this
-    # date and we will get an empty dataset
-    noaa_initial_df = NOAAService(
-        (lat, lng),
-        data_types=["TMAX", "TMIN"],
-        start_date=start_date,
-        num_nearby_stations=10,
-    ).get_noaa_data()
-
-    logger.info("\n" + "=" * 10 + " DATA CLEANING " + "=" * 10)
-    # Since we make prediction also for today,
-    # we take the data without today's day
-    noaa_cleaned_df = NOAACleaning(noaa_initial_df).get_cleaned_data().iloc[:-1]
-
-    logger.info("\n\n" + "=" * 10 + " TEMPERATURE PREDICTION " + "=" * 10)
-    start_time = time()
-    temp_max_fc = sarima_and_es(noaa_cleaned_df["temp_max"])
-    temp_min_fc = sarima_and_es(noaa_cleaned_df["temp_min"])
-    end_time = time()
-    logger.info(f"Total time: {end_time - start_time}")
-
-    logger.info("=" * 10 + " DATA COLLECTION " + "=" * 10)
-    stations = pd.DataFrame(
-        Station.objects.values(),
-        columns=[field.name for field in Station._meta.get_fields()],
-    )
-    stations["coords"] = tuple(zip(stations["lat"], stations["lng"]))
-    stations["dist"] = stations["coords"].map(
-        lambda x: haversine([lat, lng], x)
-    )
-    nearest_station = stations.loc[stations["dist"].idxmin()]
-    era_data_types = [
-        "temperature_2m_max",
-        "temperature_2m_min",
-        "precipitation_sum",
-        "windspeed_10m",
-        "winddirection_10m_dominant",
-        "pressure_msl",
-        "relativehumidity_2m",
-    ]
-    era_df = (
-        ERA5Service(
-            nearest_station["coords"],
-            data_types=era_data_types,
+    with forecasts_in_flight.track_inprogress(), span(
+        "forecast", lat=lat, lng=lng, city_id=params.get("city_id")
+    ):
+        # Not specify start date here because there may not be the data after
+        # this date and we will get an empty dataset
+        noaa_initial_df = NOAAService(
+            (lat, lng),
+            data_types=["TMAX", "TMIN"],
             start_date=start_date,
+            num_nearby_stations=10,
+        ).get_noaa_data()
+
+        # Since we make prediction also for today,
+        # we take the data without today's day
+        noaa_cleaned_df = (
+            NOAACleaning(noaa_initial_df).get_cleaned_data().iloc[:-1]
         )
-        .get_era_data()
-        .iloc[:-1]
-    )
 
-    logger.info("\n" + "=" * 10 + " PRECIPITATION " + "=" * 10)
-    start_time = time()
-    precip_fc = lstm(era_df)
-    end_time = time()
-    logger.info(f"Total time: {end_time - start_time}")
+        with span("temperature"):
+            # The stations are ordered by the distance to the location
+            station_id = str(noaa_initial_df["STATION"].iloc[0])
+            temp_max_fc = sarima_and_es(
+                noaa_cleaned_df["temp_max"], station_id=station_id
+            )
+            temp_min_fc = sarima_and_es(
+                noaa_cleaned_df["temp_min"], station_id=station_id
+            )
+
+        nearest_station_coords = get_nearest_station_coords(params, lat, lng)
+        era_data_types = [
+            "temperature_2m_max",
+            "temperature_2m_min",
+            "precipitation_sum",
+            "windspeed_10m",
+            "winddirection_10m_dominant",
+            "pressure_msl",
+            "relativehumidity_2m",
+        ]
+        era_df = (
+            ERA5Service(
+                nearest_station_coords,
+                data_types=era_data_types,
+                start_date=start_date,
+            )
+            .get_era_data()
+            .iloc[:-1]
+        )
+
+        with span("precipitation"):
+            precip_fc = lstm(era_df)
 
     forecast = {
         "max_temperature": temp_max_fc,
@@ -92,6 +120,33 @@ def get_weekly_forecast(request: HttpRequest) -> JsonResponse:
     return JsonResponse(forecast)
 
 
+def autocomplete_city(request: HttpRequest) -> JsonResponse:
+    params = request.GET
+    data = {"status": status.HTTP_200_OK.numerator, "cityData": []}
+
+    # 'City, country' is searched by the whole name and the country prefix
+    query = [normalize(s) for s in params.get("city", "").split(",", 1)]
+    if not query[0]:
+        return JsonResponse(data, status=status.HTTP_200_OK)
+    try:
+        limit = int(params.get("limit", 10))
+    except ValueError:
+        data["status"] = status.HTTP_400_BAD_REQUEST.numerator
+        data["message"] = "The limit must be an integer."
+        return JsonResponse(data, status=status.HTTP_400_BAD_REQUEST)
+    limit = min(max(limit, 1), MAX_AUTOCOMPLETE_LIMIT)
+    rows = catalog.city_search_index.search(
+        catalog.CITY_KEY_SEP.join(query), limit
+    )
+
+    cities = catalog.cities
+    data["cityData"] = cities.iloc[rows][
+        [field for field in CITY_FIELDS if field in cities.columns]
+    ].to_dict("records")
+    return JsonResponse(data, status=status.HTTP_200_OK)
+
+
+@profile_view
 def check_city(request: HttpRequest) -> JsonResponse:
     params = request.GET
     data = {"status": 0, "message": ""}
@@ -102,15 +157,15 @@ def check_city(request: HttpRequest) -> JsonResponse:
         if "," in city:
             city, country = [s.strip() for s in city.split(",")]
             found_cities = City.objects.filter(
-                name__iexact=city, country__iexact=country
+                search_name=normalize(city), search_country=normalize(country)
             )
             if len(found_cities):
                 flag = True
 
         if not flag:
-            found_cities = City.objects.filter(name__iexact=city)
+            found_cities = City.objects.filter(search_name=normalize(city))
 
-        found_cities = list(found_cities.values())
+        found_cities = list(found_cities.values(*CITY_FIELDS))
         if len(found_cities) == 0:
             data["status"] = status.HTTP_404_NOT_FOUND.numerator
             data["message"] = (
@@ -129,33 +184,59 @@ def check_city(request: HttpRequest) -> JsonResponse:
 
     else:
         lat, lng = float(params.get("lat")), float(params.get("lng"))
-        cities = pd.DataFrame(
-            City.objects.values(),
-            columns=[field.name for field in City._meta.get_fields()],
-        )
-        cities["coords"] = tuple(zip(cities["lat"], cities["lng"]))
-        cities["dist"] = cities["coords"].map(
-            lambda x: haversine([lat, lng], x)
-        )
-        nearest_city = cities.loc[cities["dist"].idxmin()]
+        # The cities are looked up with the index on coordinates, and only
+        # the nearest ones are compared with each other
+        nearest = City.objects.nearest(lat, lng)
+        if nearest is None:
+            data["status"] = status.HTTP_404_NOT_FOUND.numerator
+            data["message"] = "There are no cities in the database."
+            return JsonResponse(data, status=status.HTTP_200_OK)
+        nearest_city, dist = nearest
 
         data["status"] = status.HTTP_200_OK.numerator
         city_data = {
-            "name": nearest_city["name"],
-            "country": nearest_city["country"],
-            "distance": nearest_city["dist"],
+            "name": nearest_city.name,
+            "country": nearest_city.country,
+            "distance": dist,
         }
-        if nearest_city["dist"] < 10:
+        if dist < 10:
             data["message"] = (
-                "The city by coordinates: '{name}' in {county}"
+                "The city by coordinates: '{name}' in {country}"
             ).format_map(city_data)
         else:
             data["message"] = (
                 "The nearest {name} city in {country} is located "
                 + "{distance:.1f}км from the specified coordinates. Continue?"
             ).format_map(city_data)
-        data["cityData"] = CitySerializer(
-            City.objects.get(id=cities["dist"].idxmin())
-        ).data
+        data["cityData"] = CitySerializer(nearest_city).data
 
     return JsonResponse(data, status=status.HTTP_200_OK)
+
+
+def is_metrics_collector(request: HttpRequest) -> bool:
+    """Checking if the request comes directly from an allowed address. The
+    proxied requests are refused, since a proxy on the same host makes every
+    request come from the loopback address."""
+    if (
+        "HTTP_X_FORWARDED_FOR" in request.META
+        or "HTTP_FORWARDED" in request.META
+    ):
+        return False
+    try:
+        remote_addr = ipaddress.ip_address(request.META.get("REMOTE_ADDR", ""))
+    except ValueError:
+        return False
+    return any(
+        remote_addr in ipaddress.ip_network(network, strict=False)
+        for network in settings.METRICS_ALLOWED_IPS
+    )
+
+
+def get_metrics(request: HttpRequest) -> HttpResponse:
+    # The metrics are served only to the collectors (see
+    # METRICS_ALLOWED_IPS in the settings)
+    if not is_metrics_collector(request):
+        return HttpResponse(status=status.HTTP_403_FORBIDDEN)
+    return HttpResponse(
+        registry.render(), content_type="text/plain; version=0.0.4"
+    )
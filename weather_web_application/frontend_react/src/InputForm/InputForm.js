@@ -25,19 +25,23 @@ function InputForm() {
   const navigate = useNavigate()
   const baseURL = 'http://localhost:8000/api'
 
-  const [cities, setCities] = useState([
-    // example demo 
-    {city: 'Brest', country: 'Belarus'},  
-    {city: 'Brest', country: 'France'}, 
-  ])
+  const [cities, setCities] = useState([])
 
   useEffect(() => {
+    if (city.trim().length <= 2) { return }
+    // The suggestions are searched by the server while typing. The answers
+    // for the previous input are ignored if they come later.
+    let ignore = false
     const fetchCityData = async () => {
-      const resCities = await axios(`${baseURL}/city`);
-      setCities(resCities.data)
-    } 
+      const url_params = new URLSearchParams({city: city})
+      const resCities = await axios(
+        `${baseURL}/autocomplete-city?${url_params}`
+      );
+      if (!ignore) { setCities(resCities.data.cityData) }
+    }
     fetchCityData()
-  }, []); // [] - This will run only once
+    return () => { ignore = true }
+  }, [city]);
 
 
   const handleChangeCoords = event => {
@@ -237,16 +241,10 @@ function InputForm() {
           />
           <datalist id="cities">
             { city.length > 2 && 
-              cities.map(({name, country}, index) => {
-                if ((name + country).toLowerCase().startsWith(
-                  city.toLowerCase().replace(/[^a-z]+/g, '')
-                ) && (
-                  (name + country).toLowerCase() !== city.toLowerCase().replace(
-                    /[^a-z]+/g, ''
-                    )
-                )
-                ) { 
-                  return <option key={index} value={name + ', ' + country}/> 
+              cities.map(({id, name, country}) => {
+                const value = name + ', ' + country
+                if (value.toLowerCase() !== city.trim().toLowerCase()) { 
+                  return <option key={id} value={value}/> 
                 }
               })
             }
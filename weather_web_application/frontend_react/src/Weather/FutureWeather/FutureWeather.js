@@ -19,7 +19,7 @@ function FutureWeather({ cityData }) {
     async function getWeeklyForecast() {
       try {
         const urlParams = new URLSearchParams({
-          lat: cityData.lat, lng: cityData.lng
+          lat: cityData.lat, lng: cityData.lng, city_id: cityData.id
         })
         var resTempForecast = await axios.get(
           `${baseURL}/forecast?${urlParams}`
@@ -32,7 +32,7 @@ function FutureWeather({ cityData }) {
       }
     }
     getWeeklyForecast()
-  }, [cityData.lat, cityData.lng])
+  }, [cityData.id, cityData.lat, cityData.lng])
 
   return (
     <> {isLoading ?